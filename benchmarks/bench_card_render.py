@@ -0,0 +1,132 @@
+""" Times rendering the Machines page card list on synthetic tailnets of growing size
+
+Render time per card should stay flat as the tailnet grows, showing the card list
+(machines_cards.html and the macros in macros.html) renders in linear time.  "cold"
+renders every card, "warm" is a second page view served from the fragment cache.
+
+"baseline" renders the same cards the way they were before the macros:  one
+render_template of machines_card.html per card, with the routes, tags, IPs and badges
+assembled by string concatenation in renderer.thread_machine_content.  That renderer and
+template are read from git, from --baseline (default:  the parent of the commit that
+added templates/macros.html).  Outside a git checkout the baseline is skipped.
+
+Usage:  python benchmarks/bench_card_render.py [machines ...] [--baseline REV]
+"""
+# pylint: disable=wrong-import-position
+
+import os, sys, argparse, importlib.util, random, subprocess, tempfile, timeit
+from datetime import datetime, timedelta, timezone
+
+REPO = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, REPO)
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("TZ",        "America/New_York")
+os.environ.setdefault("HS_SERVER", "http://localhost")
+
+import renderer, timeutil, cache
+
+def synthetic_tailnet(count, users=50):
+    now      = datetime.now(timezone.utc)
+    stamp    = lambda delta: (now + delta).strftime('%Y-%m-%dT%H:%M:%S.%f')+"123Z"
+    machines = []
+    routes   = {}
+    for machine_id in range(1, count+1):
+        user_id = random.randint(1, users)
+        machines.append({
+            "id"                  : str(machine_id),
+            "givenName"           : "machine-"+str(machine_id),
+            "name"                : "host-"+str(machine_id),
+            "user"                : {"id": str(user_id), "name": "user-"+str(user_id), "createdAt": stamp(-timedelta(days=900))},
+            "ipAddresses"         : ["100.64.%i.%i" % (machine_id // 250, machine_id % 250), "fd7a:115c:a1e0::%x" % machine_id],
+            "lastSeen"            : stamp(-timedelta(seconds=random.randint(0, 86400*30))),
+            "lastSuccessfulUpdate": stamp(-timedelta(seconds=random.randint(0, 86400*30))),
+            "createdAt"           : stamp(-timedelta(days=random.randint(1, 900))),
+            "expiry"              : stamp( timedelta(days=random.randint(1, 200))) if machine_id % 3 else "0001-01-01T00:00:00Z",
+            "preAuthKey"          : {"key": "%048x" % machine_id} if machine_id % 2 else None,
+            "forcedTags"          : ["tag:server", "tag:group-"+str(user_id)],
+        })
+        # One machine in ten is a subnet router, one in fifty an exit node:
+        if machine_id % 10 == 0:
+            prefixes = ["10.%i.0.0/16" % (machine_id % 250)] + (["0.0.0.0/0", "::/0"] if machine_id % 50 == 0 else [])
+            routes[str(machine_id)] = {"routes": [
+                {"id": str(machine_id*10+index), "prefix": prefix, "advertised": True, "enabled": bool(index % 2),
+                 "machine": {"id": str(machine_id), "name": "host-"+str(machine_id)}}
+                for index, prefix in enumerate(prefixes)
+            ]}
+    return machines, routes
+
+def render_cards(machines, routes):
+    # What stream_machines_cards does, minus the network:  one context, one template for the whole list
+    context    = timeutil.RenderContext()
+    no_routes  = {"routes": []}
+    card_macro = renderer.macros().machine_card
+    cards      = (renderer.render_machine_card(machine, routes.get(machine["id"], no_routes), context, card_macro) for machine in machines)
+    return "".join(renderer.app.jinja_env.get_template("machines_cards.html").generate(cards=cards))
+
+##################################################################
+# The renderer before the macros
+##################################################################
+def git(*args):
+    return subprocess.run(["git", *args], cwd=REPO, capture_output=True, check=True).stdout
+
+def baseline_revision():
+    added = git("log", "--diff-filter=A", "--format=%H", "--", "templates/macros.html").decode().split()
+    if not added: raise ValueError("templates/macros.html isn't in the history")
+    return added[-1]+"^"
+
+def load_baseline(revision):
+    """ Imports renderer.py and templates/machines_card.html as of "revision".  Returns the module. """
+    directory = tempfile.mkdtemp(prefix="bench-card-baseline-")
+    os.makedirs(os.path.join(directory, "templates"))
+    for path in ("renderer.py", "templates/machines_card.html"):
+        with open(os.path.join(directory, path), "wb") as source_file: source_file.write(git("show", revision+":"+path))
+    # Registered before it runs so its Flask app finds the templates next to it
+    spec   = importlib.util.spec_from_file_location("baseline_renderer", os.path.join(directory, "renderer.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+def render_cards_baseline(baseline, machines, routes):
+    # What the old stream_machines_cards did with LOG_LEVEL=DEBUG:  every card in this thread, in order
+    context   = timeutil.RenderContext()
+    no_routes = {"routes": []}
+    content   = {}
+    html      = ["<div class='u-flex u-justify-space-evenly u-flex-wrap u-gap-1'>"]
+    for idx, machine in enumerate(machines):
+        baseline.thread_machine_content(machine, content, idx, routes.get(machine["id"], no_routes), context)
+        html.append(content.pop(idx))
+    html.append("</div>")
+    return "".join(html)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time rendering the Machines page card list")
+    parser.add_argument("machines", type=int, nargs="*", default=[500, 1000, 2000, 5000])
+    parser.add_argument("--baseline", help="git revision of the renderer to compare against")
+    args = parser.parse_args()
+
+    try:
+        revision = args.baseline or baseline_revision()
+        baseline = load_baseline(revision)
+        print("Baseline:  renderer.py at "+git("rev-parse", "--short", revision).decode().strip())
+    except (OSError, ValueError, subprocess.CalledProcessError) as error:
+        print("No baseline:  "+(error.stderr.decode().strip() if isinstance(error, subprocess.CalledProcessError) else str(error)))
+        baseline = None
+
+    cache.fragments.max_entries = max(args.machines)
+    print(f"{'machines':>10} {'baseline ms':>12} {'us/card':>10} {'cold ms':>10} {'us/card':>10} {'warm ms':>10} {'us/card':>10} {'KB':>10}")
+    for count in args.machines:
+        machines, routes = synthetic_tailnet(count)
+        old = float("nan")
+        if baseline is not None:
+            with baseline.app.app_context():
+                old = min(timeit.repeat(lambda: render_cards_baseline(baseline, machines, routes), number=1, repeat=3))
+        with renderer.app.app_context():
+            html = render_cards(machines, routes)
+            cold = min(timeit.repeat(lambda: (cache.fragments.clear(), render_cards(machines, routes)), number=1, repeat=3))
+            warm = min(timeit.repeat(lambda: render_cards(machines, routes), number=1, repeat=3))
+        print(f"{count:>10} {old*1e3:>12.1f} {old/count*1e6:>10.1f} {cold*1e3:>10.1f} {cold/count*1e6:>10.1f} "
+              f"{warm*1e3:>10.1f} {warm/count*1e6:>10.1f} {len(html)/1024:>10.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+""" Times the timestamp work done for one machine card, before and after timeutil.RenderContext
+
+Usage:  python benchmarks/bench_card_times.py [machines]
+"""
+# pylint: disable=wrong-import-position
+
+import os, sys, random, time, timeit
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("TZ",        "America/New_York")
+os.environ.setdefault("HS_SERVER", "http://localhost")
+# The legacy path localizes the naive datetime.now(), so the process clock must be in $TZ:
+time.tzset()
+
+import pytz, helper, timeutil
+from dateutil import parser
+
+def synthetic_machines(count):
+    now      = datetime.now(timezone.utc)
+    stamp    = lambda delta: (now + delta).strftime('%Y-%m-%dT%H:%M:%S.%f')+"123Z"
+    machines = []
+    for _ in range(count):
+        machines.append({
+            "lastSeen"            : stamp(-timedelta(seconds=random.randint(0, 86400*30))),
+            "lastSuccessfulUpdate": stamp(-timedelta(seconds=random.randint(0, 86400*30))),
+            "createdAt"           : stamp(-timedelta(days=random.randint(1, 900))),
+            "expiry"              : stamp( timedelta(days=random.randint(1, 200))),
+        })
+    return machines
+
+def legacy_card(machine):
+    # The per-card time handling thread_machine_content used before timeutil
+    timezone_   = pytz.timezone(os.environ["TZ"] if os.environ["TZ"] else "UTC")
+    local_time  = timezone_.localize(datetime.now())
+    out = []
+    for field in ("lastSeen", "lastSuccessfulUpdate", "createdAt"):
+        local = parser.parse(machine[field]).astimezone(timezone_)
+        delta = local_time - local
+        out.append(str(local.strftime('%A %m/%d/%Y, %H:%M:%S'))+" "+str(timezone_)+" ("+str(helper.pretty_print_duration(delta))+")")
+    local = parser.parse(machine["expiry"]).astimezone(timezone_)
+    delta = local - local_time
+    out.append(str(local.strftime('%A %m/%d/%Y, %H:%M:%S'))+" "+str(timezone_)+" ("+str(helper.pretty_print_duration(delta, "expiry"))+")")
+    return out
+
+def context_cards(machines):
+    # One RenderContext per request, shared by every card
+    context = timeutil.RenderContext()
+    return [context_card(machine, context) for machine in machines]
+
+def context_card(machine, context):
+    out = [formatted.text for formatted in context.since_many(machine["lastSeen"], machine["lastSuccessfulUpdate"], machine["createdAt"])]
+    out.append(context.until(machine["expiry"]).text)
+    return out
+
+def main():
+    count    = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    machines = synthetic_machines(count)
+    context  = timeutil.RenderContext()
+    # Both paths must produce the same text:
+    assert [legacy_card(m) for m in machines[:50]] == [context_card(m, context) for m in machines[:50]]
+
+    before = min(timeit.repeat(lambda: [legacy_card(m) for m in machines],    number=1, repeat=5))
+    after  = min(timeit.repeat(lambda: context_cards(machines),                number=1, repeat=5))
+    print(f"machines:       {count}")
+    print(f"before:         {before/count*1e6:8.1f} us/card")
+    print(f"after:          {after /count*1e6:8.1f} us/card")
+    print(f"speedup:        {before/after:8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,40 @@
+""" Times the address index on synthetic tailnets of growing size
+
+Reports building the radix trees from every machine address and advertised route, the
+average longest-prefix lookup, and the route overlap report.
+
+Usage:  python benchmarks/bench_iptree.py [machines ...]
+"""
+# pylint: disable=wrong-import-position
+
+import os, sys, random, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("TZ",        "America/New_York")
+os.environ.setdefault("HS_SERVER", "http://localhost")
+
+import iptree
+from bench_card_render import synthetic_tailnet
+
+def route_list(routes):
+    # /api/v1/routes embeds each route's machine
+    return [dict(route, machine={"id": machine_id}) for machine_id, machine_routes in routes.items() for route in machine_routes["routes"]]
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or [1000, 10000, 50000]
+    print(f"{'machines':>10} {'routes':>10} {'build ms':>10} {'lookup us':>10} {'overlaps ms':>12}")
+    for count in counts:
+        machines, routes = synthetic_tailnet(count)
+        routes  = route_list(routes)
+        build   = min(timeit.repeat(lambda: iptree.AddressIndex(machines, routes), number=1, repeat=3))
+        index   = iptree.AddressIndex(machines, routes)
+
+        # Half the lookups hit a machine address, half an address behind a subnet router:
+        queries = [random.choice(machines)["ipAddresses"][0] for _ in range(500)] + ["10.%i.%i.%i" % (random.randint(0, 249), random.randint(0, 255), random.randint(1, 254)) for _ in range(500)]
+        lookup  = min(timeit.repeat(lambda: [index.lookup(query) for query in queries], number=1, repeat=3)) / len(queries)
+        overlap = min(timeit.repeat(index.overlaps, number=1, repeat=3))
+        print(f"{count:>10} {len(routes):>10} {build*1e3:>10.1f} {lookup*1e6:>10.1f} {overlap*1e3:>12.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+""" Times the web UI's pages and JSON endpoints end to end against a mock Headscale
+
+For each tailnet size, starts benchmarks/mock_headscale.py on a local port, loads the web
+UI in this process pointed at it, and requests every entry in PAGES:  once "cold", with
+the response and card caches emptied, then --repeat times "warm".  Each result has the
+time to the first byte and to the last, the response size, and how many requests reached
+Headscale.  The results are printed and saved as JSON.  --compare prints each warm median
+against a previous report.
+
+The web UI's key file and Headscale config are written to a temporary directory, and the
+/data and /etc/headscale health checks are skipped.
+
+Usage:  python benchmarks/bench_pages.py [--machines 1000 10000] [--latency 20] [--repeat 5] [--output report.json] [--compare old.json]
+"""
+# pylint: disable=wrong-import-position
+
+import os, sys, argparse, json, statistics, subprocess, tempfile, time
+from datetime import datetime, timezone
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCHMARKS, ".."))
+from cryptography.fernet import Fernet
+os.environ.setdefault("LOG_LEVEL",   "ERROR")
+os.environ.setdefault("TZ",          "UTC")
+os.environ.setdefault("KEY",         Fernet.generate_key().decode())
+os.environ.setdefault("COLOR",       "blue-grey")
+os.environ.setdefault("AUTH_TYPE",   "")
+for name in ("APP_VERSION", "GIT_BRANCH", "GIT_COMMIT", "BUILD_DATE", "HS_VERSION"): os.environ.setdefault(name, "benchmark")
+
+import mock_headscale
+
+# (name, method, path, JSON body)
+PAGES = [
+    ("overview",            "GET",  "/overview",                 None),
+    ("machines",            "GET",  "/machines",                 None),
+    ("machines_table_view", "GET",  "/machines?view=table",      None),
+    ("users",               "GET",  "/users",                    None),
+    ("api_v1_machines",     "GET",  "/api/v1/machines",          None),
+    ("api_v1_users",        "GET",  "/api/v1/users",             None),
+    ("api_machines_table",  "POST", "/api/machines_table",       {"offset": 0, "limit": 100, "sort": "name", "order": "asc"}),
+    ("api_search",          "GET",  "/api/search?q=machine-12",  None),
+    ("api_ip_lookup",       "GET",  "/api/ip_lookup?q=10.0.5.9", None),
+    ("api_route_overlaps",  "GET",  "/api/route_overlaps",       None),
+    ("api_machine_info",    "GET",  "/api/machine_information?id=10", None),
+]
+
+CONFIG_YAML = """server_url: http://127.0.0.1:8080
+ip_prefixes: [100.64.0.0/10, fd7a:115c:a1e0::/48]
+dns_config:
+  base_domain: example.com
+"""
+
+def prepare(directory):
+    """ Writes the web UI's key file, holding the mock's API key, and a Headscale config to "directory" """
+    import headscale
+    headscale.KEY_FILE = os.path.join(directory, "key.txt")
+    headscale.set_api_key(mock_headscale.API_KEY)
+    with open(os.path.join(directory, "config.yaml"), "w", encoding="utf-8") as config_file: config_file.write(CONFIG_YAML)
+
+def create_app(directory=None):
+    """ Imports the web UI, reading the files prepare() wrote to "directory" (default $BENCH_WEB_UI_DIR).
+        benchmarks/loadtest.py runs it under gunicorn as "bench_pages:create_app()". """
+    directory = directory or os.environ["BENCH_WEB_UI_DIR"]
+    # Set up before server is imported, as it starts the background key check
+    import headscale, helper, config
+    headscale.KEY_FILE  = os.path.join(directory, "key.txt")
+    config.CONFIG_PATHS = (os.path.join(directory, "config.yaml"),)
+    # /data and /etc/headscale don't exist outside the container
+    helper.get_health_status = lambda: {"passed": True}
+    import server
+    return server.app
+
+def clear_caches():
+    import cache
+    cache.responses.clear()
+    cache.fragments.clear()
+
+def fetch(client, mock, method, path, body):
+    """ Returns (status, seconds to first byte, seconds to last byte, bytes, Headscale requests) """
+    mock.take_stats(reset=True)
+    started  = time.perf_counter()
+    response = client.open(path, method=method, json=body, buffered=False)
+    first    = None
+    size     = 0
+    for chunk in response.response:
+        if first is None and chunk: first = time.perf_counter()
+        size += len(chunk)
+    response.close()
+    finished = time.perf_counter()
+    return response.status_code, (first or finished) - started, finished - started, size, sum(mock.take_stats().values())
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BENCHMARKS, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    client  = None
+    results = []
+    for count in args.machines:
+        tailnet = mock_headscale.Tailnet(count, args.users, args.keys)
+        mock    = mock_headscale.serve(tailnet, latency=args.latency, jitter=args.jitter)
+        os.environ["HS_SERVER"] = mock.url
+        if client is None:
+            directory = tempfile.mkdtemp(prefix="bench-pages-")
+            prepare(directory)
+            client = create_app(directory).test_client()
+        for name, method, path, body in PAGES:
+            clear_caches()
+            status, cold_first, cold, size, cold_upstream = fetch(client, mock, method, path, body)
+            warm     = [fetch(client, mock, method, path, body) for _ in range(args.repeat)]
+            totals   = [result[2] for result in warm]
+            results.append({
+                "machines"        : count,
+                "page"            : name,
+                "path"            : path,
+                "status"          : status,
+                "bytes"           : size,
+                "cold_ms"         : round(cold*1e3, 2),
+                "cold_first_ms"   : round(cold_first*1e3, 2),
+                "cold_upstream"   : cold_upstream,
+                "warm_median_ms"  : round(statistics.median(totals)*1e3, 2),
+                "warm_p95_ms"     : round(percentile(totals, 0.95)*1e3, 2),
+                "warm_first_ms"   : round(statistics.median(result[1] for result in warm)*1e3, 2),
+                "warm_upstream"   : statistics.median(result[4] for result in warm),
+            })
+            print_result(results[-1])
+        mock.shutdown()
+        mock.server_close()
+    return results
+
+def print_header():
+    print(f"{'machines':>9} {'page':<20} {'status':>6} {'KB':>8} {'cold ms':>9} {'1st byte':>9} {'upstream':>8} {'warm ms':>9} {'p95 ms':>9} {'upstream':>8}")
+
+def print_result(result):
+    print(f"{result['machines']:>9} {result['page']:<20} {result['status']:>6} {result['bytes']/1024:>8.0f} {result['cold_ms']:>9.1f} {result['cold_first_ms']:>9.1f} "
+          f"{result['cold_upstream']:>8} {result['warm_median_ms']:>9.1f} {result['warm_p95_ms']:>9.1f} {result['warm_upstream']:>8g}")
+
+def compare(results, path):
+    with open(path, encoding="utf-8") as report_file: previous = json.load(report_file)
+    before = {(result["machines"], result["page"]): result for result in previous["results"]}
+    print(f"\nAgainst {path} ({previous.get('commit')}):")
+    print(f"{'machines':>9} {'page':<20} {'before ms':>10} {'after ms':>10} {'change':>8}")
+    for result in results:
+        old = before.get((result["machines"], result["page"]))
+        if old is None: continue
+        change = (result["warm_median_ms"] / old["warm_median_ms"] - 1) * 100 if old["warm_median_ms"] else 0.0
+        print(f"{result['machines']:>9} {result['page']:<20} {old['warm_median_ms']:>10.1f} {result['warm_median_ms']:>10.1f} {change:>+7.0f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the web UI's pages against a mock Headscale")
+    parser.add_argument("--machines", type=int, nargs="+", default=[1000, 10000])
+    parser.add_argument("--users",    type=int,   default=50)
+    parser.add_argument("--keys",     type=int,   default=3,  help="PreAuth keys per user")
+    parser.add_argument("--latency",  type=float, default=0,  help="ms added to every Headscale response")
+    parser.add_argument("--jitter",   type=float, default=0,  help="up to this many ms more, at random")
+    parser.add_argument("--repeat",   type=int,   default=5,  help="warm requests per page")
+    parser.add_argument("--output",   default="bench_pages.json")
+    parser.add_argument("--compare",  help="a previous report to compare against")
+    args = parser.parse_args()
+
+    print_header()
+    results = run(args)
+    report  = {
+        "created" : datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit"  : git_commit(),
+        "settings": {"users": args.users, "keys": args.keys, "latency_ms": args.latency, "jitter_ms": args.jitter, "repeat": args.repeat},
+        "results" : results,
+    }
+    with open(args.output, "w", encoding="utf-8") as report_file: json.dump(report, report_file, indent=2)
+    print("\nReport written to "+args.output)
+    if args.compare: compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+""" Times the machine search index on synthetic tailnets of growing size
+
+Reports the first build of the index, a refresh after 1% of the machines changed, and
+the average time of a few typical queries against the built index.
+
+Usage:  python benchmarks/bench_search.py [machines ...]
+"""
+# pylint: disable=wrong-import-position
+
+import os, sys, copy, timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+os.environ.setdefault("LOG_LEVEL", "ERROR")
+os.environ.setdefault("TZ",        "America/New_York")
+os.environ.setdefault("HS_SERVER", "http://localhost")
+
+import search
+from bench_card_render import synthetic_tailnet
+
+QUERIES = ["machine-42", "user-7", "100.64.3", "server group-12", "10.20.0.0/16", "host"]
+
+def route_list(routes):
+    # /api/v1/routes embeds each route's machine
+    return [dict(route, machine={"id": machine_id}) for machine_id, machine_routes in routes.items() for route in machine_routes["routes"]]
+
+def main():
+    counts = [int(count) for count in sys.argv[1:]] or [1000, 10000, 50000]
+    print(f"{'machines':>10} {'build ms':>10} {'update ms':>10} {'query ms':>10} {'tokens':>10}")
+    for count in counts:
+        machines, routes = synthetic_tailnet(count)
+        routes = route_list(routes)
+
+        index = search.SearchIndex()
+        build = timeit.timeit(lambda: index.refresh(machines, routes), number=1)
+
+        # A new machine list where one machine in a hundred was renamed:
+        changed = copy.deepcopy(machines)
+        for machine in changed[::100]: machine["givenName"] += "-renamed"
+        update = timeit.timeit(lambda: index.refresh(changed, routes), number=1)
+
+        query = min(timeit.repeat(lambda: [index.search(changed, routes, query) for query in QUERIES], number=10, repeat=3)) / 10 / len(QUERIES)
+        print(f"{count:>10} {build*1e3:>10.1f} {update*1e3:>10.1f} {query*1e3:>10.3f} {len(index.postings):>10}")
+
+if __name__ == "__main__":
+    main()
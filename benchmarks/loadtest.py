@@ -0,0 +1,231 @@
+""" Load tests the web UI under gunicorn with simulated operators
+
+Serves a synthetic tailnet from benchmarks/mock_headscale.py, then for each --workers and
+--threads combination starts gunicorn on the web UI (as benchmarks/bench_pages.py sets it
+up) and runs each scenario in SCENARIOS for --duration seconds.  --operators threads each
+follow the scenario's click path over and over, pausing up to twice --think seconds
+between clicks like a person reading the page.
+
+Reported per scenario:  requests/s, p50/p95/p99 latency, errors, and upstream
+amplification:  requests that reached Headscale for each request the web UI served.
+Results are printed and saved as JSON.
+
+Usage:  python benchmarks/loadtest.py [--machines 5000] [--latency 20] [--workers 1 2 4] [--threads 16]
+                                      [--operators 20] [--duration 30] [--think 0.5] [--scenarios browse move]
+                                      [--shared-dir ""]
+"""
+# pylint: disable=wrong-import-position
+
+import os, sys, argparse, json, random, statistics, subprocess, tempfile, threading, time
+from datetime import datetime, timezone
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS)
+import requests, mock_headscale, bench_pages
+
+##################################################################
+# Click paths.  Each step returns (method, path, JSON body) for an Operator.
+##################################################################
+def page(path):
+    return lambda operator: ("GET", path, None)
+
+def machines_table(operator):
+    return "POST", "/api/machines_table", {"offset": 0, "limit": 100, "sort": operator.rng.choice(["lastSeen", "name", "user"])}
+
+def machine_information(operator):
+    return "GET", "/api/machine_information?id="+operator.machine, None
+
+def move_machine(operator):
+    return "POST", "/api/move_user", {"id": operator.machine, "new_user": "user-"+str(operator.rng.randint(1, operator.tailnet.users))}
+
+def rename_machine(operator):
+    return "POST", "/api/rename_machine", {"id": operator.machine, "new_name": "machine-"+operator.machine+"-"+str(operator.rng.randint(0, 999))}
+
+def toggle_route(operator):
+    return "POST", "/api/update_route", {"route_id": str(operator.rng.randint(1, operator.tailnet.routes)), "current_state": operator.rng.choice(["True", "False"])}
+
+def search(operator):
+    return "GET", "/api/search?q=machine-"+str(operator.rng.randint(1, 99)), None
+
+SCENARIOS = {
+    # Looking around:  the three main pages
+    "browse": [page("/overview"), page("/machines"), page("/users")],
+    # Moving a machine to another user from the table view
+    "move"  : [page("/machines?view=table"), machines_table, machine_information, page("/api/get_users"), move_machine, machines_table],
+    # Renaming a machine from the table view
+    "rename": [page("/machines?view=table"), machines_table, machine_information, rename_machine, machines_table],
+    # Enabling or disabling a subnet route from the cards view
+    "route" : [page("/machines"), toggle_route, page("/machines")],
+    # Finding machines with the search box
+    "search": [page("/machines?view=table"), search, search, search],
+}
+
+class TailnetSize():
+    """ What the click paths need to know about the mock's tailnet """
+    def __init__(self, tailnet):
+        self.machines = len(tailnet.machines)
+        self.users    = len(tailnet.users)
+        self.routes   = len(tailnet.routes)
+
+class Operator(threading.Thread):
+    """ Follows a click path until "stop" is set, recording (step, seconds, status) per request """
+    def __init__(self, base_url, steps, tailnet, think, stop, seed):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.steps    = steps
+        self.tailnet  = tailnet
+        self.think    = think
+        self.stop     = stop
+        self.rng      = random.Random(seed)
+        self.session  = requests.Session()
+        self.machine  = "1"
+        self.results  = []
+
+    def run(self):
+        while not self.stop.is_set(): self.walk()
+
+    def walk(self):
+        """ One pass of the click path, on a random machine """
+        self.machine = str(self.rng.randint(1, self.tailnet.machines))
+        for step in self.steps:
+            if self.stop.is_set(): return
+            method, path, body = step(self)
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, self.base_url+path, json=body, timeout=120)
+                status   = response.status_code
+            except requests.exceptions.RequestException:
+                status   = 0
+            self.results.append((path.split("?")[0], time.perf_counter()-started, status))
+            if self.think: self.stop.wait(self.rng.uniform(0, 2*self.think))
+
+##################################################################
+# gunicorn
+##################################################################
+def start_gunicorn(port, workers, threads, environment):
+    command = [sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads), "-b", "127.0.0.1:"+str(port),
+               "--timeout", "300", "--pythonpath", BENCHMARKS, "bench_pages:create_app()"]
+    process  = subprocess.Popen(command, cwd=os.path.join(BENCHMARKS, ".."), env=environment)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None: raise RuntimeError("gunicorn exited with status "+str(process.returncode))
+        try:
+            if requests.get("http://127.0.0.1:%i/healthz" % port, timeout=1).status_code == 200: return process
+        except requests.exceptions.RequestException:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("gunicorn didn't answer /healthz within 60 s")
+
+def stop_gunicorn(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+##################################################################
+# Runs and reports
+##################################################################
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def latency_summary(results):
+    times = [seconds for _, seconds, _ in results]
+    if not times: return {"requests": 0}
+    return {
+        "requests": len(times),
+        "errors"  : sum(1 for _, _, status in results if status == 0 or status >= 400),
+        "mean_ms" : round(statistics.fmean(times)*1e3, 2),
+        "p50_ms"  : round(percentile(times, 0.50)*1e3, 2),
+        "p95_ms"  : round(percentile(times, 0.95)*1e3, 2),
+        "p99_ms"  : round(percentile(times, 0.99)*1e3, 2),
+    }
+
+def run_scenario(base_url, mock, scenario, tailnet, args):
+    # One unmeasured pass first, so the run doesn't start on empty caches
+    Operator(base_url, SCENARIOS[scenario], tailnet, 0, threading.Event(), -1).walk()
+    stop      = threading.Event()
+    operators = [Operator(base_url, SCENARIOS[scenario], tailnet, args.think, stop, seed) for seed in range(args.operators)]
+    mock.take_stats(reset=True)
+    started   = time.perf_counter()
+    for operator in operators: operator.start()
+    time.sleep(args.duration)
+    stop.set()
+    for operator in operators: operator.join()
+    elapsed   = time.perf_counter() - started
+    upstream  = mock.take_stats(reset=True)
+
+    results   = [result for operator in operators for result in operator.results]
+    summary   = latency_summary(results)
+    summary.update(
+        scenario       = scenario,
+        seconds        = round(elapsed, 2),
+        rps            = round(len(results) / elapsed, 2),
+        upstream       = sum(upstream.values()),
+        amplification  = round(sum(upstream.values()) / len(results), 2) if results else None,
+        upstream_calls = dict(sorted(upstream.items(), key=lambda item: -item[1])),
+        steps          = {path: latency_summary([result for result in results if result[0] == path]) for path in dict.fromkeys(result[0] for result in results)},
+    )
+    return summary
+
+def print_header():
+    print(f"{'workers':>7} {'threads':>7} {'scenario':<8} {'requests':>8} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>6} {'upstream':>8} {'amplif.':>8}")
+
+def print_summary(summary):
+    print(f"{summary['workers']:>7} {summary['threads']:>7} {summary['scenario']:<8} {summary['requests']:>8} {summary['rps']:>8.1f} {summary.get('p50_ms', 0):>8.1f} "
+          f"{summary.get('p95_ms', 0):>8.1f} {summary.get('p99_ms', 0):>8.1f} {summary.get('errors', 0):>6} {summary['upstream']:>8} {summary['amplification'] or 0:>8.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the web UI under gunicorn against a mock Headscale")
+    parser.add_argument("--machines",  type=int,   default=5000)
+    parser.add_argument("--users",     type=int,   default=50)
+    parser.add_argument("--keys",      type=int,   default=3,   help="PreAuth keys per user")
+    parser.add_argument("--latency",   type=float, default=20,  help="ms added to every Headscale response")
+    parser.add_argument("--jitter",    type=float, default=5,   help="up to this many ms more, at random")
+    parser.add_argument("--workers",   type=int,   nargs="+", default=[1])
+    parser.add_argument("--threads",   type=int,   nargs="+", default=[16])
+    parser.add_argument("--operators", type=int,   default=20,  help="simulated operators clicking at once")
+    parser.add_argument("--duration",  type=float, default=30,  help="seconds per scenario")
+    parser.add_argument("--think",     type=float, default=0.5, help="mean seconds between an operator's clicks")
+    parser.add_argument("--scenarios", nargs="+",  default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--shared-dir", default=None, help="SHARED_DIR for the workers.  Default is a temporary directory, \"\" runs them unshared.")
+    parser.add_argument("--port",      type=int,   default=5099)
+    parser.add_argument("--output",    default="loadtest.json")
+    args = parser.parse_args()
+
+    tailnet   = mock_headscale.Tailnet(args.machines, args.users, args.keys)
+    size      = TailnetSize(tailnet)
+    mock      = mock_headscale.serve(tailnet, latency=args.latency, jitter=args.jitter)
+    directory = tempfile.mkdtemp(prefix="loadtest-")
+    bench_pages.prepare(directory)
+    shared_dir  = os.path.join(directory, "shared") if args.shared_dir is None else args.shared_dir
+    environment = dict(os.environ, HS_SERVER=mock.url, BENCH_WEB_UI_DIR=directory, SHARED_DIR=shared_dir)
+    base_url    = "http://127.0.0.1:%i" % args.port
+
+    print_header()
+    summaries = []
+    for workers in args.workers:
+        for threads in args.threads:
+            process = start_gunicorn(args.port, workers, threads, environment)
+            try:
+                for scenario in args.scenarios:
+                    summary = run_scenario(base_url, mock, scenario, size, args)
+                    summary.update(workers=workers, threads=threads)
+                    summaries.append(summary)
+                    print_summary(summary)
+            finally:
+                stop_gunicorn(process)
+
+    report = {
+        "created" : datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "commit"  : bench_pages.git_commit(),
+        "settings": {key: value for key, value in vars(args).items() if key not in ("output", "port")},
+        "results" : summaries,
+    }
+    with open(args.output, "w", encoding="utf-8") as report_file: json.dump(report, report_file, indent=2)
+    print("\nReport written to "+args.output)
+
+if __name__ == "__main__":
+    main()
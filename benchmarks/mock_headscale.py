@@ -0,0 +1,401 @@
+""" A stand-in for Headscale's REST API, serving a synthetic tailnet from memory
+
+Implements every endpoint headscale.py calls:  /api/v1/machine, /api/v1/routes,
+/api/v1/user, /api/v1/preauthkey, /api/v1/apikey and /health.  Writes (rename, delete,
+expire, move, tags, routes, users, PreAuth keys, API keys) change the tailnet, so the web
+UI can be driven end to end.  Every response is delayed by --latency ms plus up to
+--jitter ms.  Requests are counted per endpoint:  GET /mock/stats returns the counts and
+POST /mock/reset clears them.
+
+The web UI's API key is printed on start.  Save it on the Settings page, or use it
+directly as benchmarks/bench_pages.py does.
+
+Usage:  python benchmarks/mock_headscale.py [--machines 10000] [--users 100] [--keys 3] [--latency 20] [--jitter 5] [--port 8081]
+"""
+
+import argparse, json, random, re, threading, time
+from collections  import Counter
+from datetime     import datetime, timedelta, timezone
+from http.server  import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# Headscale checks keys by their first 10 characters, as headscale.get_api_key_info does
+API_KEY = "mockhscale.b3f1c0ffee5a1ad0d15ea5eb0a710ad5"
+
+def stamp(moment):
+    return moment.strftime('%Y-%m-%dT%H:%M:%S.%f')+"123Z"
+
+class NotFound(Exception):
+    pass
+
+class Tailnet():
+    """ Users, machines, routes and keys of a synthetic tailnet.  The same seed builds the same tailnet.
+        Handlers run under "lock". """
+    def __init__(self, machines=1000, users=50, keys=3, seed=1):
+        rng      = random.Random(seed)
+        now      = datetime.now(timezone.utc)
+        self.rng = rng
+        self.lock         = threading.RLock()
+        self.next_id      = 1
+        self.users        = {}  # name -> user
+        self.machines     = {}  # id -> machine
+        self.routes       = {}  # id -> route.  "machine" is the machine itself, so renames show up.
+        self.primaries    = set() # prefixes with a primary route
+        self.preauth_keys = {}  # user name -> keys
+        self.api_keys     = [{"id": "1", "prefix": API_KEY[:10], "expiration": stamp(now+timedelta(days=90)), "createdAt": stamp(now), "lastSeen": stamp(now)}]
+        # The serialized machine and route lists, until the next write
+        self.documents    = {}
+
+        for user_id in range(1, users+1):
+            user = self.add_user("user-"+str(user_id))
+            user["createdAt"] = stamp(now - timedelta(days=rng.randint(1, 900)))
+            for key_id in range(keys):
+                self.add_preauth_key(user["name"], reusable=key_id % 2 == 0, ephemeral=key_id % 3 == 2,
+                    expiration=stamp(now + timedelta(days=rng.randint(-30, 90))), used=rng.random() < 0.5)
+
+        user_list = list(self.users.values())
+        for machine_id in range(1, machines+1):
+            user = rng.choice(user_list)
+            self.machines[str(machine_id)] = {
+                "id"                  : str(machine_id),
+                "machineKey"          : "mkey:%064x" % machine_id,
+                "nodeKey"             : "nodekey:%064x" % machine_id,
+                "discoKey"            : "discokey:%064x" % machine_id,
+                "givenName"           : "machine-"+str(machine_id),
+                "name"                : "host-"+str(machine_id),
+                "user"                : user,
+                "ipAddresses"         : ["100.64.%i.%i" % (machine_id // 250, machine_id % 250 + 1), "fd7a:115c:a1e0::%x" % machine_id],
+                "lastSeen"            : stamp(now - timedelta(seconds=rng.randint(0, 86400*30))),
+                "lastSuccessfulUpdate": stamp(now - timedelta(seconds=rng.randint(0, 86400*30))),
+                "createdAt"           : stamp(now - timedelta(days=rng.randint(1, 900))),
+                "expiry"              : stamp(now + timedelta(days=rng.randint(1, 200))) if machine_id % 3 else "0001-01-01T00:00:00Z",
+                "preAuthKey"          : self.preauth_keys[user["name"]][0] if machine_id % 2 and self.preauth_keys[user["name"]] else None,
+                "forcedTags"          : ["tag:server", "tag:group-"+user["id"]] if machine_id % 4 == 0 else [],
+                "validTags"           : [],
+                "invalidTags"         : [],
+                "registerMethod"      : "REGISTER_METHOD_AUTH_KEY",
+                "online"              : rng.random() < 0.6,
+            }
+            # One machine in ten is a subnet router, one in fifty also an exit node.
+            # Every 40th router shares its neighbour's prefix, like a high availability pair.
+            if machine_id % 10 == 0:
+                router   = machine_id // 10
+                network  = router - 1 if router % 40 == 0 else router
+                prefixes = ["10.%i.%i.0/24" % (network // 256 % 256, network % 256)]
+                if machine_id % 50 == 0: prefixes += ["0.0.0.0/0", "::/0"]
+                for index, prefix in enumerate(prefixes):
+                    self.add_route(self.machines[str(machine_id)], prefix, enabled=index % 2 == 0)
+        self.next_id = max(self.next_id, machines+1)
+
+    def new_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+    def changed(self):
+        self.documents.clear()
+
+    def document(self, name, build):
+        """ A serialized list, rebuilt only after a write """
+        if name not in self.documents: self.documents[name] = json.dumps(build()).encode()
+        return self.documents[name]
+
+    # Users
+    def add_user(self, name):
+        if name in self.users: raise ValueError("user already exists")
+        user = {"id": str(len(self.users)+1), "name": name, "createdAt": stamp(datetime.now(timezone.utc))}
+        self.users[name] = user
+        self.preauth_keys[name] = []
+        return user
+
+    def user(self, name):
+        if name not in self.users: raise NotFound("user not found")
+        return self.users[name]
+
+    # Machines
+    def machine(self, machine_id):
+        if machine_id not in self.machines: raise NotFound("machine not found")
+        return self.machines[machine_id]
+
+    def machine_routes(self, machine_id):
+        return [route for route in self.routes.values() if route["machine"]["id"] == machine_id]
+
+    def add_route(self, machine, prefix, enabled):
+        route_id = str(len(self.routes)+1)
+        self.routes[route_id] = {
+            "id": route_id, "machine": machine, "prefix": prefix, "advertised": True, "enabled": enabled,
+            "isPrimary": enabled and prefix not in self.primaries,
+            "createdAt": machine["createdAt"], "updatedAt": machine["createdAt"], "deletedAt": None,
+        }
+        if enabled: self.primaries.add(prefix)
+
+    # Keys
+    def add_preauth_key(self, user_name, reusable, ephemeral, expiration, used=False):
+        user = self.user(user_name)
+        key  = {
+            "user": user["name"], "id": self.new_id(),
+            "key": "%048x" % self.rng.getrandbits(192), "reusable": reusable, "ephemeral": ephemeral, "used": used,
+            "expiration": expiration, "createdAt": stamp(datetime.now(timezone.utc)), "aclTags": [],
+        }
+        self.preauth_keys[user["name"]].append(key)
+        return key
+
+##################################################################
+# Endpoints.  Each takes (tailnet, match, query, body) and returns a JSON-ready body.
+##################################################################
+def list_machines(tailnet, match, query, body):
+    return tailnet.document("machines", lambda: {"machines": list(tailnet.machines.values())})
+
+def get_machine(tailnet, match, query, body):
+    return {"machine": tailnet.machine(match["id"])}
+
+def delete_machine(tailnet, match, query, body):
+    tailnet.machine(match["id"])
+    del tailnet.machines[match["id"]]
+    for route in tailnet.machine_routes(match["id"]): del tailnet.routes[route["id"]]
+    return {}
+
+def rename_machine(tailnet, match, query, body):
+    machine = tailnet.machine(match["id"])
+    machine["givenName"] = match["name"]
+    return {"machine": machine}
+
+def expire_machine(tailnet, match, query, body):
+    machine = tailnet.machine(match["id"])
+    machine["expiry"] = stamp(datetime.now(timezone.utc))
+    return {"machine": machine}
+
+def set_tags(tailnet, match, query, body):
+    machine = tailnet.machine(match["id"])
+    tags    = body.get("tags", [])
+    if any(not tag.startswith("tag:") for tag in tags): raise ValueError("tags must start with tag:")
+    machine["forcedTags"] = tags
+    return {"machine": machine}
+
+def move_machine(tailnet, match, query, body):
+    machine = tailnet.machine(match["id"])
+    machine["user"] = tailnet.user(query.get("user", ""))
+    return {"machine": machine}
+
+def register_machine(tailnet, match, query, body):
+    user       = tailnet.user(query.get("user", ""))
+    machine_id = tailnet.new_id()
+    now        = stamp(datetime.now(timezone.utc))
+    machine    = {
+        "id": machine_id, "machineKey": query.get("key", ""), "nodeKey": "", "discoKey": "", "givenName": "machine-"+machine_id,
+        "name": "host-"+machine_id, "user": user, "ipAddresses": ["100.100.%i.%i" % (int(machine_id) // 250 % 256, int(machine_id) % 250 + 1)],
+        "lastSeen": now, "lastSuccessfulUpdate": now, "createdAt": now, "expiry": "0001-01-01T00:00:00Z", "preAuthKey": None,
+        "forcedTags": [], "validTags": [], "invalidTags": [], "registerMethod": "REGISTER_METHOD_CLI", "online": False,
+    }
+    tailnet.machines[machine_id] = machine
+    return {"machine": machine}
+
+def get_machine_routes(tailnet, match, query, body):
+    tailnet.machine(match["id"])
+    return {"routes": tailnet.machine_routes(match["id"])}
+
+def list_routes(tailnet, match, query, body):
+    return tailnet.document("routes", lambda: {"routes": list(tailnet.routes.values())})
+
+def set_route(tailnet, match, query, body):
+    if match["id"] not in tailnet.routes: raise NotFound("route not found")
+    tailnet.routes[match["id"]]["enabled"] = match["action"] == "enable"
+    return {}
+
+def list_users(tailnet, match, query, body):
+    return {"users": list(tailnet.users.values())}
+
+def add_user(tailnet, match, query, body):
+    return {"user": tailnet.add_user(str(body.get("name", "")))}
+
+def rename_user(tailnet, match, query, body):
+    user = tailnet.user(match["name"])
+    if match["new_name"] in tailnet.users: raise ValueError("user already exists")
+    del tailnet.users[match["name"]]
+    user["name"] = match["new_name"]
+    tailnet.users[user["name"]]        = user
+    tailnet.preauth_keys[user["name"]] = tailnet.preauth_keys.pop(match["name"])
+    for key in tailnet.preauth_keys[user["name"]]: key["user"] = user["name"]
+    return {"user": user}
+
+def delete_user(tailnet, match, query, body):
+    tailnet.user(match["name"])
+    if any(machine["user"]["name"] == match["name"] for machine in tailnet.machines.values()): raise ValueError("user not empty")
+    del tailnet.users[match["name"]]
+    del tailnet.preauth_keys[match["name"]]
+    return {}
+
+def list_preauth_keys(tailnet, match, query, body):
+    return {"preAuthKeys": tailnet.preauth_keys[tailnet.user(query.get("user", ""))["name"]]}
+
+def add_preauth_key(tailnet, match, query, body):
+    return {"preAuthKey": tailnet.add_preauth_key(str(body.get("user", "")), bool(body.get("reusable")), bool(body.get("ephemeral")),
+        body.get("expiration") or stamp(datetime.now(timezone.utc)+timedelta(hours=1)))}
+
+def expire_preauth_key(tailnet, match, query, body):
+    for key in tailnet.preauth_keys[tailnet.user(str(body.get("user", "")))["name"]]:
+        if key["key"] == body.get("key"):
+            key["expiration"] = stamp(datetime.now(timezone.utc))
+            return {}
+    raise NotFound("key not found")
+
+def list_api_keys(tailnet, match, query, body):
+    return {"apiKeys": tailnet.api_keys}
+
+def add_api_key(tailnet, match, query, body):
+    key = API_KEY[:10]+"."+"%032x" % random.getrandbits(128)
+    tailnet.api_keys.append({"id": str(len(tailnet.api_keys)+1), "prefix": key[:10], "expiration": body.get("expiration", ""), "createdAt": stamp(datetime.now(timezone.utc)), "lastSeen": None})
+    return {"apiKey": key}
+
+def expire_api_key(tailnet, match, query, body):
+    return {}
+
+def health(tailnet, match, query, body):
+    return {"databaseConnectivity": True}
+
+# (method, path pattern, handler, changes the tailnet).  Patterns are tried in order.
+ENDPOINTS = [
+    ("GET",    r"/health",                                        health,             False),
+    ("GET",    r"/api/v1/machine",                                list_machines,      False),
+    ("POST",   r"/api/v1/machine/register",                       register_machine,   True ),
+    ("GET",    r"/api/v1/machine/(?P<id>\d+)",                    get_machine,        False),
+    ("DELETE", r"/api/v1/machine/(?P<id>\d+)",                    delete_machine,     True ),
+    ("GET",    r"/api/v1/machine/(?P<id>\d+)/routes",             get_machine_routes, False),
+    ("POST",   r"/api/v1/machine/(?P<id>\d+)/rename/(?P<name>[^/]+)", rename_machine, True ),
+    ("POST",   r"/api/v1/machine/(?P<id>\d+)/expire",             expire_machine,     True ),
+    ("POST",   r"/api/v1/machine/(?P<id>\d+)/tags",               set_tags,           True ),
+    ("POST",   r"/api/v1/machine/(?P<id>\d+)/user",               move_machine,       True ),
+    ("GET",    r"/api/v1/routes",                                 list_routes,        False),
+    ("POST",   r"/api/v1/routes/(?P<id>\d+)/(?P<action>enable|disable)", set_route,   True ),
+    ("GET",    r"/api/v1/user",                                   list_users,         False),
+    ("POST",   r"/api/v1/user",                                   add_user,           True ),
+    ("POST",   r"/api/v1/user/(?P<name>[^/]+)/rename/(?P<new_name>[^/]+)", rename_user, True),
+    ("DELETE", r"/api/v1/user/(?P<name>[^/]+)",                   delete_user,        True ),
+    ("GET",    r"/api/v1/preauthkey",                             list_preauth_keys,  False),
+    ("POST",   r"/api/v1/preauthkey",                             add_preauth_key,    True ),
+    ("POST",   r"/api/v1/preauthkey/expire",                      expire_preauth_key, True ),
+    ("GET",    r"/api/v1/apikey",                                 list_api_keys,      False),
+    ("POST",   r"/api/v1/apikey",                                 add_api_key,        True ),
+    ("POST",   r"/api/v1/apikey/expire",                          expire_api_key,     True ),
+]
+# Requests are counted under the pattern with its groups written as {name}:  "GET /api/v1/machine/{id}"
+ENDPOINTS = [(method+" "+re.sub(r"\(\?P<(\w+)>[^)]*\)", r"{\1}", pattern), method, re.compile(pattern+"$"), handler, writes)
+    for method, pattern, handler, writes in ENDPOINTS]
+
+class MockHeadscale(ThreadingHTTPServer):
+    """ Serves a Tailnet.  Counts requests per endpoint in "stats". """
+    daemon_threads     = True
+    # The web UI opens up to HS_FANOUT_CONCURRENCY connections at once.  The default
+    # backlog of 5 drops the rest, and they only connect after a 1 s SYN retry.
+    request_queue_size = 128
+
+    def __init__(self, address, tailnet, latency=0.0, jitter=0.0):
+        super().__init__(address, Handler)
+        self.tailnet    = tailnet
+        self.latency    = latency / 1000
+        self.jitter     = jitter  / 1000
+        self.stats      = Counter()
+        self.stats_lock = threading.Lock()
+
+    @property
+    def url(self):
+        return "http://%s:%i" % self.server_address[:2]
+
+    def count(self, endpoint):
+        with self.stats_lock: self.stats[endpoint] += 1
+
+    def take_stats(self, reset=False):
+        with self.stats_lock:
+            stats = dict(self.stats)
+            if reset: self.stats.clear()
+        return stats
+
+class Handler(BaseHTTPRequestHandler):
+    # Keep-alive, like Headscale.  The web UI holds a pool of connections open.
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args): # pylint: disable=redefined-builtin
+        pass
+
+    def send_json(self, status, body):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type",   "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message):
+        # Headscale's gRPC gateway error body
+        self.send_json(status, {"code": 5 if status == 404 else 3, "message": message, "details": []})
+
+    def dispatch(self):
+        server = self.server
+        parts  = urlsplit(self.path)
+        query  = {name: values[0] for name, values in parse_qs(parts.query).items()}
+        length = int(self.headers.get("Content-Length") or 0)
+        data   = self.rfile.read(length) if length else b""
+
+        if parts.path == "/mock/stats":
+            return self.send_json(200, server.take_stats(reset=self.command == "POST"))
+        if parts.path == "/mock/reset":
+            server.take_stats(reset=True)
+            return self.send_json(200, {})
+
+        delay = server.latency + random.uniform(0, server.jitter)
+        if delay: time.sleep(delay)
+
+        for name, method, pattern, handler, writes in ENDPOINTS:
+            match = pattern.match(parts.path)
+            if match is None or method != self.command: continue
+            server.count(name)
+            if handler is not health:
+                token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+                if not any(token[:10] == key["prefix"] for key in server.tailnet.api_keys):
+                    return self.send_error_json(401, "Unauthorized")
+            try:
+                body = json.loads(data) if data else {}
+                with server.tailnet.lock:
+                    result = handler(server.tailnet, match.groupdict(), query, body)
+                    if writes: server.tailnet.changed()
+            except NotFound as error:
+                return self.send_error_json(404, str(error))
+            except ValueError as error:
+                return self.send_error_json(400, str(error))
+            return self.send_json(200, result)
+        server.count("unknown")
+        return self.send_error_json(404, "Not Found")
+
+    do_GET    = dispatch
+    do_POST   = dispatch
+    do_DELETE = dispatch
+
+def serve(tailnet, host="127.0.0.1", port=0, latency=0.0, jitter=0.0):
+    """ Starts a MockHeadscale on a background thread.  Port 0 picks a free port. """
+    server = MockHeadscale((host, port), tailnet, latency, jitter)
+    threading.Thread(target=server.serve_forever, name="mock-headscale", daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a synthetic tailnet over Headscale's REST API")
+    parser.add_argument("--machines", type=int,   default=1000)
+    parser.add_argument("--users",    type=int,   default=50)
+    parser.add_argument("--keys",     type=int,   default=3,  help="PreAuth keys per user")
+    parser.add_argument("--latency",  type=float, default=0,  help="ms added to every response")
+    parser.add_argument("--jitter",   type=float, default=0,  help="up to this many ms more, at random")
+    parser.add_argument("--seed",     type=int,   default=1)
+    parser.add_argument("--host",     default="127.0.0.1")
+    parser.add_argument("--port",     type=int,   default=8081)
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    tailnet = Tailnet(args.machines, args.users, args.keys, args.seed)
+    print("Built %i machines, %i users and %i routes in %.1f s" % (len(tailnet.machines), len(tailnet.users), len(tailnet.routes), time.perf_counter()-started))
+    server  = MockHeadscale((args.host, args.port), tailnet, args.latency, args.jitter)
+    print("Serving on %s.  API key:  %s" % (server.url, API_KEY))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# pylint: disable=wrong-import-order
+
+import headscale, cache, events, profiling, os, logging, json, re
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools          import partial
+from flask              import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# Bulk machine operations
+##################################################################
+# A bulk request is one action and a list of machine IDs.  It is planned into a list of
+# Headscale calls, the calls run concurrently, and a JSON line is streamed back as each
+# one finishes so the browser can show progress and per-machine results.
+
+# Headscale calls in flight at once for one bulk request.  Keep it below HS_POOL_SIZE.
+BULK_CONCURRENCY = int(os.environ.get("BULK_CONCURRENCY", "8"))
+# Machines accepted in one bulk request
+BULK_MAX_ITEMS   = int(os.environ.get("BULK_MAX_ITEMS",   "1000"))
+
+TAG_MODES = ("add", "remove", "set")
+
+def machine_ids(payload):
+    """ The de-duplicated machine IDs of a bulk request, as strings """
+    ids = payload.get("ids")
+    if not isinstance(ids, list) or not ids: raise ValueError("No machines were selected")
+    if len(ids) > BULK_MAX_ITEMS:            raise ValueError("At most "+str(BULK_MAX_ITEMS)+" machines can be changed at once")
+    if not all(isinstance(machine_id, (int, str)) and str(machine_id).isdigit() for machine_id in ids):
+        raise ValueError("Machine IDs must be numbers")
+    return list(dict.fromkeys(str(machine_id) for machine_id in ids))
+
+# Stands in for a Headscale call when there is nothing to send
+def no_change():
+    return {"status": "True", "body": {}}
+
+# Same error shape Headscale uses (5 is gRPC's NOT_FOUND)
+def not_found(machine_id):
+    return {"code": 5, "message": "Machine "+str(machine_id)+" not found"}
+
+# Tags are entered without the "tag:" prefix.  Spaces become dashes, as on the tag chips.
+def normalize_tag(tag):
+    tag = re.sub(r"\s+", "-", str(tag).strip().lower())
+    return "tag:"+tag.removeprefix("tag:")
+
+def plan_delete(url, api_key, ids, payload):
+    return [({"id": machine_id}, partial(headscale.delete_machine, url, api_key, machine_id)) for machine_id in ids]
+
+def plan_expire(url, api_key, ids, payload):
+    return [({"id": machine_id}, partial(headscale.expire_machine, url, api_key, machine_id)) for machine_id in ids]
+
+def plan_move(url, api_key, ids, payload):
+    user = str(payload.get("user", "")).strip()
+    if not user: raise ValueError("Select a user to move the machines to")
+    return [({"id": machine_id}, partial(headscale.move_user, url, api_key, machine_id, user)) for machine_id in ids]
+
+# "mode" is "add" or "remove" to change the listed tags on each machine and keep the
+# rest, or "set" to replace every machine's tags.  Unchanged machines aren't sent.
+def plan_tags(url, api_key, ids, payload):
+    mode = payload.get("mode", "add")
+    tags = list(dict.fromkeys(normalize_tag(tag) for tag in payload.get("tags", []) if str(tag).strip()))
+    if mode not in TAG_MODES:     raise ValueError("Tag mode must be one of "+", ".join(TAG_MODES))
+    if not tags and mode != "set": raise ValueError("Enter at least one tag")
+
+    current = {str(machine["id"]): machine["forcedTags"] for machine in headscale.get_machines(url, api_key)["machines"]}
+    calls   = []
+    for machine_id in ids:
+        if machine_id not in current:
+            calls.append(({"id": machine_id}, partial(not_found, machine_id)))
+            continue
+        match mode:
+            case "add"   : new_tags = current[machine_id] + [tag for tag in tags if tag not in current[machine_id]]
+            case "remove": new_tags = [tag for tag in current[machine_id] if tag not in tags]
+            case "set"   : new_tags = tags
+        if new_tags == current[machine_id]: calls.append(({"id": machine_id}, no_change))
+        else: calls.append(({"id": machine_id}, partial(headscale.set_machine_tags, url, api_key, machine_id, json.dumps({"tags": new_tags}))))
+    return calls
+
+# Enables or disables every advertised route of each machine.  One call per route that
+# isn't already in that state, so a machine can have several results or none.
+def plan_routes(url, api_key, ids, payload):
+    enabled = payload.get("enabled")
+    if not isinstance(enabled, bool): raise ValueError("Choose whether to enable or disable the routes")
+
+    routes_by_machine = headscale.get_routes_by_machine(url, api_key)
+    calls             = []
+    for machine_id in ids:
+        for route in routes_by_machine.get(machine_id, {"routes": []})["routes"]:
+            if not route["advertised"] or route["enabled"] == enabled: continue
+            # update_route flips the route from the state it is told it's in:
+            calls.append((
+                {"id": machine_id, "route": route["id"], "prefix": route["prefix"]},
+                partial(headscale.update_route, url, api_key, route["id"], str(route["enabled"]))
+            ))
+    return calls
+
+ACTIONS = {
+    "delete": plan_delete,
+    "expire": plan_expire,
+    "move"  : plan_move,
+    "tags"  : plan_tags,
+    "routes": plan_routes,
+}
+
+def plan(action, url, api_key, payload):
+    """ Turns a bulk request into (item, call) pairs.  Raises ValueError if it can't be run """
+    if action not in ACTIONS: raise ValueError("Unknown bulk action "+str(action))
+    return ACTIONS[action](url, api_key, machine_ids(payload), payload)
+
+# headscale.py's write functions return either Headscale's body, which holds "code" and
+# "message" on an error, or {"status": "True"|"False", "body": <Headscale's body>}.
+def outcome(body):
+    """ Returns (succeeded, error message) for what a headscale.py write function returned """
+    wrapped = isinstance(body, dict) and "status" in body and "body" in body
+    if wrapped and body["status"] == "True": return True, None
+    if wrapped: body = body["body"]
+    if isinstance(body, dict) and "code" in body: return False, str(body.get("message") or body["code"])
+    if wrapped: return False, "Headscale rejected the request"
+    return True, None
+
+def run(calls, concurrency=BULK_CONCURRENCY, finished_late=None):
+    """ Runs (item, call) pairs concurrently and yields (item, succeeded, error) as each one finishes.
+        If the caller stops early, "finished_late" is called as each call still running finishes. """
+    pool    = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bulk")
+    futures = {}
+    try:
+        futures = {pool.submit(profiling.carry(call)): item for item, call in calls}
+        for future in as_completed(futures):
+            try:
+                succeeded, error = outcome(future.result())
+            except Exception as exception: # pylint: disable=broad-except
+                succeeded, error = False, str(exception)
+            yield futures[future], succeeded, error
+    finally:
+        # If the browser goes away mid-stream, the calls that haven't started are dropped.
+        # The ones already running can't be stopped and finish in the background.
+        pool.shutdown(wait=False, cancel_futures=True)
+        if finished_late is not None:
+            for future in futures:
+                if not future.done(): future.add_done_callback(lambda _future: finished_late())
+
+def changed():
+    """ Drops the cached Headscale responses a bulk request may have changed, and pushes the
+        new state to live status clients now rather than at the next poll """
+    # Routes embed their machine and machines embed their user, so everything machine-shaped goes:
+    for endpoint in ("machines", "machine", "machine_routes", "routes"): cache.responses.invalidate(endpoint)
+    # The poll runs in the leader worker.  trigger() reaches it from any worker.
+    events.poll_job.trigger()
+
+def line(data):
+    return json.dumps(data, separators=(",", ":"))+"\n"
+
+def stream(action, calls):
+    """ Runs a planned bulk request and yields newline-delimited JSON:  a "start" line,
+        an "item" line per call as it finishes, and a "done" line with the totals """
+    total     = len(calls)
+    done      = 0
+    succeeded = 0
+    app.logger.info("Bulk %s:  %i Headscale calls, %i at a time", action, total, BULK_CONCURRENCY)
+    try:
+        yield line({"type": "start", "action": action, "total": total})
+        for item, item_succeeded, error in run(calls, finished_late=changed):
+            done      += 1
+            succeeded += item_succeeded
+            if not item_succeeded: app.logger.error("Bulk %s failed for machine %s:  %s", action, item["id"], error)
+            yield line(dict(item, type="item", ok=item_succeeded, error=error, done=done, total=total))
+        yield line({"type": "done", "total": total, "succeeded": succeeded, "failed": total - succeeded})
+    finally:
+        app.logger.info("Bulk %s finished:  %i of %i calls done, %i succeeded", action, done, total, succeeded)
+        # Again as each call still running finishes (see run()), so a read made meanwhile
+        # doesn't keep the state from before its write cached until the TTL expires
+        changed()
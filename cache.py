@@ -0,0 +1,144 @@
+# pylint: disable=wrong-import-order
+
+import os, threading, time, logging, json, secrets, sqlite3, metrics, shared
+from collections import OrderedDict
+from flask       import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+class TTLCache():
+    """ Thread-safe, size-bounded LRU cache whose entries expire after a per-entry TTL """
+    def __init__(self, name, max_entries=1024, shared_store=None):
+        self.name        = name
+        self.max_entries = max_entries
+        self.entries     = OrderedDict() # key -> (expires_at, value, shared version)
+        self.lock        = threading.Lock()
+        self.hits        = 0
+        self.misses      = 0
+        # A shared.Store makes this a second level over the store:  entries written by any
+        # worker are seen by all of them, and invalidating an entry drops it everywhere.
+        # Only JSON values can be cached then.
+        self.shared      = shared_store
+        # Bound once, so a lookup costs one counter increment
+        self.hit_counter  = metrics.cache_requests.labels(name, "hit")
+        self.miss_counter = metrics.cache_requests.labels(name, "miss")
+        self.size_gauge   = metrics.cache_entries.labels(name)
+
+    def get(self, key):
+        # Returns (True, value) on a hit and (False, None) on a miss
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] <= now:
+                del self.entries[key]
+                self.size_gauge.set(len(self.entries))
+                entry = None
+        if self.shared is not None: entry = self.get_shared(key, entry)
+        with self.lock:
+            if entry is None:
+                self.misses += 1
+                self.miss_counter.inc()
+                return False, None
+            if key in self.entries: self.entries.move_to_end(key)
+            self.hits += 1
+            self.hit_counter.inc()
+            return True, entry[1]
+
+    def get_shared(self, key, entry):
+        # Returns this worker's entry while it matches the store's version, so repeated hits
+        # return the same object.  Otherwise the store's value is decoded and kept here.
+        shared_key = json.dumps(key)
+        try:
+            header = self.shared.cache_header(shared_key)
+            if header is not None and entry is not None and entry[2] == header[1]: return entry
+            row = self.shared.cache_entry(shared_key) if header is not None else None
+        except sqlite3.Error as error:
+            app.logger.error("Failed reading the shared %s cache:  %s", self.name, str(error))
+            return entry
+        with self.lock:
+            if row is None:
+                if self.entries.pop(key, None) is not None: self.size_gauge.set(len(self.entries))
+                return None
+            expires, version, value = row
+            entry = (time.monotonic() + expires - time.time(), json.loads(value), version)
+            self.store_entry(key, entry)
+        return entry
+
+    def set(self, key, value, ttl):
+        if ttl <= 0: return
+        version = None
+        if self.shared is not None:
+            version = secrets.token_hex(8)
+            try:
+                self.shared.cache_set(json.dumps(key), key[0], time.time() + ttl, version, json.dumps(value, separators=(",", ":")))
+            except sqlite3.Error as error:
+                app.logger.error("Failed writing the shared %s cache:  %s", self.name, str(error))
+        with self.lock: self.store_entry(key, (time.monotonic() + ttl, value, version))
+
+    def store_entry(self, key, entry):
+        # Call with self.lock held
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.size_gauge.set(len(self.entries))
+
+    def invalidate(self, endpoint, params=None):
+        # Drops one entry, or every entry for "endpoint" when params is None
+        with self.lock:
+            if params is not None:
+                self.entries.pop(make_key(endpoint, params), None)
+            else:
+                for key in [key for key in self.entries if key[0] == endpoint]:
+                    del self.entries[key]
+            self.size_gauge.set(len(self.entries))
+        if self.shared is None: return
+        try:
+            if params is not None: self.shared.cache_delete(json.dumps(make_key(endpoint, params)))
+            else:                  self.shared.cache_delete_endpoint(endpoint)
+        except sqlite3.Error as error:
+            app.logger.error("Failed invalidating the shared %s cache:  %s", self.name, str(error))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size_gauge.set(0)
+        if self.shared is None: return
+        try:
+            self.shared.cache_clear()
+        except sqlite3.Error as error:
+            app.logger.error("Failed clearing the shared %s cache:  %s", self.name, str(error))
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "max_entries": self.max_entries, "hits": self.hits, "misses": self.misses}
+
+def make_key(endpoint, params=None):
+    """ Builds a cache key from an endpoint name and its parameters """
+    return (endpoint, tuple(sorted(params.items())) if params else ())
+
+# Seconds each Headscale read endpoint is cached for.  0 disables caching for that endpoint.
+TTLS = {
+    "machines"       : float(os.environ.get("CACHE_TTL_MACHINES",     "10")),
+    "machine"        : float(os.environ.get("CACHE_TTL_MACHINES",     "10")),
+    "machine_routes" : float(os.environ.get("CACHE_TTL_ROUTES",       "10")),
+    "routes"         : float(os.environ.get("CACHE_TTL_ROUTES",       "10")),
+    "users"          : float(os.environ.get("CACHE_TTL_USERS",        "60")),
+    "preauth_keys"   : float(os.environ.get("CACHE_TTL_PREAUTH_KEYS", "60")),
+    "preauth_summary": float(os.environ.get("CACHE_TTL_PREAUTH_KEYS", "60")),
+}
+
+# Shared by every thread in the process, and through SHARED_DIR by every worker.  Cached values must be treated as read-only.
+responses = TTLCache("responses", max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", "1024")), shared_store=shared.store)
+
+# Rendered machine cards, keyed by a hash of everything the card shows (see renderer.render_machine_card).
+# Keys never repeat once the data changes, so entries are only ever dropped by age or size.
+fragments = TTLCache("fragments", max_entries=int(os.environ.get("FRAGMENT_CACHE_ENTRIES", "10000")))
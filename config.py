@@ -0,0 +1,172 @@
+# pylint: disable=wrong-import-order
+
+import os, yaml, threading, logging
+from dataclasses import dataclass, field
+from flask       import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+# Headscale's configuration file, in the order they are tried
+CONFIG_PATHS = ("/etc/headscale/config.yml", "/etc/headscale/config.yaml")
+# Use libyaml's C loader when PyYAML was built with it
+YAML_LOADER  = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+##################################################################
+# Config model.  Values are kept as the strings the overview page
+# displays, with "N/A" for anything missing from the file.
+##################################################################
+
+def display(section, key):
+    return str(section[key]) if key in section else "N/A"
+
+@dataclass(frozen=True)
+class GeneralConfig():
+    ip_prefixes:                       str = "N/A"
+    server_url:                        str = "N/A"
+    disable_check_updates:             str = "N/A"
+    ephemeral_node_inactivity_timeout: str = "N/A"
+    node_update_check_interval:        str = "N/A"
+
+@dataclass(frozen=True)
+class OIDCConfig():
+    issuer:                str = "N/A"
+    client_id:             str = "N/A"
+    scope:                 str = "N/A"
+    use_expiry_from_token: str = "N/A"
+    expiry:                str = "N/A"
+
+@dataclass(frozen=True)
+class DERPServerConfig():
+    enabled:          str = "N/A"
+    region_id:        str = "N/A"
+    region_code:      str = "N/A"
+    region_name:      str = "N/A"
+    stun_listen_addr: str = "N/A"
+
+@dataclass(frozen=True)
+class DERPRegion():
+    region_id:   str
+    region_code: str
+    region_name: str
+    hostnames:   tuple
+    source:      str
+
+@dataclass(frozen=True)
+class DNSConfig():
+    nameservers: str = "N/A"
+    magic_dns:   str = "N/A"
+    domains:     str = "N/A"
+    base_domain: str = "N/A"
+
+@dataclass(frozen=True)
+class HeadscaleConfig():
+    path:         str
+    general:      GeneralConfig
+    dns:          DNSConfig
+    oidc:         OIDCConfig       = None # None when the file has no "oidc" section
+    derp_server:  DERPServerConfig = None # None when the embedded DERP server is absent or disabled
+    derp_paths:   tuple            = ()
+    derp_regions: tuple            = ()   # Regions loaded from the files in derp.paths
+    derp_errors:  tuple            = ()   # DERP map files that could not be read
+    watched:      tuple            = field(default=(), repr=False) # (path, signature) of every file read
+
+##################################################################
+# Loading
+##################################################################
+
+def file_signature(path):
+    try:
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    except OSError: return None
+
+def resolve_derp_path(config_path, derp_path):
+    # Relative paths are relative to the directory the config file lives in
+    return derp_path if os.path.isabs(derp_path) else os.path.join(os.path.dirname(config_path), derp_path)
+
+def load_derp_map(path):
+    with open(path, "r") as derp_file:
+        derp_map = yaml.load(derp_file, Loader=YAML_LOADER) or {}
+    regions = []
+    for region_key, region in (derp_map.get("regions") or {}).items():
+        regions.append(DERPRegion(
+            region_id   = str(region.get("regionid", region_key)),
+            region_code = str(region.get("regioncode", "N/A")),
+            region_name = str(region.get("regionname", "N/A")),
+            hostnames   = tuple(str(node.get("hostname", "N/A")) for node in region.get("nodes") or []),
+            source      = path
+        ))
+    return regions
+
+def load_config(path):
+    """ Parses the Headscale configuration file at "path" and every DERP map it lists """
+    app.logger.info("Loading %s", path)
+    watched = [(path, file_signature(path))]
+    with open(path, "r") as config_file:
+        config_yaml = yaml.load(config_file, Loader=YAML_LOADER) or {}
+
+    general = GeneralConfig(**{key: display(config_yaml, key) for key in GeneralConfig.__dataclass_fields__})
+
+    oidc = None
+    if "oidc" in config_yaml:
+        oidc = OIDCConfig(**{key: display(config_yaml["oidc"], key) for key in OIDCConfig.__dataclass_fields__})
+
+    dns = DNSConfig(**{key: display(config_yaml.get("dns_config") or {}, key) for key in DNSConfig.__dataclass_fields__})
+
+    derp        = config_yaml.get("derp") or {}
+    derp_server = None
+    if "server" in derp and derp["server"].get("enabled"):
+        derp_server = DERPServerConfig(**{key: display(derp["server"], key) for key in DERPServerConfig.__dataclass_fields__})
+
+    derp_paths   = tuple(derp.get("paths") or ())
+    derp_regions = []
+    derp_errors  = []
+    for derp_path in derp_paths:
+        derp_path = resolve_derp_path(path, derp_path)
+        watched.append((derp_path, file_signature(derp_path)))
+        try:
+            derp_regions.extend(load_derp_map(derp_path))
+        except (OSError, yaml.YAMLError, AttributeError) as error:
+            app.logger.error("Failed loading DERP map %s:  %s", derp_path, str(error))
+            derp_errors.append(derp_path)
+
+    return HeadscaleConfig(
+        path         = path,
+        general      = general,
+        dns          = dns,
+        oidc         = oidc,
+        derp_server  = derp_server,
+        derp_paths   = derp_paths,
+        derp_regions = tuple(derp_regions),
+        derp_errors  = tuple(derp_errors),
+        watched      = tuple(watched)
+    )
+
+# The last loaded config.  Reloaded only when the config file or one of its DERP maps changes.
+cached_config = None
+config_lock   = threading.Lock()
+
+def find_config_path():
+    for path in CONFIG_PATHS:
+        if os.access(path, os.R_OK): return path
+    return None
+
+def get_config():
+    """ Returns the parsed Headscale config, re-reading it only when a watched file changed """
+    global cached_config
+    current = cached_config
+    path    = find_config_path()
+    if path is None: raise FileNotFoundError("No readable Headscale configuration in "+", ".join(CONFIG_PATHS))
+    if current is not None and current.path == path and all(file_signature(watched) == signature for watched, signature in current.watched):
+        return current
+    with config_lock:
+        cached_config = load_config(path)
+        return cached_config
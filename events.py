@@ -0,0 +1,162 @@
+# pylint: disable=wrong-import-order
+
+import headscale, helper, renderer, scheduler, shared, timeutil, os, logging, json, queue, sqlite3, threading
+from flask import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# Live machine status, pushed to browsers as Server-Sent Events
+##################################################################
+# One poller is shared by every connected browser.  Each poll is compared with the
+# previous one and only the machines that changed are sent.
+#
+# With SHARED_DIR set, only the leader worker polls, while a browser is connected to any
+# worker.  It appends the events to the shared store, and every worker with browsers
+# connected relays them from there (see relay()).
+
+# How often, in seconds, Headscale is polled while at least one browser is connected
+LIVE_POLL_INTERVAL = int(os.environ.get("LIVE_POLL_INTERVAL", "10"))
+# Every connected browser holds a server thread, so the number of streams is capped
+LIVE_MAX_CLIENTS   = int(os.environ.get("LIVE_MAX_CLIENTS",   "8"))
+# Comment lines sent on idle streams so proxies don't close them, and so a
+# disconnected browser is noticed
+KEEPALIVE_INTERVAL = 15
+# Events queued for a browser that isn't reading are dropped after this many
+QUEUE_SIZE         = 16
+# How often, in seconds, a worker checks the shared store for events.  It also tells the
+# leader that it has browsers connected each time.
+RELAY_INTERVAL     = 1
+
+subscribers      = set()
+subscribers_lock = threading.Lock()
+# machine id -> signature of the fields sent to browsers, from the last poll
+last_state       = {}
+
+def subscribe():
+    """ Registers a new browser.  Returns its event queue, or None when LIVE_MAX_CLIENTS are connected """
+    with subscribers_lock:
+        if len(subscribers) >= LIVE_MAX_CLIENTS: return None
+        subscriber = queue.Queue(maxsize=QUEUE_SIZE)
+        subscribers.add(subscriber)
+        app.logger.info("Live status client connected (%i total)", len(subscribers))
+    if shared.ENABLED: relay_job.start()
+    else:              poll_job.start()
+    return subscriber
+
+def unsubscribe(subscriber):
+    with subscribers_lock:
+        subscribers.discard(subscriber)
+        app.logger.info("Live status client disconnected (%i total)", len(subscribers))
+
+def publish(event, data):
+    message = "event: "+event+"\ndata: "+json.dumps(data, separators=(",", ":"))+"\n\n"
+    if shared.ENABLED:
+        try:    shared.store.append_event(message)
+        except sqlite3.Error as error: app.logger.error("Failed writing a live status event to the shared store:  %s", str(error))
+        return
+    deliver(message)
+
+def deliver(message):
+    with subscribers_lock: targets = list(subscribers)
+    for subscriber in targets:
+        try:    subscriber.put_nowait(message)
+        except queue.Full: app.logger.warning("Live status client is not keeping up.  Dropping an event")
+
+# The fields of a machine that its card shows and the stream can update
+def machine_status(machine, routes, context):
+    last_seen                  = context.since(machine["lastSeen"])
+    expiry_time, expiring_soon = renderer.format_expiry(machine, context)
+    return {
+        "id"            : machine["id"],
+        "online"        : machine.get("online", False),
+        "last_seen"     : last_seen.relative,
+        "last_seen_text": last_seen.text,
+        "status_color"  : helper.text_color_duration(last_seen.delta),
+        "expiry"        : expiry_time,
+        "expiring_soon" : expiring_soon,
+        "routes"        : [{"id": route["id"], "enabled": route["enabled"]} for route in routes],
+    }
+
+def poll():
+    """ Fetches the machine list and publishes what changed since the last poll """
+    global last_state
+    if not connected(): return True
+    url               = headscale.get_url()
+    api_key           = headscale.get_api_key()
+    machines          = headscale.get_machines(url, api_key)["machines"]
+    routes_by_machine = headscale.get_routes_by_machine(url, api_key)
+    context           = timeutil.RenderContext()
+
+    state   = {}
+    changed = []
+    for machine in machines:
+        routes    = routes_by_machine.get(str(machine["id"]), {"routes": []})["routes"]
+        status    = machine_status(machine, routes, context)
+        # The status color is part of the signature so a machine that has gone quiet
+        # is sent when its badge should change color, even though lastSeen hasn't:
+        signature = (machine["lastSeen"], status["online"], machine["expiry"], status["status_color"],
+            tuple((route["id"], route["enabled"], route["advertised"]) for route in routes))
+        state[machine["id"]] = signature
+        if last_state and last_state.get(machine["id"]) != signature: changed.append(status)
+    removed    = [machine_id for machine_id in last_state if machine_id not in state]
+    last_state = state
+
+    if changed or removed:
+        app.logger.info("Live status:  %i machines changed, %i removed", len(changed), len(removed))
+        publish("machines", {"changed": changed, "removed": removed})
+    return True
+
+# Leader only:  with SHARED_DIR set, every worker starts it (see server.py) and the leader runs it
+poll_job = scheduler.IntervalJob("live-poll", poll, LIVE_POLL_INTERVAL, leader_only=True)
+
+# Whether a browser is connected to this worker or, with SHARED_DIR set, to any worker
+def connected():
+    with subscribers_lock:
+        if subscribers: return True
+    if not shared.ENABLED: return False
+    try:
+        return bool(shared.store.state_names("live:", max_age=5*RELAY_INTERVAL))
+    except sqlite3.Error as error:
+        app.logger.error("Failed reading the live status clients from the shared store:  %s", str(error))
+        return False
+
+# Id of the last shared event delivered by this worker.  None until relay() first runs.
+last_event_id = None
+
+def relay():
+    """ Delivers the events published through the shared store to this worker's browsers """
+    global last_event_id
+    with subscribers_lock: count = len(subscribers)
+    if not count:
+        last_event_id = None
+        return True
+    shared.publish_state("live:"+str(os.getpid()), count)
+    if last_event_id is None:
+        last_event_id = shared.store.last_event_id()
+        return True
+    for event_id, message in shared.store.events_after(last_event_id):
+        deliver(message)
+        last_event_id = event_id
+    return True
+
+relay_job = scheduler.IntervalJob("live-relay", relay, RELAY_INTERVAL)
+
+def stream(subscriber):
+    """ Yields the Server-Sent Events for one browser until it disconnects """
+    try:
+        # Tell EventSource how long to wait, in milliseconds, before reconnecting:
+        yield "retry: "+str(LIVE_POLL_INTERVAL*1000)+"\n\n"
+        while True:
+            try:    yield subscriber.get(timeout=KEEPALIVE_INTERVAL)
+            except queue.Empty: yield ": keepalive\n\n"
+    finally:
+        unsubscribe(subscriber)
@@ -0,0 +1,22 @@
+# Read by gunicorn from the working directory.  The command line in the Dockerfile sets everything else.
+#
+# With PROMETHEUS_MULTIPROC_DIR set, every worker writes its metrics to files in that directory
+# and /metrics reports the sum over all workers (see metrics.py).  With SHARED_DIR set, the
+# workers share cached responses and background job results (see shared.py).
+
+import os, shutil
+
+# Metrics left over from a previous run would be added to this run's totals, and its cached
+# responses may be stale
+def on_starting(server):
+    for name in ("PROMETHEUS_MULTIPROC_DIR", "SHARED_DIR"):
+        directory = os.environ.get(name)
+        if not directory: continue
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+
+# Drops the gauges of a worker that exited.  Its counters and histograms are kept.
+def child_exit(server, worker):
+    if not os.environ.get("PROMETHEUS_MULTIPROC_DIR"): return
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,10 +1,11 @@
 # pylint: disable=wrong-import-order
 
-import requests, json, os, logging
+import requests, json, os, logging, asyncio, aiohttp, tempfile, threading, codecs, time, cache, metrics, timeutil
 from cryptography.fernet import Fernet
-from datetime            import timedelta, date
-from dateutil            import parser
+from datetime            import timedelta, date, datetime, timezone
 from flask               import Flask
+from requests.adapters   import HTTPAdapter
+from urllib3.util.retry  import Retry
 
 LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
 # Initiate the Flask application and logging:
@@ -16,70 +17,273 @@ match LOG_LEVEL:
     case "ERROR"   : app.logger.setLevel(logging.ERROR)
     case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
 
+##################################################################
+# Shared HTTP client for the Headscale REST API
+##################################################################
+
+class HeadscaleClient():
+    """ Keep-alive HTTP client with a shared connection pool for all calls to Headscale """
+    def __init__(self, pool_size=32, timeout=30.0, retries=3, backoff=0.3):
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({'Accept': 'application/json'})
+
+        # Only idempotent GETs are retried.  Writes are sent exactly once.
+        retry = Retry(
+            total            = retries,
+            backoff_factor   = backoff,
+            status_forcelist = (502, 503, 504),
+            allowed_methods  = frozenset(["GET"]),
+            raise_on_status  = False
+        )
+        # pool_maxsize is the number of connections kept alive per host.  It should be at
+        # least as large as the renderer's executor so worker threads don't wait on a socket.
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://",  adapter)
+        self.session.mount("https://", adapter)
+
+    def request(self, method, url, api_key, path, params=None, data=None, stream=False):
+        headers = {} if api_key is None else {'Authorization': 'Bearer '+str(api_key)}
+        if data is not None: headers['Content-Type'] = 'application/json'
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method,
+                str(url).rstrip("/")+path,
+                params  = params,
+                data    = data,
+                headers = headers,
+                timeout = self.timeout,
+                stream  = stream
+            )
+        except requests.exceptions.RequestException:
+            metrics.observe_upstream(time.perf_counter()-started, True)
+            raise
+        metrics.observe_upstream(time.perf_counter()-started, response.status_code >= 400)
+        return response
+
+    def get(self, url, api_key, path, params=None):
+        return self.request("GET", url, api_key, path, params=params)
+
+    def post(self, url, api_key, path, params=None, data=None):
+        return self.request("POST", url, api_key, path, params=params, data=data)
+
+    def delete(self, url, api_key, path):
+        return self.request("DELETE", url, api_key, path)
+
+# One client per process.  Every function below, and every thread renderer.py
+# spawns, goes through the same connection pool.
+client = HeadscaleClient(
+    pool_size = int  (os.environ.get("HS_POOL_SIZE",   "32" )),
+    timeout   = float(os.environ.get("HS_TIMEOUT",     "30" )),
+    retries   = int  (os.environ.get("HS_RETRIES",     "3"  )),
+    backoff   = float(os.environ.get("HS_RETRY_BACKOFF", "0.3"))
+)
+
+class AsyncHeadscaleClient():
+    """ asyncio client used to overlap many Headscale requests on a single thread """
+    def __init__(self, url, api_key, concurrency=32, timeout=30.0):
+        self.url         = str(url).rstrip("/")
+        self.api_key     = api_key
+        self.concurrency = concurrency
+        self.timeout     = timeout
+        self.session     = None
+        self.semaphore   = None
+
+    async def __aenter__(self):
+        # The session and semaphore must be created inside the running event loop
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session   = aiohttp.ClientSession(
+            connector = aiohttp.TCPConnector(limit=self.concurrency),
+            timeout   = aiohttp.ClientTimeout(total=self.timeout),
+            headers   = {
+                'Accept': 'application/json',
+                'Authorization': 'Bearer '+str(self.api_key)
+            }
+        )
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.session.close()
+
+    async def get(self, path, params=None):
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                async with self.session.get(self.url+path, params=params) as response:
+                    body = await response.json(content_type=None)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                metrics.observe_upstream(time.perf_counter()-started, True)
+                raise
+            metrics.observe_upstream(time.perf_counter()-started, response.status >= 400)
+            return response.status, body
+
+FANOUT_CONCURRENCY = int(os.environ.get("HS_FANOUT_CONCURRENCY", "32"))
+
+def fan_out(url, api_key, calls):
+    """ Runs a list of (path, params) GETs concurrently and returns (status, JSON body) pairs in order """
+    async def run():
+        async with AsyncHeadscaleClient(url, api_key, FANOUT_CONCURRENCY, client.timeout) as async_client:
+            return await asyncio.gather(*(async_client.get(path, params) for path, params in calls))
+    if not calls: return []
+    return asyncio.run(run())
+
+# GETs "path", serving and storing successful responses in the shared response cache.
+# "key" comes from cache.make_key(endpoint, {...}).  With "failure" set, a failed request
+# is logged as "failure:  <response or error>".
+def cached_get(key, url, api_key, path, params=None, failure=None):
+    found, value = cache.responses.get(key)
+    if found: return value
+    try:
+        response = client.get(url, api_key, path, params=params)
+    except requests.exceptions.RequestException as error:
+        if failure: app.logger.error("%s:  %s", failure, str(error))
+        raise
+    body = response.json()
+    if response.status_code == 200: cache.responses.set(key, body, cache.TTLS[key[0]])
+    elif failure:                   app.logger.error("%s:  %s", failure, response.text)
+    return body
+
+# Like cached_get, but for many requests at once.  "calls" maps a cache key to (path, params).
+# Only the misses are sent to Headscale, concurrently.  Returns {key: body}.
+def cached_fan_out(url, api_key, calls):
+    bodies = {}
+    misses = []
+    for key in calls:
+        found, value = cache.responses.get(key)
+        if found: bodies[key] = value
+        else:     misses.append(key)
+    for key, (status, body) in zip(misses, fan_out(url, api_key, [calls[key] for key in misses])):
+        if status == 200: cache.responses.set(key, body, cache.TTLS[key[0]])
+        bodies[key] = body
+    return bodies
+
+# Size of the reads used when a response body is decoded while it downloads.
+STREAM_CHUNK_SIZE = int(os.environ.get("HS_STREAM_CHUNK_SIZE", "16384"))
+
+# Decodes the objects inside the top-level array "field" of a JSON document as the
+# document arrives.  "chunks" is an iterable of bytes.  Each object is yielded as soon
+# as its closing brace has been received.  Raises ValueError if the chunks run out
+# before the array's closing bracket, as they do for a truncated or malformed document.
+def iter_json_array(chunks, field):
+    decoder = json.JSONDecoder()
+    text    = codecs.getincrementaldecoder("utf-8")()
+    marker  = '"'+field+'"'
+    buffer  = ""
+    started = False
+    for chunk in chunks:
+        buffer += text.decode(chunk)
+        if not started:
+            start = buffer.find(marker)
+            if start == -1: continue
+            bracket = buffer.find("[", start+len(marker))
+            if bracket == -1: continue
+            buffer  = buffer[bracket+1:]
+            started = True
+        while True:
+            buffer = buffer.lstrip(" \t\r\n,")
+            if buffer.startswith("]"): return
+            try: item, end = decoder.raw_decode(buffer)
+            except ValueError: break   # The next object isn't complete yet
+            yield item
+            buffer = buffer[end:]
+    if not started: raise ValueError("No \""+field+"\" array in the response")
+    raise ValueError("The response ended before the end of the \""+field+"\" array")
+
 ##################################################################
 # Functions related to HEADSCALE and API KEYS
 ##################################################################
 
 def get_url():  return os.environ['HS_SERVER']
 
+# Returns the status code of Headscale's /health endpoint, or 0 if it can't be reached
+@metrics.upstream
+def get_health(url):
+    try:
+        return client.get(url, None, "/health").status_code
+    except requests.exceptions.RequestException as error:
+        app.logger.error("Headscale health check failed:  %s", str(error))
+        return 0
+
+# Key file on the filesystem for persistent storage
+KEY_FILE = "/data/key.txt"
+
+# The decrypted key is held in memory as (file signature, key).  It is only re-read
+# and decrypted when the file's inode, mtime or size changes.
+api_key_cache = (None, None)
+api_key_lock  = threading.Lock()
+
+def key_file_signature(stat):
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
 def set_api_key(api_key):
+    global api_key_cache
     # User-set encryption key
-    encryption_key = os.environ['KEY']                      
-    # Key file on the filesystem for persistent storage
-    key_file       = open("/data/key.txt", "wb+")
+    encryption_key = os.environ['KEY']
     # Preparing the Fernet class with the key
-    fernet         = Fernet(encryption_key)                 
+    fernet         = Fernet(encryption_key)
     # Encrypting the key
-    encrypted_key  = fernet.encrypt(api_key.encode())       
-    # Return true if the file wrote correctly
-    return True if key_file.write(encrypted_key) else False 
+    encrypted_key  = fernet.encrypt(api_key.encode())
+
+    # Write to a temporary file and rename it over the key file, so
+    # concurrent readers see either the old key or the new one, never a partial file.
+    with api_key_lock:
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(KEY_FILE), prefix=".key.txt.")
+        try:
+            with os.fdopen(tmp_fd, "wb") as tmp_file:
+                tmp_file.write(encrypted_key)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_path, KEY_FILE)
+        except OSError as error:
+            app.logger.error("Failed writing the API key to %s:  %s", KEY_FILE, str(error))
+            if os.path.exists(tmp_path): os.unlink(tmp_path)
+            return False
+        api_key_cache = (key_file_signature(os.stat(KEY_FILE)), api_key)
+    return True
 
 def get_api_key():
-    if not os.path.exists("/data/key.txt"): return False
-    # User-set encryption key
-    encryption_key = os.environ['KEY']                      
-    # Key file on the filesystem for persistent storage
-    key_file       = open("/data/key.txt", "rb+")           
-    # The encrypted key read from the file
-    enc_api_key    = key_file.read()                        
-    if enc_api_key == b'': return "NULL"
-
-    # Preparing the Fernet class with the key
-    fernet         = Fernet(encryption_key)                 
-    # Decrypting the key
-    decrypted_key  = fernet.decrypt(enc_api_key).decode()   
-
+    global api_key_cache
+    try:    signature = key_file_signature(os.stat(KEY_FILE))
+    except FileNotFoundError: return False
+    cached_signature, cached_key = api_key_cache
+    if signature == cached_signature: return cached_key
+
+    with api_key_lock:
+        # The encrypted key read from the file
+        with open(KEY_FILE, "rb") as key_file:
+            signature   = key_file_signature(os.fstat(key_file.fileno()))
+            enc_api_key = key_file.read()
+        if enc_api_key == b'':
+            decrypted_key = "NULL"
+        else:
+            # User-set encryption key
+            encryption_key = os.environ['KEY']
+            # Preparing the Fernet class with the key
+            fernet         = Fernet(encryption_key)
+            # Decrypting the key
+            decrypted_key  = fernet.decrypt(enc_api_key).decode()
+        api_key_cache = (signature, decrypted_key)
     return decrypted_key
 
+@metrics.upstream
 def test_api_key(url, api_key):
-    response = requests.get(
-        str(url)+"/api/v1/apikey",
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.get(url, api_key, "/api/v1/apikey")
     return response.status_code
 
 # Expires an API key
+@metrics.upstream
 def expire_key(url, api_key):
     payload = {'prefix':str(api_key[0:10])}
     json_payload=json.dumps(payload)
     app.logger.debug("Sending the payload '"+str(json_payload)+"' to the headscale server")
 
-    response = requests.post(
-        str(url)+"/api/v1/apikey/expire",
-        data=json_payload,
-        headers={
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-            }
-    )
+    response = client.post(url, api_key, "/api/v1/apikey/expire", data=json_payload)
     return response.status_code
 
 # Checks if the key needs to be renewed
 # If it does, renews the key, then expires the old key
+@metrics.upstream
 def renew_api_key(url, api_key):
     # 0 = Key has been updated or key is not in need of an update
     # 1 = Key has failed validity check or has failed to write the API key 
@@ -87,7 +291,7 @@ def renew_api_key(url, api_key):
     key_info            = get_api_key_info(url, api_key)
     expiration_time     = key_info["expiration"]
     today_date          = date.today()
-    expire              = parser.parse(expiration_time)
+    expire              = timeutil.parse_timestamp(expiration_time)
     expire_fmt          = str(expire.year) + "-" + str(expire.month).zfill(2) + "-" + str(expire.day).zfill(2)
     expire_date         = date.fromisoformat(expire_fmt)
     delta               = expire_date - today_date
@@ -101,15 +305,7 @@ def renew_api_key(url, api_key):
         json_payload=json.dumps(payload)
         app.logger.debug("Sending the payload '"+str(json_payload)+"' to the headscale server")
 
-        response = requests.post(
-            str(url)+"/api/v1/apikey",
-            data=json_payload,
-            headers={
-                'Accept': 'application/json',
-                'Content-Type': 'application/json',
-                'Authorization': 'Bearer '+str(api_key)
-                }
-        )
+        response = client.post(url, api_key, "/api/v1/apikey", data=json_payload)
         new_key = response.json()
         app.logger.debug("JSON:  "+json.dumps(new_key))
         app.logger.debug("New Key is:  "+new_key["apiKey"])
@@ -130,15 +326,10 @@ def renew_api_key(url, api_key):
     else: return True       # No work is required
 
 # Gets information about the current API key
+@metrics.upstream
 def get_api_key_info(url, api_key):
     app.logger.info("Getting API key information")
-    response = requests.get(
-        str(url)+"/api/v1/apikey",
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.get(url, api_key, "/api/v1/apikey")
     json_response = response.json()
     # Find the current key in the array:  
     key_prefix = str(api_key[0:10])
@@ -155,44 +346,28 @@ def get_api_key_info(url, api_key):
 ##################################################################
 
 # register a new machine
+@metrics.upstream
 def register_machine(url, api_key, machine_key, user):
     app.logger.info("Registering machine %s to user %s", str(machine_key), str(user))
-    response = requests.post(
-        str(url)+"/api/v1/machine/register?user="+str(user)+"&key="+str(machine_key),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/machine/register", params={"user": str(user), "key": str(machine_key)})
     return response.json()
 
 
 # Sets the machines tags
+@metrics.upstream
 def set_machine_tags(url, api_key, machine_id, tags_list):
     app.logger.info("Setting machine_id %s tag %s", str(machine_id), str(tags_list))
-    response = requests.post(
-        str(url)+"/api/v1/machine/"+str(machine_id)+"/tags",
-        data=tags_list,
-        headers={
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-            }
-    )
+    response = client.post(url, api_key, "/api/v1/machine/"+str(machine_id)+"/tags", data=tags_list)
     return response.json()
 
 # Moves machine_id to user "new_user"
+@metrics.upstream
 def move_user(url, api_key, machine_id, new_user):
     app.logger.info("Moving machine_id %s to user %s", str(machine_id), str(new_user))
-    response = requests.post(
-        str(url)+"/api/v1/machine/"+str(machine_id)+"/user?user="+str(new_user),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/machine/"+str(machine_id)+"/user", params={"user": str(new_user)})
     return response.json()
 
+@metrics.upstream
 def update_route(url, api_key, route_id, current_state):
     action = ""
     if current_state == "True":  action = "disable"
@@ -205,49 +380,54 @@ def update_route(url, api_key, route_id, current_state):
     app.logger.debug("Current State:  "+str(current_state))
     app.logger.debug("Action to take:  "+str(action))
 
-    response = requests.post(
-        str(url)+"/api/v1/routes/"+str(route_id)+"/"+str(action),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/routes/"+str(route_id)+"/"+str(action))
     return response.json()
 
 # Get all machines on the Headscale network
+@metrics.upstream
 def get_machines(url, api_key):
     app.logger.info("Getting machine information")
-    response = requests.get(
-        str(url)+"/api/v1/machine",
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
-    return response.json()
+    return cached_get(cache.make_key("machines"), url, api_key, "/api/v1/machine")
+
+# Yields machines one at a time while /api/v1/machine is still downloading, so callers
+# can start rendering before the whole list is decoded.  The list is cached under the
+# same key as get_machines, but only once its closing bracket has been read.
+def iter_machines(url, api_key):
+    key = cache.make_key("machines")
+    found, value = cache.responses.get(key)
+    if found:
+        yield from value["machines"]
+        return
+
+    app.logger.info("Streaming machine information")
+    machines = []
+    # metrics.upstream would return before a generator runs, so only the request is labelled here
+    with metrics.calling("iter_machines"):
+        response = client.request("GET", url, api_key, "/api/v1/machine", stream=True)
+    with response:
+        if response.status_code != 200:
+            app.logger.error("Getting machines failed:  %s", response.text)
+            return
+        try:
+            for machine in iter_json_array(response.iter_content(chunk_size=STREAM_CHUNK_SIZE), "machines"):
+                machines.append(machine)
+                yield machine
+        except ValueError as error:
+            app.logger.error("Getting machines failed after %i machines:  %s", len(machines), str(error))
+            return
+    cache.responses.set(key, {"machines": machines}, cache.TTLS["machines"])
 
 # Get machine with "machine_id" on the Headscale network
+@metrics.upstream
 def get_machine_info(url, api_key, machine_id):
     app.logger.info("Getting information for machine ID %s", str(machine_id))
-    response = requests.get(
-        str(url)+"/api/v1/machine/"+str(machine_id),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
-    return response.json()
+    return cached_get(cache.make_key("machine", {"id": str(machine_id)}), url, api_key, "/api/v1/machine/"+str(machine_id))
 
 # Delete a machine from Headscale
+@metrics.upstream
 def delete_machine(url, api_key, machine_id):
     app.logger.info("Deleting machine %s", str(machine_id))
-    response = requests.delete(
-        str(url)+"/api/v1/machine/"+str(machine_id),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.delete(url, api_key, "/api/v1/machine/"+str(machine_id))
     status = "True" if response.status_code == 200 else "False"
     if response.status_code == 200:
         app.logger.info("Machine deleted.")
@@ -256,15 +436,10 @@ def delete_machine(url, api_key, machine_id):
     return {"status": status, "body": response.json()}
 
 # Rename "machine_id" with name "new_name"
+@metrics.upstream
 def rename_machine(url, api_key, machine_id, new_name):
     app.logger.info("Renaming machine %s", str(machine_id))
-    response = requests.post(
-        str(url)+"/api/v1/machine/"+str(machine_id)+"/rename/"+str(new_name),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/machine/"+str(machine_id)+"/rename/"+str(new_name))
     status = "True" if response.status_code == 200 else "False"
     if response.status_code == 200:
         app.logger.info("Machine renamed")
@@ -272,60 +447,54 @@ def rename_machine(url, api_key, machine_id, new_name):
         app.logger.error("Machine rename failed!  %s", str(response.json()))
     return {"status": status, "body": response.json()}
 
+# Expire "machine_id".  It has to log in again to rejoin the tailnet.
+@metrics.upstream
+def expire_machine(url, api_key, machine_id):
+    app.logger.info("Expiring machine %s", str(machine_id))
+    response = client.post(url, api_key, "/api/v1/machine/"+str(machine_id)+"/expire")
+    status = "True" if response.status_code == 200 else "False"
+    if response.status_code == 200:
+        app.logger.info("Machine expired")
+    else:
+        app.logger.error("Machine expiry failed!  %s", str(response.json()))
+    return {"status": status, "body": response.json()}
+
 # Gets routes for the passed machine_id
+@metrics.upstream
 def get_machine_routes(url, api_key, machine_id):
     app.logger.info("Getting routes for machine %s", str(machine_id))
-    response = requests.get(
-        str(url)+"/api/v1/machine/"+str(machine_id)+"/routes",
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
-    if response.status_code == 200:
-        app.logger.info("Routes obtained")
-    else:
-        app.logger.error("Failed to get routes:  %s", str(response.json()))
-    return response.json()
+    return cached_get(cache.make_key("machine_routes", {"id": str(machine_id)}), url, api_key, "/api/v1/machine/"+str(machine_id)+"/routes",
+        failure="Failed to get routes")
 
 # Gets routes for the entire tailnet
+@metrics.upstream
 def get_routes(url, api_key):
     app.logger.info("Getting routes")
-    response = requests.get(
-        str(url)+"/api/v1/routes",
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
-    return response.json()
+    return cached_get(cache.make_key("routes"), url, api_key, "/api/v1/routes")
+
+# Gets routes for the entire tailnet in one request and groups them by machine.
+# Returns {machine_id: {"routes": [...]}}, the same shape as get_machine_routes.
+def get_routes_by_machine(url, api_key):
+    routes_by_machine = {}
+    for route in get_routes(url, api_key)["routes"]:
+        routes_by_machine.setdefault(str(route["machine"]["id"]), {"routes": []})["routes"].append(route)
+    return routes_by_machine
 
 ##################################################################
 # Functions related to NAMESPACES
 ##################################################################
 
 # Get all users in use
+@metrics.upstream
 def get_users(url, api_key):
     app.logger.info("Getting Users")
-    response = requests.get(
-        str(url)+"/api/v1/user",
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
-    return response.json()
+    return cached_get(cache.make_key("users"), url, api_key, "/api/v1/user")
 
 # Rename "old_name" with name "new_name"
+@metrics.upstream
 def rename_user(url, api_key, old_name, new_name):
     app.logger.info("Renaming user %s to %s.", str(old_name), str(new_name))
-    response = requests.post(
-        str(url)+"/api/v1/user/"+str(old_name)+"/rename/"+str(new_name),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/user/"+str(old_name)+"/rename/"+str(new_name))
     status = "True" if response.status_code == 200 else "False"
     if response.status_code == 200:
         app.logger.info("User renamed.")
@@ -334,15 +503,10 @@ def rename_user(url, api_key, old_name, new_name):
     return {"status": status, "body": response.json()}
 
 # Delete a user from Headscale
+@metrics.upstream
 def delete_user(url, api_key, user_name):
     app.logger.info("Deleting a User:  %s", str(user_name))
-    response = requests.delete(
-        str(url)+"/api/v1/user/"+str(user_name),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.delete(url, api_key, "/api/v1/user/"+str(user_name))
     status = "True" if response.status_code == 200 else "False"
     if response.status_code == 200:
         app.logger.info("User deleted.")
@@ -351,17 +515,10 @@ def delete_user(url, api_key, user_name):
     return {"status": status, "body": response.json()}
 
 # Add a user from Headscale
+@metrics.upstream
 def add_user(url, api_key, data):
     app.logger.info("Adding user:  %s", str(data))
-    response = requests.post(
-        str(url)+"/api/v1/user",
-        data=data,
-        headers={
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/user", data=data)
     status = "True" if response.status_code == 200 else "False"
     if response.status_code == 200:
         app.logger.info("User added.")
@@ -374,30 +531,54 @@ def add_user(url, api_key, data):
 ##################################################################
 
 # Get all PreAuth keys associated with a user "user_name"
+@metrics.upstream
 def get_preauth_keys(url, api_key, user_name):
     app.logger.info("Getting PreAuth Keys in User %s", str(user_name))
-    response = requests.get(
-        str(url)+"/api/v1/preauthkey?user="+str(user_name),
-        headers={
-            'Accept': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
-    return response.json()
+    key = cache.make_key("preauth_keys", {"user": str(user_name)})
+    return cached_get(key, url, api_key, "/api/v1/preauthkey", params={"user": str(user_name)})
+
+# Get all PreAuth keys for every user in "user_names" concurrently.  Returns {user_name: keys}
+@metrics.upstream
+def get_preauth_keys_for_users(url, api_key, user_names):
+    app.logger.info("Getting PreAuth Keys for %i users", len(user_names))
+    calls = {
+        cache.make_key("preauth_keys", {"user": str(user_name)}): ("/api/v1/preauthkey", {"user": str(user_name)})
+        for user_name in user_names
+    }
+    bodies = cached_fan_out(url, api_key, calls)
+    return {user_name: bodies[key] for user_name, key in zip(user_names, calls)}
+
+# Counts PreAuth keys across every user in one pass.  Every user's keys are fetched
+# concurrently and the aggregate is cached until a key or user changes.
+@metrics.upstream
+def get_preauth_key_summary(url, api_key):
+    key          = cache.make_key("preauth_summary")
+    found, value = cache.responses.get(key)
+    if found: return value
+
+    app.logger.info("Building the PreAuth key summary")
+    user_names   = [user["name"] for user in get_users(url, api_key)["users"]]
+    keys_by_user = get_preauth_keys_for_users(url, api_key, user_names)
+    now          = datetime.now(timezone.utc)
+    summary      = {"users": len(user_names), "total": 0, "usable": 0, "expired": 0, "reusable": 0, "used": 0, "ephemeral": 0}
+    for preauth_keys in keys_by_user.values():
+        for preauth_key in preauth_keys.get("preAuthKeys", []):
+            key_expired = timeutil.parse_timestamp(preauth_key["expiration"]) < now
+            summary["total"] += 1
+            if key_expired:               summary["expired"]   += 1
+            if preauth_key["reusable"]:   summary["reusable"]  += 1
+            if preauth_key["used"]:       summary["used"]      += 1
+            if preauth_key["ephemeral"]:  summary["ephemeral"] += 1
+            if not key_expired and (preauth_key["reusable"] or not preauth_key["used"]): summary["usable"] += 1
+    cache.responses.set(key, summary, cache.TTLS["preauth_summary"])
+    return summary
 
 # Add a preauth key to the user "user_name" given the booleans "ephemeral" 
 # and "reusable" with the expiration date "date" contained in the JSON payload "data"
+@metrics.upstream
 def add_preauth_key(url, api_key, data):
     app.logger.info("Adding PreAuth Key:  %s", str(data))
-    response = requests.post(
-        str(url)+"/api/v1/preauthkey",
-        data=data,
-        headers={
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/preauthkey", data=data)
     status = "True" if response.status_code == 200 else "False"
     if response.status_code == 200:
         app.logger.info("PreAuth Key added.")
@@ -406,17 +587,10 @@ def add_preauth_key(url, api_key, data):
     return {"status": status, "body": response.json()}
 
 # Expire a pre-auth key.  data is {"user": "string", "key": "string"}
+@metrics.upstream
 def expire_preauth_key(url, api_key, data):
     app.logger.info("Expiring PreAuth Key...")
-    response = requests.post(
-        str(url)+"/api/v1/preauthkey/expire",
-        data=data,
-        headers={
-            'Accept': 'application/json',
-            'Content-Type': 'application/json',
-            'Authorization': 'Bearer '+str(api_key)
-        }
-    )
+    response = client.post(url, api_key, "/api/v1/preauthkey/expire", data=data)
     status = "True" if response.status_code == 200 else "False"
     app.logger.debug("expire_preauth_key - Return:  "+str(response.json()))
     app.logger.debug("expire_preauth_key - Status:  "+str(status))
@@ -1,6 +1,6 @@
 # pylint: disable=wrong-import-order
 
-import os, headscale, requests, logging
+import os, headscale, config, logging, scheduler, shared, time, json, hashlib
 from flask import Flask
 
 LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
@@ -52,23 +52,52 @@ def text_color_duration(duration):
     if secs  > 30: return "green-text       text-lighten-2"
     return "green-text                     "
 
+# How often, in seconds, the background job validates and renews the API key
+KEY_CHECK_INTERVAL = int(os.environ.get("KEY_CHECK_INTERVAL", "300"))
+# Result of the last key check:  (valid, time checked).  None until the first check runs.
+key_status = None
+
 def key_check():
     """ Checks the validity of a Headsclae API key and renews it if it's nearing expiration """
+    # Only the leader worker renews, so the workers don't each create a new key.  The others
+    # read the renewed key from KEY_FILE.
+    global key_status
     api_key    = headscale.get_api_key()
     url        = headscale.get_url()
 
     # Test the API key.  If the test fails, return a failure. 
     # AKA, if headscale returns Unauthorized, fail:
     app.logger.info("Testing API key validity.")
-    status = headscale.test_api_key(url, api_key)
-    if status != 200: 
-        app.logger.info("Got a non-200 response from Headscale.  Test failed (Response:  %i)", status)
-        return False
-    else:
-        app.logger.info("Key check passed.")
-        # Check if the key needs to be renewed
-        headscale.renew_api_key(url, api_key)
-        return True
+    try:
+        status = headscale.test_api_key(url, api_key)
+        if status != 200: 
+            app.logger.info("Got a non-200 response from Headscale.  Test failed (Response:  %i)", status)
+            valid = False
+        else:
+            app.logger.info("Key check passed.")
+            # Check if the key needs to be renewed
+            if shared.is_leader(): headscale.renew_api_key(url, api_key)
+            valid = True
+    except Exception as error: # pylint: disable=broad-except
+        app.logger.error("Key check failed:  %s", str(error))
+        valid = False
+    key_status = (valid, time.time())
+    shared.publish_state("key_status", key_status)
+    return valid
+
+# Validates and renews the key in the background so page loads only read key_status
+key_check_job = scheduler.IntervalJob("key-check", key_check, KEY_CHECK_INTERVAL, leader_only=True)
+
+def get_key_status():
+    """ Returns the last key check made by any worker, or None """
+    status = shared.read_state("key_status")
+    return key_status if status is None else tuple(status)
+
+def key_valid():
+    """ Returns the cached result of the last key check """
+    status = get_key_status()
+    if status is None: return key_check()
+    return status[0]
 
 def get_color(import_id, item_type = ""):
     """ Sets colors for users/namespaces """
@@ -136,8 +165,15 @@ def format_message(error_type, title, message):
 
     return content
 
-def access_checks():
-    """ Checks various items before each page load to ensure permissions are correct """
+# How often, in seconds, the background job re-runs the access checks, and how soon after a failure
+HEALTH_CHECK_INTERVAL = int(os.environ.get("HEALTH_CHECK_INTERVAL", "30"))
+HEALTH_RETRY_INTERVAL = int(os.environ.get("HEALTH_RETRY_INTERVAL", "5"))
+# Snapshot of the last access checks.  None until the first check runs.
+health_status = None
+
+def run_health_checks():
+    """ Checks various items to ensure permissions are correct and publishes the results in health_status """
+    global health_status
     url = headscale.get_url()
 
     # Return an error message if things fail.
@@ -154,8 +190,8 @@ def access_checks():
 
     # Check 1: Check: the Headscale server is reachable:
     server_reachable = False
-    response = requests.get(str(url)+"/health")
-    if response.status_code == 200:
+    server_status    = headscale.get_health(url)
+    if server_status == 200:
         server_reachable = True
     else:
         checks_passed = False
@@ -189,15 +225,48 @@ def access_checks():
     else: app.logger.error("/data/key.txt EXIST: FAILED - NO ERROR")
 
     # Check: /etc/headscale/config.yaml is readable:
-    if os.access('/etc/headscale/config.yaml', os.R_OK):  config_readable = True
-    elif os.access('/etc/headscale/config.yml', os.R_OK): config_readable = True
+    if config.find_config_path() is not None: config_readable = True
     else:
         app.logger.error("/etc/headscale/config.y(a)ml: READ: FAILED")
         checks_passed = False
 
-    if checks_passed:
-        app.logger.info("All startup checks passed.")
-        return "Pass"
+    if checks_passed: app.logger.info("All startup checks passed.")
+    health_status = {
+        "passed"          : checks_passed,
+        "checked_at"      : time.time(),
+        "server_reachable": server_reachable,
+        "server_status"   : server_status,
+        "data_readable"   : data_readable,
+        "data_writable"   : data_writable,
+        "data_executable" : data_executable,
+        "file_exists"     : file_exists,
+        "file_readable"   : file_readable,
+        "file_writable"   : file_writable,
+        "config_readable" : config_readable,
+    }
+    shared.publish_state("health_status", health_status)
+    return checks_passed
+
+# Re-runs the checks in the background, and sooner after a failure, so page loads only read health_status
+health_check_job = scheduler.IntervalJob("health-check", run_health_checks, HEALTH_CHECK_INTERVAL, HEALTH_RETRY_INTERVAL, leader_only=True)
+
+def get_health_status():
+    """ Returns the latest health snapshot, from any worker """
+    status = shared.read_state("health_status")
+    if status is not None: return status
+    if health_status is None: run_health_checks()
+    return health_status
+
+def access_checks():
+    """ Formats the latest health snapshot.  Returns "Pass", or an error message for each failed check """
+    url    = headscale.get_url()
+    status = get_health_status()
+    if status["passed"]: return "Pass"
+
+    server_reachable, server_status = status["server_reachable"], status["server_status"]
+    data_readable, data_writable, data_executable = status["data_readable"], status["data_writable"], status["data_executable"]
+    file_exists, file_readable, file_writable     = status["file_exists"], status["file_readable"], status["file_writable"]
+    config_readable                               = status["config_readable"]
 
     message_html = ""
     # Generate the message:
@@ -206,7 +275,7 @@ def access_checks():
         message = """
         <p>Your headscale server is either unreachable or not properly configured. 
         Please ensure your configuration is correct (Check for 200 status on
-        """+url+"""/api/v1 failed.  Response:  """+str(response.status_code)+""".)</p>
+        """+url+"""/health failed.  Response:  """+str(server_status)+""".)</p>
         """
 
         message_html += format_message("Error", "Headscale unreachable", message)
@@ -280,7 +349,20 @@ def access_checks():
 def load_checks():
     """ Bundles all the checks into a single function to call easier """
     # General error checks.  See the function for more info:
-    if access_checks() != "Pass": return 'error_page'
+    if not get_health_status()["passed"]: return 'error_page'
     # If the API key fails, redirect to the settings page:
-    if not key_check(): return 'settings_page'
+    if not key_valid(): return 'settings_page'
     return "Pass"
+
+# Rendered pages show relative times ("5 minutes ago") that change even when the data
+# doesn't, so their ETags also include the current time bucket of this many seconds.
+ETAG_TIME_BUCKET = int(os.environ.get("ETAG_TIME_BUCKET", "60"))
+
+def time_bucket():
+    """ Number of the current ETAG_TIME_BUCKET second window """
+    return int(time.time() // ETAG_TIME_BUCKET)
+
+def content_etag(*parts):
+    """ Strong ETag from a hash of everything a response is built from """
+    serialized = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.blake2b(serialized.encode(), digest_size=16).hexdigest()
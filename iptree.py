@@ -0,0 +1,221 @@
+# pylint: disable=wrong-import-order
+
+import headscale, os, logging, ipaddress, threading, time
+from flask import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# Radix tree over machine addresses and advertised routes
+##################################################################
+# Answers "which machine owns this address" and "which subnet router serves it" with a
+# longest-prefix match, and finds advertised routes that duplicate or overlap each other.
+
+EXIT_ROUTES = ("0.0.0.0/0", "::/0")
+
+class Node():
+    """ One prefix in a RadixTree.  "value" holds the prefix's bits, left-aligned. """
+    __slots__ = ("value", "length", "children", "entries")
+    def __init__(self, value, length, entries=None):
+        self.value    = value
+        self.length   = length
+        self.children = [None, None]
+        self.entries  = entries
+
+class RadixTree():
+    """ Path-compressed binary trie of the prefixes of one address family """
+    def __init__(self, width):
+        self.width = width
+        self.root  = Node(0, 0)
+
+    def bit(self, value, position):
+        return (value >> (self.width - 1 - position)) & 1
+
+    def common_length(self, value, length, other_value, other_length):
+        """ How many leading bits two prefixes share """
+        shortest  = min(length, other_length)
+        different = value ^ other_value
+        if different == 0: return shortest
+        return min(self.width - different.bit_length(), shortest)
+
+    def insert(self, value, length, entry):
+        # bit() and common_length() are inlined here.  Building the index is mostly this loop.
+        width = self.width
+        node  = self.root
+        while node.length != length:
+            branch = (value >> (width - 1 - node.length)) & 1
+            child  = node.children[branch]
+            if child is None:
+                node.children[branch] = Node(value, length, [entry])
+                return
+            different = child.value ^ value
+            common    = min(child.length, length) if different == 0 else min(width - different.bit_length(), child.length, length)
+            if common == child.length:
+                node = child
+                continue
+            # The new prefix and the child part ways (or the new prefix ends) above the
+            # child, so a node for their shared bits is put between them:
+            shared = Node(value >> (width - common) << (width - common), common)
+            shared.children[self.bit(child.value, common)] = child
+            node.children[branch] = shared
+            if common == length: shared.entries = [entry]
+            else: shared.children[self.bit(value, common)] = Node(value, length, [entry])
+            return
+        if node.entries is None: node.entries = []
+        node.entries.append(entry)
+
+    def covering(self, value, length):
+        """ The nodes with entries whose prefix contains the given one, shortest first """
+        found = []
+        node  = self.root
+        while node is not None and node.length <= length and self.common_length(node.value, node.length, value, length) == node.length:
+            if node.entries: found.append(node)
+            if node.length == length: break
+            node = node.children[self.bit(value, node.length)]
+        return found
+
+    def within(self, value, length):
+        """ The nodes with entries whose prefix is inside the given one, the given one excluded """
+        node = self.root
+        while node is not None and node.length < length:
+            if self.common_length(node.value, node.length, value, length) < node.length: return []
+            node = node.children[self.bit(value, node.length)]
+        if node is None or self.common_length(node.value, node.length, value, length) < length: return []
+        found = []
+        stack = [child for child in node.children if child is not None] if node.length == length else [node]
+        while stack:
+            node = stack.pop()
+            if node.entries: found.append(node)
+            stack.extend(child for child in node.children if child is not None)
+        return found
+
+    def nodes(self):
+        """ Yields (node, covering nodes with entries) for every node with entries """
+        stack = [(self.root, ())]
+        while stack:
+            node, ancestors = stack.pop()
+            if node.entries:
+                yield node, ancestors
+                ancestors = ancestors + (node,)
+            stack.extend((child, ancestors) for child in node.children if child is not None)
+
+def parse(text):
+    """ Returns (family width, value, length) for an address or prefix.  Raises ValueError. """
+    network = ipaddress.ip_network(str(text).strip(), strict=False)
+    return network.max_prefixlen, int(network.network_address), network.prefixlen
+
+def prefix_text(width, value, length):
+    address = ipaddress.IPv4Address(value) if width == 32 else ipaddress.IPv6Address(value)
+    return str(address)+"/"+str(length)
+
+def machine_entry(machine, address):
+    return {"kind": "machine", "machine": machine["id"], "name": machine["givenName"], "user": machine["user"]["name"], "address": address}
+
+def route_entry(route):
+    return {
+        "kind"   : "route",
+        "route"  : route["id"],
+        "machine": route["machine"]["id"],
+        "name"   : route["machine"].get("givenName", route["machine"].get("name", "")),
+        "prefix" : route["prefix"],
+        "enabled": route["enabled"],
+        "primary": route.get("isPrimary", False),
+    }
+
+# Headscale sends traffic for a prefix to its primary route.  Without one (older
+# versions), every enabled route for the prefix is a candidate.
+def serving(routes):
+    enabled = [route for route in routes if route["enabled"]]
+    return [route for route in enabled if route["primary"]] or enabled
+
+class AddressIndex():
+    """ A RadixTree per address family, holding machine addresses and advertised routes """
+    def __init__(self, machines, routes):
+        self.trees = {32: RadixTree(32), 128: RadixTree(128)}
+        for machine in machines:
+            for address in machine["ipAddresses"]:
+                try:    width, value, length = parse(address)
+                except ValueError: continue
+                self.trees[width].insert(value, length, machine_entry(machine, address))
+        for route in routes:
+            # Routes of deleted machines are left behind with machine ID 0
+            if not route["advertised"] or int(route["machine"]["id"]) == 0: continue
+            try:    width, value, length = parse(route["prefix"])
+            except ValueError: continue
+            self.trees[width].insert(value, length, route_entry(route))
+
+    def lookup(self, text):
+        """ Who owns an address, and which routes contain it.  Raises ValueError. """
+        width, value, length = parse(text)
+        tree     = self.trees[width]
+        covering = tree.covering(value, length)
+        routes   = [entry for node in reversed(covering) for entry in node.entries if entry["kind"] == "route"]
+        # The longest matching prefix with an enabled route is where the traffic goes:
+        serving_routes = []
+        for node in reversed(covering):
+            serving_routes = serving([entry for entry in node.entries if entry["kind"] == "route"])
+            if serving_routes: break
+        result = {
+            "query"  : str(text),
+            "prefix" : prefix_text(width, value, length),
+            "owners" : [entry for node in covering if node.length == width for entry in node.entries if entry["kind"] == "machine"],
+            "routes" : routes,
+            "serving": serving_routes,
+        }
+        # A prefix query also lists the more specific routes inside it:
+        if length < width:
+            result["within"] = [entry for node in tree.within(value, length) for entry in node.entries if entry["kind"] == "route"]
+        return result
+
+    def overlaps(self):
+        """ Advertised routes that share a prefix, and routes inside another route.  Exit routes are left out. """
+        duplicates = []
+        overlaps   = []
+        for tree in self.trees.values():
+            for node, ancestors in tree.nodes():
+                routes = [entry for entry in node.entries if entry["kind"] == "route" and entry["prefix"] not in EXIT_ROUTES]
+                if not routes: continue
+                if len(routes) > 1:
+                    duplicates.append({"prefix": routes[0]["prefix"], "routes": routes, "serving": serving(routes)})
+                covering = []
+                for ancestor in ancestors:
+                    ancestor_routes = [entry for entry in ancestor.entries if entry["kind"] == "route" and entry["prefix"] not in EXIT_ROUTES]
+                    if ancestor_routes: covering.append({"prefix": ancestor_routes[0]["prefix"], "routes": ancestor_routes, "serving": serving(ancestor_routes)})
+                if covering:
+                    # The more specific prefix wins for the addresses inside it, if it is enabled
+                    overlaps.append({"prefix": routes[0]["prefix"], "routes": routes, "serving": serving(routes), "covered_by": covering})
+        return {"duplicates": duplicates, "overlaps": overlaps}
+
+# Everything AddressIndex reads.  The index is only rebuilt when this changes.
+def signature(machines, routes):
+    return (
+        tuple((machine["id"], machine["givenName"], machine["user"]["name"], tuple(machine["ipAddresses"])) for machine in machines),
+        tuple((route["id"], route["machine"]["id"], route["prefix"], route["advertised"], route["enabled"], route.get("isPrimary")) for route in routes)
+    )
+
+# The index and the cached machine and route lists it was built from.  Cached responses
+# are the same objects until they expire, and a new response usually carries the same
+# addresses and routes, so the index is rarely rebuilt.
+built = {"machines": None, "routes": None, "signature": None, "index": None}
+lock  = threading.Lock()
+
+def address_index(url, api_key):
+    machines = headscale.get_machines(url, api_key)["machines"]
+    routes   = headscale.get_routes(url, api_key)["routes"]
+    with lock:
+        if built["machines"] is machines and built["routes"] is routes: return built["index"]
+        current = signature(machines, routes)
+        if current != built["signature"]:
+            started = time.perf_counter()
+            built.update(signature=current, index=AddressIndex(machines, routes))
+            app.logger.info("Address index built from %i machines and %i routes in %.1f ms", len(machines), len(routes), (time.perf_counter()-started)*1000)
+        built.update(machines=machines, routes=routes)
+        return built["index"]
@@ -0,0 +1,143 @@
+# pylint: disable=wrong-import-order
+
+import os, logging, time, contextvars, secrets
+from contextlib        import contextmanager
+from functools         import wraps
+from flask             import Flask, g, request
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest, multiprocess
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# Prometheus metrics, served on /metrics
+##################################################################
+# With several gunicorn workers, PROMETHEUS_MULTIPROC_DIR points at a directory the workers
+# share (see gunicorn.conf.py).  Each worker writes its samples there and /metrics adds them
+# up, so whichever worker answers a scrape reports the totals.
+MULTIPROCESS = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+# /metrics needs the same login as the rest of the web UI.  A scraper that can't log in sends
+# "Authorization: Bearer <METRICS_TOKEN>" instead.  Empty disables the token.
+METRICS_TOKEN = os.environ.get("METRICS_TOKEN", "").replace('"', '')
+
+# Headscale answers most calls in milliseconds.  Pages for large tailnets take seconds.
+BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+upstream_seconds = Histogram("headscale_webui_upstream_request_seconds",
+    "Time for Headscale to answer a request (to the response headers, for streamed bodies), by the headscale.py function that sent it",
+    ["function"], buckets=BUCKETS)
+upstream_errors  = Counter("headscale_webui_upstream_errors_total",
+    "Headscale requests that failed or were answered with an error status, by the headscale.py function that sent them",
+    ["function"])
+request_seconds  = Histogram("headscale_webui_request_seconds",
+    "Time to serve a request, up to the last byte of a streamed body",
+    ["endpoint", "method", "status"], buckets=BUCKETS)
+render_seconds   = Histogram("headscale_webui_render_phase_seconds",
+    "Time spent in each phase of rendering a page:  fetch (waiting on Headscale), render (cards) and assembly (the rest)",
+    ["page", "phase"], buckets=BUCKETS)
+cache_requests   = Counter("headscale_webui_cache_requests_total",
+    "Cache lookups, by cache and result (hit or miss)",
+    ["cache", "result"])
+cache_entries    = Gauge("headscale_webui_cache_entries",
+    "Entries held in a cache",
+    ["cache"], multiprocess_mode="livesum")
+executor_queue   = Gauge("headscale_webui_executor_queue_depth",
+    "Tasks submitted to a thread pool executor that are waiting for a thread",
+    ["executor"], multiprocess_mode="livesum")
+
+##################################################################
+# Headscale calls
+##################################################################
+# The headscale.py function whose requests are being sent.  Context variables are copied
+# into asyncio tasks, so fan_out's requests are labelled with their caller too.
+caller = contextvars.ContextVar("caller", default="other")
+
+@contextmanager
+def calling(function):
+    token = caller.set(function)
+    try:     yield
+    finally: caller.reset(token)
+
+def upstream(func):
+    """ Decorator for headscale.py functions.  Their requests are labelled with the function's name. """
+    @wraps(func)
+    def decorated(*args, **kwargs):
+        with calling(func.__name__): return func(*args, **kwargs)
+    return decorated
+
+def observe_upstream(seconds, failed):
+    function = caller.get()
+    upstream_seconds.labels(function).observe(seconds)
+    if failed: upstream_errors.labels(function).inc()
+
+##################################################################
+# Requests and renders
+##################################################################
+def track_requests(flask_app):
+    """ Records the duration of every request served by flask_app """
+    @flask_app.before_request
+    def start_request_timer():
+        g.request_started = time.perf_counter()
+
+    @flask_app.after_request
+    def observe_request(response):
+        started = g.get("request_started")
+        if started is None: return response
+        labels  = (request.endpoint or "none", request.method, str(response.status_code))
+        # Streamed bodies are still being sent here, so the time is taken when the response is closed:
+        response.call_on_close(lambda: request_seconds.labels(*labels).observe(time.perf_counter() - started))
+        return response
+
+class PhaseTimer():
+    """ Adds up the time a page render spends in each phase.  Whatever isn't in a phase is "assembly". """
+    def __init__(self, page):
+        self.page    = page
+        self.started = time.perf_counter()
+        self.phases  = {}
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def observe(self):
+        total = time.perf_counter() - self.started
+        for phase, seconds in self.phases.items(): render_seconds.labels(self.page, phase).observe(seconds)
+        render_seconds.labels(self.page, "assembly").observe(max(total - sum(self.phases.values()), 0.0))
+
+##################################################################
+# Executors
+##################################################################
+executors = {}
+
+def sample_executor(name, executor):
+    # Flask-Executor doesn't expose its pool's queue.  The ThreadPoolExecutor is "_self".
+    pool = getattr(executor, "_self", None)
+    work_queue = getattr(pool, "_work_queue", None)
+    if work_queue is not None: executor_queue.labels(name).set(work_queue.qsize())
+
+def track_executor(name, executor):
+    """ Samples a Flask-Executor's queue depth as each of its tasks finishes, and on every scrape """
+    executors[name] = executor
+    executor.add_default_done_callback(lambda future: sample_executor(name, executor))
+
+def scrape_authorized():
+    """ True if the request carries METRICS_TOKEN as a bearer token """
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if not METRICS_TOKEN or scheme.lower() != "bearer": return False
+    return secrets.compare_digest(token.strip().encode(), METRICS_TOKEN.encode())
+
+def exposition():
+    """ Returns the body and content type of a /metrics response """
+    for name, executor in executors.items(): sample_executor(name, executor)
+    registry = REGISTRY
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,167 @@
+# pylint: disable=wrong-import-order
+
+import os, logging, threading, time, sys, secrets, cProfile, pstats
+from functools import wraps
+from flask     import Flask, g, request
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# Opt-in profiling of single requests
+##################################################################
+# A request carrying the X-Profile header, or the ?profile= parameter, set to PROFILING_TOKEN
+# is run under a profiler.  The profile covers the request's thread, including a streamed
+# body, and every task it hands to a thread pool through carry().  Profiling is off while
+# PROFILING_TOKEN is empty.
+PROFILING_TOKEN     = os.environ.get("PROFILING_TOKEN", "").replace('"', '')
+# "sample" writes collapsed stacks for flamegraph.pl or speedscope.  "cprofile" writes
+# pstats files:  exact call counts, but every call is slowed down.
+PROFILING_MODE      = os.environ.get("PROFILING_MODE", "sample").replace('"', '').lower()
+PROFILING_INTERVAL  = float(os.environ.get("PROFILING_INTERVAL_MS", "5")) / 1000
+PROFILING_MAX_BYTES = int(os.environ.get("PROFILING_MAX_MB", "100")) * 1024 * 1024
+PROFILE_DIR         = "/data/profiles"
+
+class Session():
+    """ One profiled request and the threads working for it """
+    def __init__(self, name):
+        self.name     = name
+        self.path     = os.path.join(PROFILE_DIR, name + (".pstats" if PROFILING_MODE == "cprofile" else ".collapsed"))
+        self.lock     = threading.Lock()
+        self.threads  = {}   # thread ident -> label used as the root of its stacks
+        self.profiles = []   # cProfile.Profile per thread, in "cprofile" mode
+        self.stacks   = {}   # collapsed stack -> samples, in "sample" mode
+        self.stopped  = threading.Event()
+        self.sampler  = None
+
+    def start(self):
+        """ Starts profiling the calling thread.  Returns what finish() needs. """
+        profile = self.attach("request")
+        if PROFILING_MODE != "cprofile":
+            self.sampler = threading.Thread(target=self.sample, name="profiler", daemon=True)
+            self.sampler.start()
+        return profile
+
+    def attach(self, label):
+        """ Adds the calling thread to the profile.  Returns its cProfile.Profile, if any. """
+        with self.lock: self.threads[threading.get_ident()] = label
+        if PROFILING_MODE != "cprofile": return None
+        profile = cProfile.Profile()
+        with self.lock: self.profiles.append(profile)
+        profile.enable()
+        return profile
+
+    def detach(self, profile):
+        if profile is not None: profile.disable()
+        with self.lock: self.threads.pop(threading.get_ident(), None)
+
+    def sample(self):
+        while not self.stopped.wait(PROFILING_INTERVAL):
+            frames = sys._current_frames() # pylint: disable=protected-access
+            with self.lock: threads = list(self.threads.items())
+            for ident, label in threads:
+                frame = frames.get(ident)
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(code.co_name+" ("+os.path.basename(code.co_filename)+":"+str(code.co_firstlineno)+")")
+                    frame = frame.f_back
+                stack = label+";"+";".join(reversed(names))
+                self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def finish(self, profile):
+        self.detach(profile)
+        self.stopped.set()
+        if self.sampler is not None: self.sampler.join()
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if PROFILING_MODE == "cprofile":
+            with self.lock: profiles = list(self.profiles)
+            pstats.Stats(*profiles).dump_stats(self.path)
+        else:
+            with open(self.path, "w", encoding="utf-8") as profile_file:
+                for stack, count in self.stacks.items(): profile_file.write(stack+" "+str(count)+"\n")
+        app.logger.info("Profile written to %s", self.path)
+        prune()
+
+# Deletes the oldest profiles until the directory holds at most PROFILING_MAX_MB
+def prune():
+    try:
+        entries = [entry for entry in os.scandir(PROFILE_DIR) if entry.is_file()]
+    except OSError as error:
+        app.logger.error("Failed listing %s:  %s", PROFILE_DIR, str(error))
+        return
+    entries.sort(key=lambda entry: entry.stat().st_mtime)
+    total = sum(entry.stat().st_size for entry in entries)
+    for entry in entries:
+        if total <= PROFILING_MAX_BYTES: break
+        total -= entry.stat().st_size
+        # Another worker may be pruning at the same time
+        try:    os.unlink(entry.path)
+        except FileNotFoundError: pass
+
+# One profile at a time per worker keeps the overhead bounded
+active      = None
+active_lock = threading.Lock()
+
+def current():
+    """ The session profiling the calling thread, or None """
+    session = active
+    if session is None or threading.get_ident() not in session.threads: return None
+    return session
+
+def carry(fn):
+    """ Wraps a task about to be handed to a thread pool, so it is profiled with the request submitting it """
+    session = current()
+    if session is None: return fn
+    @wraps(fn)
+    def profiled(*args, **kwargs):
+        profile = session.attach(threading.current_thread().name)
+        try:     return fn(*args, **kwargs)
+        finally: session.detach(profile)
+    return profiled
+
+def requested():
+    token = request.headers.get("X-Profile") or request.args.get("profile")
+    return bool(PROFILING_TOKEN and token and secrets.compare_digest(token, PROFILING_TOKEN))
+
+def track_requests(flask_app, logged_in):
+    """ Profiles the requests to flask_app that ask for it.  "logged_in" returns whether the
+        request has passed the login, as a request without one must not write a profile. """
+    @flask_app.before_request
+    def start_profile():
+        global active
+        if not requested(): return
+        if not logged_in():
+            app.logger.warning("Not profiling %s:  the request isn't logged in", request.path)
+            return
+        with active_lock:
+            if active is not None:
+                app.logger.warning("Not profiling %s:  another request is being profiled", request.path)
+                return
+            active = Session(time.strftime("%Y%m%d-%H%M%S")+"-"+str(request.endpoint)+"-"+secrets.token_hex(3))
+            session = active
+        g.profile_session = session
+        g.profile         = session.start()
+
+    @flask_app.after_request
+    def finish_profile(response):
+        session = g.get("profile_session")
+        if session is None: return response
+        profile = g.profile
+        # A streamed body is still being generated here, so the profile is written when the response is closed:
+        def finish():
+            global active
+            try:     session.finish(profile)
+            except OSError as error: app.logger.error("Failed writing the profile %s:  %s", session.path, str(error))
+            finally:
+                with active_lock: active = None
+        response.call_on_close(finish)
+        response.headers["X-Profile-File"] = os.path.basename(session.path)
+        return response
@@ -0,0 +1,101 @@
+# pylint: disable=wrong-import-order
+
+import headscale, timeutil, os, logging, time
+from flask import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# Compact, normalized records for the JSON data API (/api/v1/...)
+##################################################################
+# Bump when a field is renamed or removed.  Adding fields is backwards compatible.
+API_VERSION = 1
+
+# Headscale's "no value" timestamp
+ZERO_TIME = "0001-01-01T00:00:00Z"
+
+def epoch(value):
+    """ Converts a Headscale timestamp to whole seconds since the epoch.  Unset timestamps become None """
+    if not value or value == ZERO_TIME: return None
+    return int(timeutil.parse_timestamp(value).timestamp())
+
+def user_record(user):
+    return {
+        "id"     : int(user["id"]),
+        "name"   : user["name"],
+        "created": epoch(user.get("createdAt")),
+    }
+
+# The user is referenced by id.  Its record is sent once in the document's "users" list.
+def machine_record(machine):
+    return {
+        "id"         : int(machine["id"]),
+        "name"       : machine["givenName"],
+        "hostname"   : machine["name"],
+        "user"       : int(machine["user"]["id"]),
+        "ips"        : machine["ipAddresses"],
+        "last_seen"  : epoch(machine["lastSeen"]),
+        "last_update": epoch(machine["lastSuccessfulUpdate"]),
+        "created"    : epoch(machine["createdAt"]),
+        "expiry"     : epoch(machine["expiry"]),
+        "preauth_key": str(machine["preAuthKey"]["key"])[0:10] if machine["preAuthKey"] else None,
+        "tags"       : [tag[4:] for tag in machine["forcedTags"]],
+        "online"     : machine.get("online", False),
+    }
+
+# The machine is referenced by id.
+def route_record(route):
+    return {
+        "id"        : int(route["id"]),
+        "machine"   : int(route["machine"]["id"]),
+        "prefix"    : route["prefix"],
+        "advertised": route["advertised"],
+        "enabled"   : route["enabled"],
+    }
+
+# The user is referenced by name, the way Headscale's preauth key API addresses users.
+def preauth_key_record(key):
+    return {
+        "id"        : int(key["id"]),
+        "user"      : key["user"],
+        "key"       : key["key"],
+        "reusable"  : key["reusable"],
+        "ephemeral" : key["ephemeral"],
+        "used"      : key["used"],
+        "expiration": epoch(key["expiration"]),
+        "created"   : epoch(key.get("createdAt")),
+    }
+
+# "now" and "timezone" let the browser format times exactly as the server-rendered pages would.
+def document(**collections):
+    return {"version": API_VERSION, "now": int(time.time()), "timezone": timeutil.RenderContext().timezone_name, **collections}
+
+# Every machine, its user and its routes
+def machines_document(url, api_key):
+    app.logger.info("Building the machines document")
+    machines = headscale.get_machines(url, api_key)["machines"]
+    routes   = headscale.get_routes(url, api_key)["routes"]
+    users    = {machine["user"]["id"]: machine["user"] for machine in machines}
+    return document(
+        users    = [user_record(user)       for user    in users.values()],
+        machines = [machine_record(machine) for machine in machines],
+        routes   = [route_record(route)     for route   in routes],
+    )
+
+# Every user and their preauth keys
+def users_document(url, api_key):
+    app.logger.info("Building the users document")
+    users        = headscale.get_users(url, api_key)["users"]
+    keys_by_user = headscale.get_preauth_keys_for_users(url, api_key, [user["name"] for user in users])
+    return document(
+        users        = [user_record(user) for user in users],
+        preauth_keys = [preauth_key_record(key) for user in users for key in keys_by_user[user["name"]]["preAuthKeys"]],
+    )
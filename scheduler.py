@@ -0,0 +1,76 @@
+# pylint: disable=wrong-import-order
+
+import os, threading, logging, time, shared
+from flask import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+# How often, in seconds, the leader checks whether another worker called trigger() on a
+# leader_only job
+TRIGGER_CHECK_INTERVAL = 1
+
+class IntervalJob():
+    """ Runs a function on a background daemon thread every "interval" seconds """
+    def __init__(self, name, func, interval, failure_interval=None, leader_only=False):
+        # If "func" returns False, the next run is "failure_interval" seconds away instead.
+        # A "leader_only" job only runs in the worker holding the leader lock (see shared.is_leader()).
+        # The other workers keep trying the lock every interval, so one takes over if the leader exits.
+        self.name             = name
+        self.func             = func
+        self.interval         = interval
+        self.failure_interval = interval if failure_interval is None else failure_interval
+        self.leader_only      = leader_only
+        self.wakeup   = threading.Event()
+        self.lock     = threading.Lock()
+        self.thread   = None
+        # Whether this worker ran the job last time, and when (time.time(), as other workers compare it)
+        self.leading  = False
+        self.last_run = 0.0
+
+    def start(self):
+        # Safe to call more than once.  Only one thread runs per job.
+        with self.lock:
+            if self.thread is not None and self.thread.is_alive(): return
+            self.thread = threading.Thread(target=self.run_forever, name=self.name, daemon=True)
+            self.thread.start()
+            app.logger.info("Started background job %s (every %is)", self.name, self.interval)
+
+    def trigger(self):
+        # Run the job again now instead of waiting for the rest of the interval.  A leader_only
+        # job may be running in another worker, so the request also goes through the shared store.
+        self.wakeup.set()
+        if self.leader_only and shared.ENABLED: shared.publish_state("trigger:"+self.name, time.time())
+
+    def wait(self, timeout):
+        # Waits "timeout" seconds, or until trigger() is called.  The leader also wakes up for a
+        # trigger() from another worker made since the job last started.
+        if not (self.leading and shared.ENABLED):
+            self.wakeup.wait(timeout)
+            return
+        deadline = time.monotonic() + timeout
+        while not self.wakeup.wait(max(0, min(TRIGGER_CHECK_INTERVAL, deadline - time.monotonic()))):
+            if time.monotonic() >= deadline: return
+            triggered = shared.read_state("trigger:"+self.name)
+            if triggered is not None and triggered > self.last_run: return
+
+    def run_forever(self):
+        while True:
+            try:
+                self.leading = self.leader_only and shared.is_leader()
+                if self.leader_only and not self.leading: succeeded = True
+                else:
+                    self.last_run = time.time()
+                    succeeded     = self.func() is not False
+            except Exception as error: # pylint: disable=broad-except
+                app.logger.error("Background job %s failed:  %s", self.name, str(error))
+                succeeded = False
+            self.wait(self.interval if succeeded else self.failure_interval)
+            self.wakeup.clear()
@@ -0,0 +1,142 @@
+# pylint: disable=wrong-import-order
+
+import headscale, os, logging, re, threading, time
+from bisect import bisect_left
+from flask  import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# In-memory search index over the machine list
+##################################################################
+# Every machine is broken into lowercase tokens:  its name and hostname, IP addresses,
+# tags, user and advertised route prefixes.  A query matches a machine when each of its
+# words is a prefix of one of the machine's tokens.
+
+# Splits names into words, so "web-01.lab" is found by "web", "01" and "lab"
+WORD_SPLIT = re.compile(r"[^a-z0-9]+")
+
+def name_tokens(value):
+    value = str(value).lower()
+    return {value, *(word for word in WORD_SPLIT.split(value) if word)}
+
+# Addresses are only matched from the start, so "100.64" doesn't match every machine by "64"
+def address_tokens(value):
+    value = str(value).lower()
+    return {value, value.split("/")[0]}
+
+def machine_tokens(machine, prefixes):
+    tokens = set()
+    for value in (machine["givenName"], machine["name"], machine["user"]["name"]):
+        tokens |= name_tokens(value)
+    for tag in machine.get("forcedTags", []) + machine.get("validTags", []):
+        tokens |= name_tokens(tag.removeprefix("tag:")) | {tag.lower()}
+    for address in machine["ipAddresses"] + prefixes:
+        tokens |= address_tokens(address)
+    return tokens
+
+# Everything machine_tokens reads.  A machine is only re-tokenized when this changes.
+def machine_signature(machine, prefixes):
+    return (machine["givenName"], machine["name"], machine["user"]["name"], tuple(machine["ipAddresses"]),
+        tuple(machine.get("forcedTags", [])), tuple(machine.get("validTags", [])), tuple(prefixes))
+
+class SearchIndex():
+    """ Token -> machine IDs index, updated incrementally as the machine list changes """
+    def __init__(self):
+        self.lock          = threading.Lock()
+        self.postings      = {} # token -> set of machine IDs
+        self.tokens        = {} # machine ID -> its tokens
+        self.signatures    = {} # machine ID -> machine_signature
+        self.machines      = {} # machine ID -> machine
+        self.positions     = {} # machine ID -> its position in Headscale's list
+        self.sorted_tokens = []
+        self.dirty         = False
+        # The lists the index was last refreshed from.  Cached responses are the same
+        # objects until they expire, so an unchanged list is recognized without a diff.
+        self.source        = (None, None)
+
+    def refresh(self, machines, routes):
+        """ Brings the index up to date with a machine list and route list from Headscale """
+        if self.source[0] is machines and self.source[1] is routes: return
+        started  = time.perf_counter()
+        prefixes = {}
+        for route in routes:
+            if route["advertised"]: prefixes.setdefault(str(route["machine"]["id"]), []).append(route["prefix"])
+
+        current = {str(machine["id"]): machine for machine in machines}
+        changed = 0
+        for machine_id in [machine_id for machine_id in self.tokens if machine_id not in current]:
+            self.remove(machine_id)
+            changed += 1
+        for machine_id, machine in current.items():
+            machine_prefixes = prefixes.get(machine_id, [])
+            signature        = machine_signature(machine, machine_prefixes)
+            if self.signatures.get(machine_id) == signature: continue
+            self.remove(machine_id)
+            self.add(machine_id, machine_tokens(machine, machine_prefixes))
+            self.signatures[machine_id] = signature
+            changed += 1
+
+        self.machines  = current
+        self.positions = {machine_id: position for position, machine_id in enumerate(current)}
+        self.source    = (machines, routes)
+        app.logger.info("Search index:  %i of %i machines updated in %.1f ms", changed, len(current), (time.perf_counter()-started)*1000)
+
+    def add(self, machine_id, tokens):
+        self.tokens[machine_id] = tokens
+        for token in tokens:
+            if token not in self.postings:
+                self.postings[token] = set()
+                self.dirty = True
+            self.postings[token].add(machine_id)
+
+    def remove(self, machine_id):
+        for token in self.tokens.pop(machine_id, ()):
+            self.postings[token].discard(machine_id)
+            if not self.postings[token]:
+                del self.postings[token]
+                self.dirty = True
+        self.signatures.pop(machine_id, None)
+
+    def prefix_matches(self, word):
+        """ IDs of the machines with a token starting with "word" """
+        if self.dirty:
+            self.sorted_tokens = sorted(self.postings)
+            self.dirty         = False
+        matches = set()
+        for position in range(bisect_left(self.sorted_tokens, word), len(self.sorted_tokens)):
+            token = self.sorted_tokens[position]
+            if not token.startswith(word): break
+            matches |= self.postings[token]
+        return matches
+
+    def search(self, machines, routes, query):
+        """ Returns the machines matching every word of query, in Headscale's order """
+        words = query.lower().split()
+        if not words: return []
+        with self.lock:
+            self.refresh(machines, routes)
+            # Intersect the rarest word first so the sets stay small:
+            word_matches = sorted((self.prefix_matches(word) for word in words), key=len)
+            matches      = set.intersection(*word_matches)
+            return [self.machines[machine_id] for machine_id in sorted(matches, key=self.positions.__getitem__)]
+
+# Shared by every request in the process
+index = SearchIndex()
+
+def search(url, api_key, query):
+    """ Returns the machines matching query, in Headscale's order """
+    started  = time.perf_counter()
+    machines = headscale.get_machines(url, api_key)["machines"]
+    routes   = headscale.get_routes(url, api_key)["routes"]
+    results  = index.search(machines, routes, query)
+    app.logger.info("Search %s:  %i machines in %.1f ms", repr(query), len(results), (time.perf_counter()-started)*1000)
+    return results
@@ -1,10 +1,8 @@
 # pylint: disable=wrong-import-order
 
-import headscale, helper, json, os, pytz, renderer, secrets, requests, logging
+import headscale, helper, json, os, renderer, records, events, bulk, iptree, metrics, profiling, shared, requests, logging, cache, config, tempfile, timeutil
 from functools                     import wraps
-from datetime                      import datetime
-from flask                         import Flask, escape, Markup, redirect, render_template, request, url_for
-from dateutil                      import parser
+from flask                         import Flask, escape, make_response, Markup, Response, redirect, render_template, request, stream_template, url_for
 from flask_executor                import Executor
 from werkzeug.middleware.proxy_fix import ProxyFix
 
@@ -17,6 +15,11 @@ AUTH_TYPE   = os.environ["AUTH_TYPE"].replace('"', '').lower()
 LOG_LEVEL   = os.environ["LOG_LEVEL"].replace('"', '').upper()
 # If LOG_LEVEL is DEBUG, enable Flask debugging:
 DEBUG_STATE = True if LOG_LEVEL == "DEBUG" else False
+# Render machine and user cards in the browser from the /api/v1 JSON data instead of on the server:
+CLIENT_RENDERING = os.environ.get("CLIENT_RENDERING", "false").replace('"', '').lower() == "true"
+# Send ETags with the Overview and Users pages, and the table and client rendered views of the
+# Machines page.  The streamed cards view of the Machines page never gets one:
+PAGE_ETAGS       = os.environ.get("PAGE_ETAGS", "true").replace('"', '').lower() == "true"
 
 # Initiate the Flask application and logging:
 app          = Flask(__name__, static_url_path="/static")
@@ -28,11 +31,18 @@ match LOG_LEVEL:
     case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
 
 executor     = Executor(app)
+metrics.track_requests(app)
 app.wsgi_app = ProxyFix(app.wsgi_app, x_for=1, x_proto=1, x_host=1, x_prefix=1)
 app.logger.info("Headscale-WebUI Version:  "+os.environ["APP_VERSION"]+" / "+os.environ["GIT_BRANCH"])
 app.logger.info("LOG LEVEL SET TO %s", str(LOG_LEVEL))
 app.logger.info("DEBUG STATE:  %s", str(DEBUG_STATE))
 
+# Validate and renew the API key, and run the access checks, in the background instead of on every page load.
+# With SHARED_DIR set, only the leader worker runs them, and the live status poller (see events.py):
+helper.key_check_job.start()
+helper.health_check_job.start()
+if shared.ENABLED: events.poll_job.start()
+
 ########################################################################################
 # Set Authentication type.  Currently "OIDC" and "BASIC"
 ########################################################################################
@@ -71,15 +81,18 @@ if AUTH_TYPE == "oidc":
     }
     """
 
-    with open("/app/instance/secrets.json", "w+") as secrets_json:
+    # Every worker writes the file, so it's moved into place whole while the others may be reading it:
+    tmp_fd, tmp_path = tempfile.mkstemp(dir="/app/instance", prefix=".secrets.json.")
+    with os.fdopen(tmp_fd, "w") as secrets_json:
         secrets_json.write(client_secrets)
+    os.replace(tmp_path, "/app/instance/secrets.json")
     app.logger.debug("Client Secrets:  ")
     with open("/app/instance/secrets.json", "r+") as secrets_json:
         app.logger.debug("/app/instances/secrets.json:")
         app.logger.debug(secrets_json.read())
     
     app.config.update({
-        'SECRET_KEY': secrets.token_urlsafe(32),
+        'SECRET_KEY': shared.get_secret_key(),
         'TESTING': DEBUG_STATE,
         'DEBUG': DEBUG_STATE,
         'OIDC_CLIENT_SECRETS': '/app/instance/secrets.json',
@@ -91,7 +104,8 @@ if AUTH_TYPE == "oidc":
         'OIDC_INTROSPECTION_AUTH_METHOD': 'client_secret_post'
     })
     from flask_oidc import OpenIDConnect
-    oidc = OpenIDConnect(app)
+    # The access tokens are kept where every worker can read them
+    oidc = OpenIDConnect(app, credentials_store=shared.StateMapping("oidc:") if shared.ENABLED else None)
 
 elif AUTH_TYPE == "basic":
     # https://flask-basicauth.readthedocs.io/en/latest/
@@ -102,7 +116,16 @@ elif AUTH_TYPE == "basic":
     app.config['BASIC_AUTH_PASSWORD'] = os.environ["BASIC_AUTH_PASS"]
     app.config['BASIC_AUTH_FORCE']    = True
 
-    basic_auth = BasicAuth(app)
+    # Every view requires authentication except the load balancer health check, and /metrics
+    # for a scraper sending METRICS_TOKEN.  Matched by path, so a view that is renamed or added
+    # stays protected.
+    class HealthCheckBasicAuth(BasicAuth):
+        def authenticate(self):
+            if request.path == "/healthz": return True
+            if request.path == "/metrics" and metrics.scrape_authorized(): return True
+            return super().authenticate()
+
+    basic_auth = HealthCheckBasicAuth(app)
     ########################################################################################
     # Set Authentication type - Dynamically load function decorators
     # https://stackoverflow.com/questions/17256602/assertionerror-view-function-mapping-is-overwriting-an-existing-endpoint-functi 
@@ -132,6 +155,35 @@ else:
             return decorated
     oidc = OpenIDConnect()
 
+# Profiling starts in a before_request hook, but oidc.require_login only checks the login in
+# the view, so the hook checks it itself.  Registered after the login's own hooks, so with
+# basic auth a request without a login is turned away before it gets here.
+def logged_in():
+    if AUTH_TYPE == "oidc":  return oidc.user_loggedin
+    if AUTH_TYPE == "basic": return basic_auth.authenticate()
+    return True
+profiling.track_requests(app, logged_in)
+
+########################################################################################
+# Conditional requests.  Responses carry a strong ETag hashed from the Headscale data
+# they are built from, and a client that already has that version gets a 304.
+########################################################################################
+def page_etag(nav, *data):
+    # The app version covers template changes, "nav" covers the logged in OIDC user:
+    return helper.content_etag(os.environ["APP_VERSION"], os.environ["GIT_COMMIT"], COLOR, str(nav), helper.time_bucket(), *data)
+
+def not_modified(etag):
+    """ True if the client's cached copy matches etag """
+    return etag is not None and request.if_none_match.contains(etag)
+
+def etag_response(response, etag):
+    if etag is None: return response
+    response = make_response(response)
+    response.set_etag(etag)
+    # Cached by the browser only, and always revalidated:
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 ########################################################################################
 # / pages - User-facing pages
 ######################################################ddddddddddd##################################
@@ -153,13 +205,25 @@ def overview_page():
         OIDC_NAV_DROPDOWN = renderer.oidc_nav_dropdown(user_name, email_address, name)
         OIDC_NAV_MOBILE   = renderer.oidc_nav_mobile(user_name, email_address, name)
 
-    return render_template('overview.html',
+    etag = None
+    if PAGE_ETAGS:
+        url     = headscale.get_url()
+        api_key = headscale.get_api_key()
+        etag    = page_etag(OIDC_NAV_DROPDOWN,
+            config.get_config(),
+            headscale.get_machines(url, api_key),
+            headscale.get_routes(url, api_key),
+            headscale.get_preauth_key_summary(url, api_key)
+        )
+        if not_modified(etag): return etag_response(Response(status=304), etag)
+
+    return etag_response(render_template('overview.html',
         render_page = renderer.render_overview(),
         COLOR_NAV   = COLOR_NAV,
         COLOR_BTN   = COLOR_BTN,
         OIDC_NAV_DROPDOWN = OIDC_NAV_DROPDOWN,
         OIDC_NAV_MOBILE = OIDC_NAV_MOBILE
-    )
+    ), etag)
 
 @app.route('/machines', methods=('GET', 'POST'))
 @oidc.require_login
@@ -178,15 +242,30 @@ def machines_page():
         OIDC_NAV_DROPDOWN = renderer.oidc_nav_dropdown(user_name, email_address, name)
         OIDC_NAV_MOBILE   = renderer.oidc_nav_mobile(user_name, email_address, name)
     
-    cards = renderer.render_machines_cards()
-    return render_template('machines.html',
+    # "cards" renders every machine.  "table" sends an empty table the browser fills one page at a time.
+    view         = "table" if request.args.get("view") == "table" else "cards"
+    server_cards = view == "cards" and not CLIENT_RENDERING
+
+    # The table and client rendered views are a static shell.  Server rendered cards get no ETag:
+    # it would need the whole machine list before the first byte, and the cards are streamed.
+    etag = None
+    if PAGE_ETAGS and not server_cards:
+        etag = page_etag(OIDC_NAV_DROPDOWN, view, CLIENT_RENDERING)
+        if not_modified(etag): return etag_response(Response(status=304), etag)
+
+    cards = renderer.stream_machines_cards() if server_cards else []
+    # The page shell is sent right away and each card is flushed as soon as it is rendered.
+    # X-Accel-Buffering stops nginx from holding the response until it is complete.
+    return etag_response(Response(stream_template('machines.html',
         cards            = cards,
+        view             = view,
+        client_rendering = CLIENT_RENDERING,
         headscale_server = headscale.get_url(),
         COLOR_NAV   = COLOR_NAV,
         COLOR_BTN   = COLOR_BTN,
         OIDC_NAV_DROPDOWN = OIDC_NAV_DROPDOWN,
         OIDC_NAV_MOBILE = OIDC_NAV_MOBILE
-    )
+    ), headers={"X-Accel-Buffering": "no"}), etag)
 
 @app.route('/users', methods=('GET', 'POST'))
 @oidc.require_login
@@ -205,15 +284,27 @@ def users_page():
         OIDC_NAV_DROPDOWN = renderer.oidc_nav_dropdown(user_name, email_address, name)
         OIDC_NAV_MOBILE   = renderer.oidc_nav_mobile(user_name, email_address, name)
 
-    cards = renderer.render_users_cards()
-    return render_template('users.html',
+    etag = None
+    if PAGE_ETAGS:
+        data = ()
+        if not CLIENT_RENDERING:
+            url     = headscale.get_url()
+            api_key = headscale.get_api_key()
+            users   = headscale.get_users(url, api_key)
+            data    = (users, headscale.get_preauth_keys_for_users(url, api_key, [user["name"] for user in users["users"]]))
+        etag = page_etag(OIDC_NAV_DROPDOWN, CLIENT_RENDERING, *data)
+        if not_modified(etag): return etag_response(Response(status=304), etag)
+
+    cards = renderer.render_users_cards() if not CLIENT_RENDERING else Markup("")
+    return etag_response(render_template('users.html',
         cards = cards,
+        client_rendering = CLIENT_RENDERING,
         headscale_server = headscale.get_url(),
         COLOR_NAV   = COLOR_NAV,
         COLOR_BTN   = COLOR_BTN,
         OIDC_NAV_DROPDOWN = OIDC_NAV_DROPDOWN,
         OIDC_NAV_MOBILE = OIDC_NAV_MOBILE
-    )
+    ), etag)
 
 @app.route('/settings', methods=('GET', 'POST'))
 @oidc.require_login
@@ -251,13 +342,43 @@ def settings_page():
 @app.route('/error')
 @oidc.require_login
 def error_page():
-    if helper.access_checks() == "Pass": 
+    # Re-run the checks so the page shows the current state, not the last snapshot:
+    helper.run_health_checks()
+    error_message = helper.access_checks()
+    if error_message == "Pass": 
         return redirect(url_for('overview_page'))
 
     return render_template('error.html', 
-        ERROR_MESSAGE = Markup(helper.access_checks())
+        ERROR_MESSAGE = Markup(error_message)
     )
 
+# Unauthenticated health check for load balancers.  Only reads the latest snapshot, and only
+# reports whether each check passed.
+@app.route('/healthz')
+def healthz_page():
+    status = helper.get_health_status()
+    return status, 200 if status["passed"] else 503
+
+# The health snapshot with the API key check and the cache statistics
+@app.route('/api/status')
+@oidc.require_login
+def status_page():
+    status = helper.get_health_status()
+    key    = helper.get_key_status()
+    body   = dict(status, key_valid=key[0] if key else None)
+    body["caches"] = {"responses": cache.responses.stats(), "fragments": cache.fragments.stats()}
+    return body, 200 if status["passed"] else 503
+
+# Prometheus metrics.  See "Metrics" in SETUP.md.
+@app.route('/metrics')
+def metrics_page():
+    if metrics.scrape_authorized(): return metrics_response()
+    return oidc.require_login(metrics_response)()
+
+def metrics_response():
+    body, content_type = metrics.exposition()
+    return Response(body, content_type=content_type)
+
 @app.route('/logout')
 def logout_page():
     if AUTH_TYPE == "oidc":
@@ -290,22 +411,10 @@ def test_key_page():
 
     key_info   = headscale.get_api_key_info(url, api_key)
 
-    # Set the current timezone and local time
-    timezone   = pytz.timezone(os.environ["TZ"] if os.environ["TZ"] else "UTC")
-    local_time = timezone.localize(datetime.now())
-
     # Format the dates for easy readability
-    creation_parse   = parser.parse(key_info['createdAt'])
-    creation_local   = creation_parse.astimezone(timezone)
-    creation_delta   = local_time - creation_local
-    creation_print   = helper.pretty_print_duration(creation_delta)
-    creation_time    = str(creation_local.strftime('%A %m/%d/%Y, %H:%M:%S'))+" "+str(timezone)+" ("+str(creation_print)+")"
-
-    expiration_parse = parser.parse(key_info['expiration'])
-    expiration_local = expiration_parse.astimezone(timezone)
-    expiration_delta = expiration_local - local_time
-    expiration_print = helper.pretty_print_duration(expiration_delta, "expiry")
-    expiration_time  = str(expiration_local.strftime('%A %m/%d/%Y, %H:%M:%S'))+" "+str(timezone)+" ("+str(expiration_print)+")"
+    context          = timeutil.RenderContext()
+    creation_time    = context.since(key_info['createdAt']).text
+    expiration_time  = context.until(key_info['expiration']).text
 
     key_info['expiration'] = expiration_time
     key_info['createdAt']  = creation_time
@@ -326,6 +435,10 @@ def save_key_page():
         # Re-read the file and get the new API key and test it
         api_key = headscale.get_api_key()
         test_status = headscale.test_api_key(url, api_key)
+        # Publish the new key's state now rather than at the next background check:
+        helper.key_check()
+        # Nothing cached under the old key can be trusted:
+        cache.responses.clear()
         if test_status == 200:
             key_info   = headscale.get_api_key_info(url, api_key)
             expiration = key_info['expiration']
@@ -347,17 +460,74 @@ def update_route_page():
     api_key       = headscale.get_api_key()
     current_state = json_response['current_state']
 
-    return headscale.update_route(url, api_key, route_id, current_state)
+    response = headscale.update_route(url, api_key, route_id, current_state)
+    # The route's machine isn't known here, so drop every per-machine route list:
+    cache.responses.invalidate("routes")
+    cache.responses.invalidate("machine_routes")
+    return response
 
-@app.route('/api/machine_information', methods=['POST'])
+# GET (?id=) lets the browser cache the response and revalidate it with its ETag
+@app.route('/api/machine_information', methods=['GET', 'POST'])
 @oidc.require_login
 def machine_information_page():
-    json_response = request.get_json()
-    machine_id    = escape(json_response['id'])
+    if request.method == "GET": machine_id = escape(request.args['id'])
+    else:                       machine_id = escape(request.get_json()['id'])
+    url           = headscale.get_url()
+    api_key       = headscale.get_api_key()
+
+    machine = headscale.get_machine_info(url, api_key, machine_id)
+    etag    = helper.content_etag(machine)
+    if not_modified(etag): return etag_response(Response(status=304), etag)
+    return etag_response(machine, etag)
+
+@app.route('/api/machines_table', methods=['POST'])
+@oidc.require_login
+def machines_table_page():
+    json_response = request.get_json(silent=True)
+    if not isinstance(json_response, dict): json_response = {}
+    try:
+        offset    = max(int(json_response.get('offset', 0)), 0)
+        limit     = min(max(int(json_response.get('limit', 100)), 1), 500)
+    except (TypeError, ValueError):
+        return {"status": "False", "body": {"message": "offset and limit must be numbers"}}, 400
+    sort          = json_response.get('sort', 'lastSeen')
+    descending    = json_response.get('order', 'desc') != 'asc'
+    query         = str(json_response.get('query', '')).strip()
+    if not isinstance(sort, str) or sort not in renderer.MACHINE_SORT_KEYS: sort = 'lastSeen'
+
+    return renderer.render_machines_table(offset, limit, sort, descending, query)
+
+# ?q= is matched against machine names, hostnames, IPs, tags, users and advertised routes.
+# Returns every matching ID and the rendered cards of the first ?limit= matches.
+@app.route('/api/search', methods=['GET'])
+@oidc.require_login
+def search_page():
+    query         = request.args.get('q', '').strip()
+    limit         = min(max(request.args.get('limit', 50, type=int), 0), 500)
+
+    return renderer.render_search_results(query, limit)
+
+# ?q= is an address or prefix.  Returns the machines that own it, the advertised routes
+# that contain it and the routes its traffic goes to (longest prefix match).
+@app.route('/api/ip_lookup', methods=['GET'])
+@oidc.require_login
+def ip_lookup_page():
+    url           = headscale.get_url()
+    api_key       = headscale.get_api_key()
+
+    try:
+        return iptree.address_index(url, api_key).lookup(request.args.get('q', ''))
+    except ValueError as error:
+        return {"status": "False", "body": {"message": str(error)}}, 400
+
+# Advertised routes that duplicate or sit inside another route, and which router serves each
+@app.route('/api/route_overlaps', methods=['GET'])
+@oidc.require_login
+def route_overlaps_page():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
 
-    return headscale.get_machine_info(url, api_key, machine_id)
+    return iptree.address_index(url, api_key).overlaps()
 
 @app.route('/api/delete_machine', methods=['POST'])
 @oidc.require_login
@@ -367,7 +537,12 @@ def delete_machine_page():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
 
-    return headscale.delete_machine(url, api_key, machine_id)
+    response = headscale.delete_machine(url, api_key, machine_id)
+    cache.responses.invalidate("machines")
+    cache.responses.invalidate("machine",        {"id": str(machine_id)})
+    cache.responses.invalidate("machine_routes", {"id": str(machine_id)})
+    cache.responses.invalidate("routes")
+    return response
 
 @app.route('/api/rename_machine', methods=['POST'])
 @oidc.require_login
@@ -378,7 +553,13 @@ def rename_machine_page():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
 
-    return headscale.rename_machine(url, api_key, machine_id, new_name)
+    response = headscale.rename_machine(url, api_key, machine_id, new_name)
+    # Routes embed their machine, so they carry the old name too:
+    cache.responses.invalidate("machines")
+    cache.responses.invalidate("machine",        {"id": str(machine_id)})
+    cache.responses.invalidate("machine_routes", {"id": str(machine_id)})
+    cache.responses.invalidate("routes")
+    return response
 
 @app.route('/api/move_user', methods=['POST'])
 @oidc.require_login
@@ -389,7 +570,13 @@ def move_user_page():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
 
-    return headscale.move_user(url, api_key, machine_id, new_user)
+    response = headscale.move_user(url, api_key, machine_id, new_user)
+    # Routes embed their machine, so they carry the old user too:
+    cache.responses.invalidate("machines")
+    cache.responses.invalidate("machine",        {"id": str(machine_id)})
+    cache.responses.invalidate("machine_routes", {"id": str(machine_id)})
+    cache.responses.invalidate("routes")
+    return response
 
 @app.route('/api/set_machine_tags', methods=['POST'])
 @oidc.require_login
@@ -400,7 +587,13 @@ def set_machine_tags():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
 
-    return headscale.set_machine_tags(url, api_key, machine_id, machine_tags)
+    response = headscale.set_machine_tags(url, api_key, machine_id, machine_tags)
+    # The routes embed their machine, tags included
+    cache.responses.invalidate("machines")
+    cache.responses.invalidate("machine",        {"id": str(machine_id)})
+    cache.responses.invalidate("machine_routes", {"id": str(machine_id)})
+    cache.responses.invalidate("routes")
+    return response
 
 @app.route('/api/register_machine', methods=['POST'])
 @oidc.require_login
@@ -411,7 +604,27 @@ def register_machine():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
 
-    return str(headscale.register_machine(url, api_key, machine_key, user))
+    response = headscale.register_machine(url, api_key, machine_key, user)
+    cache.responses.invalidate("machines")
+    return str(response)
+
+########################################################################################
+# Bulk Machine Endpoints.  One JSON line is streamed back per Headscale call as it finishes.
+########################################################################################
+# POST {"ids": [...], ...} to /api/bulk/delete, expire, move ("user"), tags ("tags", "mode")
+# or routes ("enabled").  See bulk.py.
+@app.route('/api/bulk/<action>', methods=['POST'])
+@oidc.require_login
+def bulk_machines_page(action):
+    json_response = request.get_json(silent=True) or {}
+    url           = headscale.get_url()
+    api_key       = headscale.get_api_key()
+
+    try:
+        calls = bulk.plan(action, url, api_key, json_response)
+    except ValueError as error:
+        return {"status": "False", "body": {"message": str(error)}}, 400
+    return Response(bulk.stream(action, calls), mimetype="application/x-ndjson", headers={"X-Accel-Buffering": "no"})
 
 ########################################################################################
 # User API Endpoints
@@ -425,7 +638,17 @@ def rename_user_page():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
 
-    return headscale.rename_user(url, api_key, old_name, new_name)
+    response = headscale.rename_user(url, api_key, old_name, new_name)
+    # Machines and routes embed their user, so they carry the old name too:
+    cache.responses.invalidate("users")
+    cache.responses.invalidate("preauth_keys", {"user": str(old_name)})
+    cache.responses.invalidate("preauth_keys", {"user": str(new_name)})
+    cache.responses.invalidate("preauth_summary")
+    cache.responses.invalidate("machines")
+    cache.responses.invalidate("machine")
+    cache.responses.invalidate("machine_routes")
+    cache.responses.invalidate("routes")
+    return response
 
 @app.route('/api/add_user', methods=['POST'])
 @oidc.require_login
@@ -436,7 +659,12 @@ def add_user():
     api_key        = headscale.get_api_key()
     json_string    = '{"name": "'+user_name+'"}'
 
-    return headscale.add_user(url, api_key, json_string)
+    response = headscale.add_user(url, api_key, json_string)
+    cache.responses.invalidate("users")
+    cache.responses.invalidate("preauth_summary")
+    # Send the new user's card so the page can add it without reloading:
+    if response["status"] == "True": response["card"] = renderer.render_user_card(response["body"]["user"], {"preAuthKeys": []})
+    return response
 
 @app.route('/api/delete_user', methods=['POST'])
 @oidc.require_login
@@ -446,15 +674,22 @@ def delete_user():
     url            = headscale.get_url()
     api_key        = headscale.get_api_key()
 
-    return headscale.delete_user(url, api_key, user_name)
+    response = headscale.delete_user(url, api_key, user_name)
+    cache.responses.invalidate("users")
+    cache.responses.invalidate("preauth_keys", {"user": user_name})
+    cache.responses.invalidate("preauth_summary")
+    return response
 
-@app.route('/api/get_users', methods=['POST'])
+@app.route('/api/get_users', methods=['GET', 'POST'])
 @oidc.require_login
 def get_users_page():
     url           = headscale.get_url()
     api_key       = headscale.get_api_key()
     
-    return headscale.get_users(url, api_key)
+    users = headscale.get_users(url, api_key)
+    etag  = helper.content_etag(users)
+    if not_modified(etag): return etag_response(Response(status=304), etag)
+    return etag_response(users, etag)
 
 ########################################################################################
 # Pre-Auth Key API Endpoints
@@ -463,19 +698,29 @@ def get_users_page():
 @oidc.require_login
 def add_preauth_key():
     json_response  = json.dumps(request.get_json())
+    user_name      = request.get_json().get('user')
     url            = headscale.get_url()
     api_key        = headscale.get_api_key()
 
-    return headscale.add_preauth_key(url, api_key, json_response)
+    response = headscale.add_preauth_key(url, api_key, json_response)
+    # Without a user in the request, every user's keys are dropped
+    cache.responses.invalidate("preauth_keys", {"user": str(user_name)} if user_name is not None else None)
+    cache.responses.invalidate("preauth_summary")
+    return response
 
 @app.route('/api/expire_preauth_key', methods=['POST'])
 @oidc.require_login
 def expire_preauth_key():
     json_response  = json.dumps(request.get_json())
+    user_name      = request.get_json().get('user')
     url            = headscale.get_url()
     api_key        = headscale.get_api_key()
 
-    return headscale.expire_preauth_key(url, api_key, json_response)
+    response = headscale.expire_preauth_key(url, api_key, json_response)
+    # Without a user in the request, every user's keys are dropped
+    cache.responses.invalidate("preauth_keys", {"user": str(user_name)} if user_name is not None else None)
+    cache.responses.invalidate("preauth_summary")
+    return response
 
 @app.route('/api/build_preauthkey_table', methods=['POST'])
 @oidc.require_login
@@ -485,6 +730,38 @@ def build_preauth_key_table():
 
     return renderer.build_preauth_key_table(user_name)
 
+########################################################################################
+# JSON Data API.  Compact, normalized records the browser renders itself.
+########################################################################################
+@app.route('/api/v1/machines', methods=['GET'])
+@oidc.require_login
+def machines_data_page():
+    url           = headscale.get_url()
+    api_key       = headscale.get_api_key()
+
+    return records.machines_document(url, api_key)
+
+@app.route('/api/v1/users', methods=['GET'])
+@oidc.require_login
+def users_data_page():
+    url           = headscale.get_url()
+    api_key       = headscale.get_api_key()
+
+    return records.users_document(url, api_key)
+
+########################################################################################
+# Live machine status.  Server-Sent Events fed by one shared poller.
+########################################################################################
+@app.route('/api/events', methods=['GET'])
+@oidc.require_login
+def events_page():
+    subscriber = events.subscribe()
+    if subscriber is None: return Response("Too many live status clients.", status=503)
+    return Response(events.stream(subscriber), mimetype="text/event-stream", headers={
+        "Cache-Control"    : "no-cache",
+        "X-Accel-Buffering": "no"
+    })
+
 ########################################################################################
 # Main thread
 ########################################################################################
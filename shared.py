@@ -0,0 +1,237 @@
+# pylint: disable=wrong-import-order
+
+import os, logging, threading, time, json, sqlite3, fcntl, secrets, tempfile
+from collections.abc import MutableMapping
+from flask           import Flask
+
+LOG_LEVEL = os.environ["LOG_LEVEL"].replace('"', '').upper()
+# Initiate the Flask application and logging:
+app = Flask(__name__, static_url_path="/static")
+match LOG_LEVEL:
+    case "DEBUG"   : app.logger.setLevel(logging.DEBUG)
+    case "INFO"    : app.logger.setLevel(logging.INFO)
+    case "WARNING" : app.logger.setLevel(logging.WARNING)
+    case "ERROR"   : app.logger.setLevel(logging.ERROR)
+    case "CRITICAL": app.logger.setLevel(logging.CRITICAL)
+
+##################################################################
+# State shared by the gunicorn workers
+##################################################################
+# Every gunicorn worker is a process with its own memory.  With SHARED_DIR set, the workers
+# share through two files in that directory:
+#   cache.sqlite:  Headscale responses (cache.responses), OIDC credentials, the results of
+#                  the background jobs and the live status events
+#   leader.lock:   held by the one worker that runs the background jobs (see is_leader())
+# SHARED_DIR must be on a local filesystem:  SQLite's locking isn't reliable over NFS or SMB.
+# Empty keeps every worker to itself, which is only right with a single worker.
+SHARED_DIR = os.environ.get("SHARED_DIR", "").replace('"', '')
+ENABLED    = bool(SHARED_DIR)
+
+if ENABLED:
+    try:
+        os.makedirs(SHARED_DIR, exist_ok=True)
+    except OSError as error:
+        app.logger.error("Can't create SHARED_DIR %s, so the workers won't share state:  %s", SHARED_DIR, str(error))
+        ENABLED = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache  (key TEXT PRIMARY KEY, endpoint TEXT NOT NULL, expires REAL NOT NULL, version TEXT NOT NULL, value TEXT NOT NULL);
+CREATE INDEX IF NOT EXISTS cache_endpoint ON cache (endpoint);
+CREATE INDEX IF NOT EXISTS cache_expires  ON cache (expires);
+CREATE TABLE IF NOT EXISTS state  (name TEXT PRIMARY KEY, value TEXT NOT NULL, updated REAL NOT NULL);
+CREATE INDEX IF NOT EXISTS state_updated  ON state (updated);
+CREATE TABLE IF NOT EXISTS events (id INTEGER PRIMARY KEY AUTOINCREMENT, created REAL NOT NULL, message TEXT NOT NULL);
+"""
+# Live status events are kept this many seconds for the workers to pick up
+EVENT_RETENTION = 60
+# State not written for this many seconds is dropped:  OIDC credentials of users who haven't
+# logged in since, and the live status heartbeats of workers that have exited.  A week, the
+# lifetime of flask-oidc's ID token cookie.  The background jobs rewrite their results far
+# more often.
+STATE_RETENTION = 7 * 24 * 3600
+
+class Store():
+    """ The SQLite database in SHARED_DIR.  Each thread gets its own connection.
+        Times in the database are time.time(), as monotonic clocks differ between processes. """
+    def __init__(self, path):
+        self.path  = path
+        self.local = threading.local()
+
+    def connection(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            # Autocommit.  Waits up to 10 s for another worker's write to finish.
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            # WAL lets the workers read while one of them writes.  Everything stored can be
+            # fetched or recomputed, so a write lost in a crash doesn't matter.
+            if connection.execute("PRAGMA journal_mode").fetchone()[0] != "wal":
+                try:    connection.execute("PRAGMA journal_mode=WAL")
+                except sqlite3.OperationalError: pass # Another worker is switching it
+            connection.execute("PRAGMA synchronous=OFF")
+            connection.executescript(SCHEMA)
+            self.local.connection = connection
+        return connection
+
+    # Headscale responses.  "version" changes with every write, so a worker can tell whether
+    # its decoded copy is still current without reading the value.
+    def cache_header(self, key):
+        """ (expires, version) of an unexpired entry, or None """
+        return self.connection().execute("SELECT expires, version FROM cache WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+
+    def cache_entry(self, key):
+        """ (expires, version, value) of an unexpired entry, or None """
+        return self.connection().execute("SELECT expires, version, value FROM cache WHERE key = ? AND expires > ?", (key, time.time())).fetchone()
+
+    def cache_set(self, key, endpoint, expires, version, value):
+        connection = self.connection()
+        connection.execute("INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?)", (key, endpoint, expires, version, value))
+        connection.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),))
+
+    def cache_delete(self, key):
+        self.connection().execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    def cache_delete_endpoint(self, endpoint):
+        self.connection().execute("DELETE FROM cache WHERE endpoint = ?", (endpoint,))
+
+    def cache_clear(self):
+        self.connection().execute("DELETE FROM cache")
+
+    # Small JSON values published by one worker for the others
+    def get_state(self, name):
+        row = self.connection().execute("SELECT value FROM state WHERE name = ?", (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def set_state(self, name, value):
+        connection = self.connection()
+        connection.execute("INSERT OR REPLACE INTO state VALUES (?, ?, ?)", (name, json.dumps(value), time.time()))
+        connection.execute("DELETE FROM state WHERE updated < ?", (time.time() - STATE_RETENTION,))
+
+    def delete_state(self, name):
+        return self.connection().execute("DELETE FROM state WHERE name = ?", (name,)).rowcount
+
+    def state_names(self, prefix, max_age=None):
+        """ Names starting with "prefix", optionally only those updated in the last "max_age" seconds """
+        since = time.time() - max_age if max_age is not None else 0
+        rows  = self.connection().execute("SELECT name FROM state WHERE substr(name, 1, ?) = ? AND updated >= ?", (len(prefix), prefix, since))
+        return [row[0] for row in rows]
+
+    # Live status events, in the order they were published
+    def append_event(self, message):
+        connection = self.connection()
+        connection.execute("INSERT INTO events (created, message) VALUES (?, ?)", (time.time(), message))
+        connection.execute("DELETE FROM events WHERE created < ?", (time.time() - EVENT_RETENTION,))
+
+    def last_event_id(self):
+        return self.connection().execute("SELECT COALESCE(MAX(id), 0) FROM events").fetchone()[0]
+
+    def events_after(self, event_id):
+        """ [(id, message)] published after "event_id" """
+        return self.connection().execute("SELECT id, message FROM events WHERE id > ? ORDER BY id", (event_id,)).fetchall()
+
+class Leader():
+    """ An exclusive lock on a file, held by at most one process.  The kernel releases it when
+        the process exits, so another worker takes over the next time it calls acquire(). """
+    def __init__(self, path):
+        self.path      = path
+        self.lock_file = None
+        self.lock      = threading.Lock()
+
+    def acquire(self):
+        # Returns whether this process holds the lock, taking it if it's free
+        with self.lock:
+            if self.lock_file is not None: return True
+            try:
+                lock_file = open(self.path, "a", encoding="utf-8") # pylint: disable=consider-using-with
+            except OSError as error:
+                app.logger.error("Can't open %s:  %s", self.path, str(error))
+                return False
+            try:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                lock_file.close()
+                return False
+            self.lock_file = lock_file
+            app.logger.info("This worker (pid %i) now runs the background jobs", os.getpid())
+            return True
+
+store  = Store(os.path.join(SHARED_DIR, "cache.sqlite")) if ENABLED else None
+leader = Leader(os.path.join(SHARED_DIR, "leader.lock"))  if ENABLED else None
+
+def is_leader():
+    """ Whether this worker runs the background jobs.  Always True without SHARED_DIR. """
+    return not ENABLED or leader.acquire()
+
+def read_state(name):
+    """ The value last published under "name" by any worker, or None """
+    if not ENABLED: return None
+    try:
+        return store.get_state(name)
+    except sqlite3.Error as error:
+        app.logger.error("Failed reading %s from the shared store:  %s", name, str(error))
+        return None
+
+def publish_state(name, value):
+    if not ENABLED: return
+    try:
+        store.set_state(name, value)
+    except sqlite3.Error as error:
+        app.logger.error("Failed writing %s to the shared store:  %s", name, str(error))
+
+class StateMapping(MutableMapping):
+    """ A dict whose items are kept in the shared store under "prefix".  Values must be JSON. """
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def __getitem__(self, key):
+        value = store.get_state(self.prefix+key)
+        if value is None: raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        store.set_state(self.prefix+key, value)
+
+    def __delitem__(self, key):
+        if not store.delete_state(self.prefix+key): raise KeyError(key)
+
+    def __iter__(self):
+        return iter([name[len(self.prefix):] for name in store.state_names(self.prefix)])
+
+    def __len__(self):
+        return len(store.state_names(self.prefix))
+
+##################################################################
+# The key Flask signs sessions and cookies with
+##################################################################
+# Every worker has to use the same key, or a cookie set by one is rejected by the others.
+# SECRET_KEY if it's set.  Otherwise one is generated on first start and kept in /data,
+# so sessions also survive restarts.
+SECRET_KEY_FILE = "/data/secret_key"
+
+def read_secret_key():
+    try:
+        with open(SECRET_KEY_FILE, encoding="utf-8") as key_file: return key_file.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def get_secret_key():
+    configured = os.environ.get("SECRET_KEY", "").replace('"', '')
+    if configured: return configured
+    try:
+        secret_key = read_secret_key()
+        if secret_key: return secret_key
+        # Written to a temporary file and linked into place, so a worker starting at the same
+        # time either sees no file or the whole key.  Only the first worker's link succeeds.
+        tmp_fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(SECRET_KEY_FILE), prefix=".secret_key.")
+        try:
+            with os.fdopen(tmp_fd, "w", encoding="utf-8") as tmp_file: tmp_file.write(secrets.token_urlsafe(32))
+            try:    os.link(tmp_path, SECRET_KEY_FILE)
+            except FileExistsError: pass
+        finally:
+            os.unlink(tmp_path)
+        secret_key = read_secret_key()
+        if secret_key: return secret_key
+        app.logger.error("%s is empty", SECRET_KEY_FILE)
+    except OSError as error:
+        app.logger.error("Failed reading or writing %s:  %s", SECRET_KEY_FILE, str(error))
+    app.logger.warning("Using a secret key for this worker only.  Logins won't carry over to other workers or restarts.")
+    return secrets.token_urlsafe(32)
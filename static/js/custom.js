@@ -112,6 +112,11 @@ function escapeHTML(str){
     return p.innerHTML;
 }
 
+// escapeHTML leaves quotes alone, so use this for attribute values
+function escapeAttribute(str){
+    return String(str).replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;").replace(/'/g, "&#39;");
+}
+
 // Enables the Floating Action Button (FAB) for the Machines and Users page
 document.addEventListener('DOMContentLoaded', function() {
     var elems = document.querySelectorAll('.fixed-action-btn');
@@ -124,6 +129,78 @@ document.addEventListener('DOMContentLoaded', function() {
     var instances = M.Datepicker.init(elems);
 });
 
+//-----------------------------------------------------------
+// Overview Page Address Lookup
+//-----------------------------------------------------------
+// Both are answered by the server's radix tree of machine addresses and advertised routes.
+function route_label(route) {
+    var state = route.enabled ? (route.primary ? "enabled, primary" : "enabled") : "disabled"
+    return `${escapeHTML(route.prefix)} via ${route.machine}. ${escapeHTML(route.name)} (${state})`
+}
+
+function routers_label(routes) {
+    if (routes.length == 0) { return "no enabled router" }
+    return routes.map(function(route) { return route.machine+". "+escapeHTML(route.name) }).join(", ")
+}
+
+function lookup_address(query) {
+    var results = document.getElementById('address-lookup-results')
+    results.innerHTML = loading()
+    $.ajax({
+        type: "GET",
+        url: "api/ip_lookup",
+        data: {"q": query},
+        success: function(response) {
+            var list = function(items, empty) {
+                if (items.length == 0) { return "<p>"+empty+"</p>" }
+                return "<ul class='browser-default'>"+items.map(function(item) { return "<li>"+item+"</li>" }).join("")+"</ul>"
+            }
+            var owners = response.owners.map(function(owner) { return `${owner.machine}. ${escapeHTML(owner.name)} (user ${escapeHTML(owner.user)})` })
+            var html   = "<h6>"+escapeHTML(response.prefix)+" is owned by</h6>"+list(owners, "No machine has this address.")
+            html += "<h6>Traffic goes to</h6>"+list(response.serving.map(route_label), "No enabled route contains this address.")
+            html += "<h6>Routes containing it, most specific first</h6>"+list(response.routes.map(route_label), "None.")
+            if (response.within) { html += "<h6>More specific routes inside it</h6>"+list(response.within.map(route_label), "None.") }
+            results.innerHTML = html
+        },
+        error: function(xhr) {
+            results.innerHTML = "<p>"+escapeHTML(xhr.responseJSON ? xhr.responseJSON.body.message : "The lookup failed.")+"</p>"
+        }
+    })
+}
+
+function load_route_overlaps() {
+    var container = document.getElementById('route-overlaps')
+    container.innerHTML = loading()
+    $.ajax({
+        type: "GET",
+        url: "api/route_overlaps",
+        success: function(response) {
+            if (response.duplicates.length == 0 && response.overlaps.length == 0) {
+                container.innerHTML = "<p>No advertised routes overlap.</p>"
+                return
+            }
+            var html = ""
+            if (response.duplicates.length) {
+                html += "<h6>Advertised by more than one machine</h6><ul class='browser-default'>"
+                response.duplicates.forEach(function(duplicate) {
+                    html += `<li><b>${escapeHTML(duplicate.prefix)}</b>:  served by ${routers_label(duplicate.serving)}.  Advertised by ${duplicate.routes.map(route_label).join(", ")}.</li>`
+                })
+                html += "</ul>"
+            }
+            if (response.overlaps.length) {
+                html += "<h6>Inside another route</h6><ul class='browser-default'>"
+                response.overlaps.forEach(function(overlap) {
+                    var covering = overlap.covered_by.map(function(route) { return escapeHTML(route.prefix)+" ("+routers_label(route.serving)+")" }).join(", ")
+                    var outcome  = overlap.serving.length ? "It takes precedence for its addresses." : "It is not enabled, so its addresses go to the wider route."
+                    html += `<li><b>${escapeHTML(overlap.prefix)}</b> (${routers_label(overlap.serving)}) is inside ${covering}.  ${outcome}</li>`
+                })
+                html += "</ul>"
+            }
+            container.innerHTML = html
+        }
+    })
+}
+
 //-----------------------------------------------------------
 // Settings Page Actions
 //-----------------------------------------------------------
@@ -225,26 +302,28 @@ function load_modal_rename_user(user_id, old_name) {
     modal_body    = document.getElementById('modal_content');
     modal_confirm = document.getElementById('modal_confirm');
 
-    modal_title.innerHTML = "Rename user '"+old_name+"'?"
+    modal_title.innerHTML = "Rename user '"+escapeHTML(old_name)+"'?"
     body_html = `
     <ul class="collection">
         <li class="collection-item avatar">
             <i class="material-icons circle">language</i>
             <span class="title">Information</span>
-            <p>You are about to rename the user '${old_name}'</p>
+            <p>You are about to rename the user '${escapeHTML(old_name)}'</p>
         </li>
     </ul>
     <h6>New Name</h6>
     <div class="input-field">
         <i class="material-icons prefix">language</i>
-        <input value='${old_name}' id="new_user_name_form" type="text" data-length="32">
+        <input value='${escapeAttribute(old_name)}' id="new_user_name_form" type="text" data-length="32">
     </div>
     `
 
     modal_body.innerHTML = body_html
     $(document).ready(function() { $('input#new_user_name_form').characterCounter(); });    
 
-    modal_confirm.setAttribute('onclick', 'rename_user('+user_id+', "'+old_name+'")')
+    // The name goes through data-user, so quotes in it can't break the handler
+    modal_confirm.dataset.user = old_name
+    modal_confirm.setAttribute('onclick', 'rename_user('+user_id+', this.dataset.user)')
 }
 
 function load_modal_delete_user(user_id, user_name) {
@@ -258,18 +337,19 @@ function load_modal_delete_user(user_id, user_name) {
     modal_body    = document.getElementById('modal_content');
     modal_confirm = document.getElementById('modal_confirm');
 
-    modal_title.innerHTML = "Delete user '"+user_name+"'?"
+    modal_title.innerHTML = "Delete user '"+escapeHTML(user_name)+"'?"
     body_html = `
     <ul class="collection">
         <li class="collection-item avatar">
             <i class="material-icons circle red">warning</i>
             <span class="title">Warning</span>
-            <p>Are you sure you want to delete the user '${user_name}'?</p>
+            <p>Are you sure you want to delete the user '${escapeHTML(user_name)}'?</p>
         </li>
     </ul>
     `
     modal_body.innerHTML = body_html
-    modal_confirm.setAttribute('onclick', 'delete_user("'+user_id+'", "'+user_name+'")')
+    modal_confirm.dataset.user = user_name
+    modal_confirm.setAttribute('onclick', 'delete_user("'+user_id+'", this.dataset.user)')
 }
 
 function load_modal_add_preauth_key(user_name) {
@@ -283,7 +363,7 @@ function load_modal_add_preauth_key(user_name) {
     modal_body    = document.getElementById('modal_content');
     modal_confirm = document.getElementById('modal_confirm');
 
-    modal_title.innerHTML = "Adding a PreAuth key to '"+user_name+"'"
+    modal_title.innerHTML = "Adding a PreAuth key to '"+escapeHTML(user_name)+"'"
     body_html = `
         <ul class="collection">
             <li class="collection-item avatar">
@@ -320,7 +400,8 @@ function load_modal_add_preauth_key(user_name) {
     // Init the date picker
     M.Datepicker.init(document.querySelector('.datepicker'), {format:'yyyy-mm-dd'});
 
-    modal_confirm.setAttribute('onclick', 'add_preauth_key("'+user_name+'")')
+    modal_confirm.dataset.user = user_name
+    modal_confirm.setAttribute('onclick', 'add_preauth_key(this.dataset.user)')
 }
 
 function load_modal_expire_preauth_key(user_name, key) {
@@ -345,7 +426,9 @@ function load_modal_expire_preauth_key(user_name, key) {
     </ul>
     `
     modal_body.innerHTML = body_html
-    modal_confirm.setAttribute('onclick', 'expire_preauth_key("'+user_name+'", "'+key+'")')
+    modal_confirm.dataset.user = user_name
+    modal_confirm.dataset.key  = key
+    modal_confirm.setAttribute('onclick', 'expire_preauth_key(this.dataset.user, this.dataset.key)')
 }
 
 function load_modal_move_machine(machine_id) {
@@ -356,13 +439,12 @@ function load_modal_move_machine(machine_id) {
 
     var data = {"id": machine_id}
     $.ajax({
-        type: "POST", 
+        type: "GET", 
         url: "api/machine_information",
-        data: JSON.stringify(data),
-        contentType: "application/json",
+        data: data,
         success: function(headscale) {
             $.ajax({
-                type: "POST", 
+                type: "GET", 
                 url: "api/get_users",
                 success: function(response) {
                     modal         = document.getElementById('card_modal');
@@ -424,10 +506,9 @@ function load_modal_delete_machine(machine_id) {
 
     var data = {"id": machine_id}
     $.ajax({
-        type: "POST", 
+        type: "GET", 
         url: "api/machine_information",
-        data: JSON.stringify(data),
-        contentType: "application/json",
+        data: data,
         success: function(response) {
             modal         = document.getElementById('card_modal');
             modal_title   = document.getElementById('modal_title');
@@ -474,10 +555,9 @@ function load_modal_rename_machine(machine_id) {
     document.getElementById('modal_confirm').innerText = "Rename"
     var data = {"id": machine_id}
     $.ajax({
-        type: "POST", 
+        type: "GET", 
         url: "api/machine_information",
-        data: JSON.stringify(data),
-        contentType: "application/json",
+        data: data,
         success: function(response) {
             modal         = document.getElementById('card_modal');
             modal_title   = document.getElementById('modal_title');
@@ -524,7 +604,7 @@ function load_modal_rename_machine(machine_id) {
 
 function load_modal_add_machine() {
     $.ajax({
-        type: "POST", 
+        type: "GET", 
         url: "api/get_users",
         success: function(response) {
             modal_body = document.getElementById('default_add_new_machine_modal');
@@ -668,7 +748,8 @@ function rename_machine(machine_id) {
                 modal_element = document.getElementById('card_modal')
                 M.Modal.getInstance(modal_element).close()
 
-                document.getElementById(machine_id+'-name-container').innerHTML = machine_id+". "+ escapeHTML(new_name)
+                if (machines_table.active) { load_machines_table() }
+                else { document.getElementById(machine_id+'-name-container').innerHTML = machine_id+". "+ escapeHTML(new_name) }
                 M.toast({html: 'Machine '+machine_id+' renamed to '+ escapeHTML(new_name)});
             } else { 
                 load_modal_generic("error", "Error setting the machine name", "Headscale response:  "+JSON.stringify(response.body.message))
@@ -691,12 +772,15 @@ function move_machine(machine_id) {
             modal_element = document.getElementById('card_modal')
             M.Modal.getInstance(modal_element).close()
 
-            document.getElementById(machine_id+'-user-container').innerHTML = response.machine.user.name
-            document.getElementById(machine_id+'-ns-badge').innerHTML = response.machine.user.name
+            if (machines_table.active) { load_machines_table() }
+            else {
+                document.getElementById(machine_id+'-user-container').innerHTML = response.machine.user.name
+                document.getElementById(machine_id+'-ns-badge').innerHTML = response.machine.user.name
 
-            // Get the color and set it
-            var user_color = get_color(response.machine.user.id)
-            document.getElementById(machine_id+'-ns-badge').className = "badge ipinfo " + user_color + " white-text hide-on-small-only"
+                // Get the color and set it
+                var user_color = get_color(response.machine.user.id)
+                document.getElementById(machine_id+'-ns-badge').className = "badge ipinfo " + user_color + " white-text hide-on-small-only"
+            }
 
             M.toast({html:  "'"+response.machine.givenName+"' moved to user "+response.machine.user.name});
         }
@@ -715,8 +799,9 @@ function delete_machine(machine_id) {
             modal_element = document.getElementById('card_modal')
             M.Modal.getInstance(modal_element).close()
 
-            // When the machine is deleted, hide its collapsible:
-            document.getElementById(machine_id+'-main-collapsible').className = "collapsible popout hide";
+            // When the machine is deleted, hide its collapsible (or reload the table rows):
+            if (machines_table.active) { load_machines_table() }
+            else { document.getElementById(machine_id+'-main-collapsible').className = "collapsible popout hide"; }
 
             M.toast({html: 'Machine deleted.'});
         }
@@ -768,6 +853,729 @@ function btn_toggle(state) {
     else                  { document.getElementById('new_machine_modal_confirm').className = 'green btn-flat white-text hide' }
 }
 
+//-----------------------------------------------------------
+// Machine Page Table View
+//-----------------------------------------------------------
+// Rows are fetched one page at a time from api/machines_table and only the
+// rows inside the viewport (plus a small overscan) are kept in the DOM.
+var machines_table = {
+    row_height: 48,
+    page_size:  100,
+    overscan:   10,
+    total:      0,
+    sort:       "lastSeen",
+    order:      "desc",
+    query:      "",
+    pages:      {},
+    pending:    {},
+    active:     false
+}
+
+function load_machines_table(sort, order) {
+    if (sort)  { machines_table.sort  = sort  }
+    if (order) { machines_table.order = order }
+    machines_table.pages   = {}
+    machines_table.pending = {}
+    machines_table.active  = true
+
+    var viewport = document.getElementById('machines-table-viewport')
+    viewport.onscroll = machines_table_render
+    machines_table_sort_icons()
+    machines_table_fetch(Math.floor(viewport.scrollTop / machines_table.row_height / machines_table.page_size))
+}
+
+function machines_table_fetch(page) {
+    if (page in machines_table.pages || page in machines_table.pending) { return }
+    machines_table.pending[page] = true
+    var data = {"offset": page * machines_table.page_size, "limit": machines_table.page_size, "sort": machines_table.sort, "order": machines_table.order, "query": machines_table.query}
+    var sort = machines_table.sort
+    var order = machines_table.order
+    var query = machines_table.query
+
+    $.ajax({
+        type:"POST", 
+        url: "api/machines_table",
+        data: JSON.stringify(data),
+        contentType: "application/json",
+        success: function(response) {
+            // Drop responses for a sort order or search that is no longer displayed
+            if (sort != machines_table.sort || order != machines_table.order || query != machines_table.query) { return }
+            delete machines_table.pending[page]
+            machines_table.pages[page] = response.rows
+            machines_table.total       = response.total
+            document.getElementById('machines-table-spacer').style.height = (machines_table.total * machines_table.row_height)+"px"
+            document.getElementById('machines-search-status').innerText = machines_table.query ? machines_table.total+" machines found." : ""
+            machines_table_render()
+        }
+    })
+}
+
+function machines_table_row(row) {
+    var name = escapeHTML(row.given_name)
+    var user = escapeHTML(row.user)
+    var checked = machine_selection.has(String(row.id)) ? "checked" : ""
+    return `<div class="machine-table-row" id="${row.id}-main-collapsible">
+                <span class="machine-table-select"><label class="machine-select"><input type="checkbox" class="filled-in" autocomplete="off" data-machine="${row.id}" onchange="select_machine(${row.id}, this.checked)" ${checked}><span></span></label></span>
+                <span class="machine-table-status"><i class="material-icons tiny ${row.status_color}">fiber_manual_record</i></span>
+                <span class="machine-table-name"   id="${row.id}-name-container" title="${escapeHTML(row.hostname)}">${row.id}. ${name}</span>
+                <span class="machine-table-user"><span class="badge ipinfo ${row.user_color} white-text" id="${row.id}-ns-badge">${user}</span><span class="hide" id="${row.id}-user-container">${user}</span></span>
+                <span class="machine-table-ips">${row.ip_addresses.map(escapeHTML).join(", ")}</span>
+                <span class="machine-table-seen">${row.last_seen}</span>
+                <span class="machine-table-expiry">${row.expiry}</span>
+                <span class="machine-table-actions">
+                    <a class="btn-flat btn-small modal-trigger" href="#card_modal" onclick="load_modal_rename_machine(${row.id})"><i class="material-icons">edit</i></a>
+                    <a class="btn-flat btn-small modal-trigger" href="#card_modal" onclick="load_modal_move_machine(${row.id})"><i class="material-icons">swap_horiz</i></a>
+                    <a class="btn-flat btn-small modal-trigger" href="#card_modal" onclick="load_modal_delete_machine(${row.id})"><i class="material-icons">delete</i></a>
+                </span>
+            </div>`
+}
+
+function machines_table_render() {
+    var viewport = document.getElementById('machines-table-viewport')
+    var height   = machines_table.row_height
+    var first    = Math.max(Math.floor(viewport.scrollTop / height) - machines_table.overscan, 0)
+    var last     = Math.min(Math.ceil((viewport.scrollTop + viewport.clientHeight) / height) + machines_table.overscan, machines_table.total)
+
+    var html = ""
+    for (var index = first; index < last; index++) {
+        var page = Math.floor(index / machines_table.page_size)
+        var rows = machines_table.pages[page]
+        if (!rows) { machines_table_fetch(page); continue }
+        var row = rows[index - page * machines_table.page_size]
+        if (row) { html += machines_table_row(row) }
+    }
+    var container = document.getElementById('machines-table-rows')
+    container.style.top = (first * height)+"px"
+    container.innerHTML = html
+}
+
+function sort_machines_table(column) {
+    // Clicking the current column flips the order, a new column starts descending
+    var order = "desc"
+    if (column == machines_table.sort && machines_table.order == "desc") { order = "asc" }
+    document.getElementById('machines-table-viewport').scrollTop = 0
+    load_machines_table(column, order)
+}
+
+function machines_table_sort_icons() {
+    ["name", "user", "lastSeen", "expiry"].forEach(function(column) {
+        var icon = document.getElementById('sort-'+column)
+        if (column != machines_table.sort) { icon.innerHTML = ""                   }
+        else if (machines_table.order == "desc") { icon.innerHTML = "arrow_downward" }
+        else                                     { icon.innerHTML = "arrow_upward"   }
+    })
+}
+
+//-----------------------------------------------------------
+// Machine Page Search
+//-----------------------------------------------------------
+// Queries go to the server's search index.  The table view filters its rows, the card
+// views swap the full card list for the rendered cards of the matches.  The full list is
+// taken out of the document meanwhile, so element IDs stay unique.
+var machine_search = {query: "", timer: null, all: null}
+
+function search_machines(query) {
+    clearTimeout(machine_search.timer)
+    machine_search.timer = setTimeout(function() { run_machine_search(query.trim()) }, 200)
+}
+
+function run_machine_search(query) {
+    if (query == machine_search.query) { return }
+    machine_search.query = query
+    var status = document.getElementById('machines-search-status')
+
+    if (machines_table.active) {
+        machines_table.query = query
+        document.getElementById('machines-table-viewport').scrollTop = 0
+        load_machines_table()
+        return
+    }
+
+    var results = document.getElementById('machines-search-results')
+    machine_search.all = machine_search.all || document.getElementById('machines-all')
+    if (query == "") {
+        results.innerHTML = ""
+        status.innerText  = ""
+        if (!machine_search.all.isConnected) { results.before(machine_search.all); sync_machine_checkboxes(machine_search.all) }
+        return
+    }
+
+    $.ajax({
+        type: "GET",
+        url: "api/search",
+        data: {"q": query},
+        success: function(response) {
+            // Drop responses for a query that has since changed
+            if (query != machine_search.query) { return }
+            machine_search.all.remove()
+            results.innerHTML = response.cards
+            var shown = results.querySelectorAll('.collapsible').length
+            if      (response.total == 0)    { status.innerText = "No machines found." }
+            else if (shown < response.total) { status.innerText = "Showing the first "+shown+" of "+response.total+" machines." }
+            else                             { status.innerText = response.total+" machines found." }
+            init_rendered_cards(results)
+            init_machine_chips(results)
+            sync_machine_checkboxes(results)
+        }
+    })
+}
+
+// Tag chips of server rendered cards.  The tags are in each chips element's data-chips.
+function init_machine_chips(container) {
+    container.querySelectorAll('.chips[data-chips]').forEach(function(element) {
+        var machine_id = element.dataset.machine
+        M.Chips.init(element, {
+            data: JSON.parse(element.dataset.chips),
+            onChipDelete() { delete_chip(machine_id, this.chipsData) },
+            onChipAdd()    { add_chip(machine_id,    this.chipsData) }
+        })
+    })
+}
+
+function sync_machine_checkboxes(container) {
+    container.querySelectorAll('input[data-machine]').forEach(function(box) { box.checked = machine_selection.has(box.dataset.machine) })
+}
+
+//-----------------------------------------------------------
+// Machine Page Bulk Actions
+//-----------------------------------------------------------
+// Machines are selected with the checkbox on each card or table row.  api/bulk/<action>
+// streams back one JSON line per Headscale call as it finishes, which drives the
+// progress bar and the list of failures in the modal.
+var machine_selection = new Set()
+// Machines with a failed call in the running bulk action.  They stay selected for a retry.
+var bulk_failed       = new Set()
+
+function select_machine(machine_id, selected) {
+    machine_id = String(machine_id)
+    if (selected) { machine_selection.add(machine_id)    }
+    else          { machine_selection.delete(machine_id) }
+    document.querySelectorAll('input[data-machine="'+machine_id+'"]').forEach(function(box) { box.checked = selected })
+
+    document.getElementById('bulk-count').innerText = machine_selection.size
+    document.querySelectorAll('.bulk-action').forEach(function(button) { button.classList.toggle('disabled', machine_selection.size == 0) })
+}
+
+// Selects every card on the page, or every row the table has loaded so far
+function select_all_machines(selected) {
+    if (machines_table.active) {
+        Object.values(machines_table.pages).forEach(function(rows) { rows.forEach(function(row) { select_machine(row.id, selected) }) })
+    }
+    document.querySelectorAll('input[data-machine]').forEach(function(box) { select_machine(box.dataset.machine, selected) })
+}
+
+function clear_machine_selection() {
+    Array.from(machine_selection).forEach(function(machine_id) { select_machine(machine_id, false) })
+    document.getElementById('machines-select-all').checked = false
+}
+
+function load_modal_bulk(action) {
+    var count         = machine_selection.size
+    var modal_title   = document.getElementById('modal_title')
+    var modal_body    = document.getElementById('modal_content')
+    var modal_confirm = document.getElementById('modal_confirm')
+    var destructive   = action == "delete" || action == "expire"
+
+    modal_confirm.className = (destructive ? "red" : "green")+" btn-flat white-text"
+    modal_confirm.innerText = {"move": "Move", "tags": "Save Tags", "routes": "Update Routes", "expire": "Expire", "delete": "Delete"}[action]
+    modal_confirm.setAttribute('onclick', 'run_bulk("'+action+'")')
+
+    var information = function(icon, color, title, text) {
+        return `<ul class="collection">
+            <li class="collection-item avatar">
+                <i class="material-icons circle ${color}">${icon}</i>
+                <span class="title">${title}</span>
+                <p>${text}</p>
+            </li>
+        </ul>`
+    }
+
+    switch (action) {
+        case "move":
+            modal_title.innerHTML = "Move "+count+" machines?"
+            modal_body.innerHTML  = loading()
+            $.ajax({
+                type: "GET",
+                url: "api/get_users",
+                success: function(response) {
+                    var select_html = `<h6>Select a User</h6><select id='bulk-user-select'>`
+                    for (let i=0; i < response.users.length; i++) {
+                        var name = escapeHTML(response["users"][i]["name"])
+                        select_html = select_html+`<option value="${name}">${name}</option>`
+                    }
+                    select_html = select_html+`</select>`
+                    modal_body.innerHTML = information("language", "", "Information", "You are about to move "+count+" machines to a new user.")+select_html
+                    M.FormSelect.init(modal_body.querySelectorAll('select'))
+                }
+            })
+            break
+        case "tags":
+            modal_title.innerHTML = "Change the tags of "+count+" machines?"
+            modal_body.innerHTML  = information("label", "", "Information", "Tags are separated by commas.  Spaces will be replaced with a dash (-).")+`
+            <select id='bulk-tags-mode'>
+                <option value="add">Add these tags</option>
+                <option value="remove">Remove these tags</option>
+                <option value="set">Replace all tags with these</option>
+            </select>
+            <div class="input-field"><input id="bulk-tags-field" type="text"><label for="bulk-tags-field">Tags</label></div>`
+            M.FormSelect.init(modal_body.querySelectorAll('select'))
+            break
+        case "routes":
+            modal_title.innerHTML = "Update the routes of "+count+" machines?"
+            modal_body.innerHTML  = information("directions", "", "Information", "Every advertised route of the selected machines will be changed.")+`
+            <select id='bulk-routes-state'>
+                <option value="enable">Enable all routes</option>
+                <option value="disable">Disable all routes</option>
+            </select>`
+            M.FormSelect.init(modal_body.querySelectorAll('select'))
+            break
+        case "expire":
+            modal_title.innerHTML = "Expire "+count+" machines?"
+            modal_body.innerHTML  = information("warning", "red", "Warning", "Are you sure you want to expire "+count+" machines?  They will have to log in again.")
+            break
+        case "delete":
+            modal_title.innerHTML = "Delete "+count+" machines?"
+            modal_body.innerHTML  = information("warning", "red", "Warning", "Are you sure you want to delete "+count+" machines?")
+            break
+    }
+}
+
+// The action-specific fields of the request, read from the modal
+function bulk_payload(action) {
+    switch (action) {
+        case "move":   return {"user": document.getElementById('bulk-user-select').value}
+        case "tags":   return {"mode": document.getElementById('bulk-tags-mode').value, "tags": document.getElementById('bulk-tags-field').value.split(",")}
+        case "routes": return {"enabled": document.getElementById('bulk-routes-state').value == "enable"}
+        default:       return {}
+    }
+}
+
+function run_bulk(action) {
+    var data = Object.assign({"ids": Array.from(machine_selection)}, bulk_payload(action))
+    bulk_failed.clear()
+
+    document.getElementById('modal_confirm').className = "hide"
+    document.getElementById('modal_content').innerHTML = `
+        <div class="progress"><div class="determinate" id="bulk-progress" style="width: 0%"></div></div>
+        <p id="bulk-status">Starting...</p>
+        <ul class="collection hide" id="bulk-failures"></ul>`
+
+    fetch("api/bulk/"+action, {method: "POST", headers: {"Content-Type": "application/json"}, body: JSON.stringify(data)})
+    .then(function(response) {
+        if (!response.ok) {
+            return response.json().then(function(error) { document.getElementById('bulk-status').innerText = error.body.message })
+        }
+        // A line can be split across chunks, so whatever follows the last newline waits for the next one
+        var reader  = response.body.getReader()
+        var decoder = new TextDecoder()
+        var buffer  = ""
+        function read() {
+            return reader.read().then(function(chunk) {
+                if (chunk.done) { return }
+                buffer += decoder.decode(chunk.value, {stream: true})
+                var lines = buffer.split("\n")
+                buffer    = lines.pop()
+                lines.forEach(function(line) { if (line) { bulk_progress(action, JSON.parse(line)) } })
+                return read()
+            })
+        }
+        return read()
+    })
+    .catch(function(error) { document.getElementById('bulk-status').innerText = "Bulk "+action+" failed:  "+error })
+}
+
+// Hides a deleted machine's card.  While search results are shown, the full card list is
+// detached from the document (see run_machine_search), so it's looked up there too.
+// A machine that isn't in the current results has no card in the document.
+function hide_machine_card(machine_id) {
+    var card_id = machine_id+'-main-collapsible'
+    var cards   = [document.getElementById(card_id)]
+    if (machine_search.all && !machine_search.all.isConnected) { cards.push(machine_search.all.querySelector('#'+CSS.escape(card_id))) }
+    cards.forEach(function(card) { if (card) { card.classList.add('hide') } })
+}
+
+function bulk_progress(action, event) {
+    var status = document.getElementById('bulk-status')
+    switch (event.type) {
+        case "start":
+            status.innerText = event.total == 0 ? "Nothing to change." : "0 of "+event.total+" done"
+            break
+        case "item":
+            document.getElementById('bulk-progress').style.width = (100 * event.done / event.total)+"%"
+            status.innerText = event.done+" of "+event.total+" done"
+            if (event.ok) {
+                if (action == "delete" && !machines_table.active) { hide_machine_card(event.id) }
+                if (!bulk_failed.has(event.id)) { select_machine(event.id, false) }
+            } else {
+                bulk_failed.add(event.id)
+                select_machine(event.id, true)
+                var failures = document.getElementById('bulk-failures')
+                var route    = event.prefix ? " ("+escapeHTML(event.prefix)+")" : ""
+                failures.classList.remove('hide')
+                failures.insertAdjacentHTML('beforeend', `<li class="collection-item"><b>Machine ${escapeHTML(event.id)}${route}:</b>  ${escapeHTML(event.error)}</li>`)
+            }
+            break
+        case "done":
+            document.getElementById('bulk-progress').style.width = "100%"
+            status.innerText = event.succeeded+" succeeded, "+event.failed+" failed."
+            M.toast({html: 'Bulk '+action+':  '+event.succeeded+' succeeded, '+event.failed+' failed.'})
+
+            // The table reloads its rows.  Cards are re-rendered by reloading the page once the results are read.
+            var modal_confirm = document.getElementById('modal_confirm')
+            modal_confirm.className = "green btn-flat white-text"
+            modal_confirm.innerText = "Done"
+            if (machines_table.active) { load_machines_table() }
+            if (machines_table.active || action == "delete") { modal_confirm.setAttribute('onclick', "M.Modal.getInstance(document.getElementById('card_modal')).close()") }
+            else                                             { modal_confirm.setAttribute('onclick', 'window.location.reload()') }
+            break
+    }
+}
+
+//-----------------------------------------------------------
+// Client-side Rendering
+//-----------------------------------------------------------
+// Used when CLIENT_RENDERING is enabled.  Cards are built here from the compact
+// records served by api/v1/machines and api/v1/users, instead of on the server.
+// The helpers below mirror helper.py and timeutil.py so both renderers agree.
+var day_names = ["Sunday", "Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday"]
+
+function get_text_color(id) {
+    var colors = [
+        "red-text         text-lighten-1",
+        "teal-text        text-lighten-1",
+        "blue-text        text-lighten-1",
+        "blue-grey-text   text-lighten-1",
+        "indigo-text      text-lighten-2",
+        "green-text       text-lighten-1",
+        "deep-orange-text text-lighten-1",
+        "yellow-text      text-lighten-2",
+        "purple-text      text-lighten-2",
+        "indigo-text      text-lighten-2",
+        "brown-text       text-lighten-1",
+        "grey-text        text-lighten-1"
+    ];
+    return colors[id % colors.length]
+}
+
+// Splits a number of seconds the way Python's timedelta does (days can be negative, seconds can't)
+function split_duration(total) {
+    var days    = Math.floor(total / 86400)
+    var seconds = total - days * 86400
+    return {days: days, hours: Math.floor(seconds / 3600), mins: Math.floor((seconds % 3600) / 60), secs: seconds % 60}
+}
+
+function pretty_print_duration(total, delta_type) {
+    var d     = split_duration(total)
+    // Whole hours including the days, as in helper.py.  Only differs for a negative duration,
+    // where it keeps a past expiry from reading "in 23 hours".
+    var hours = d.days * 24 + d.hours
+    if (delta_type == "expiry") {
+        if (d.days  > 730) { return "in greater than two years" }
+        if (d.days  > 365) { return "in greater than a year" }
+        if (d.days  > 0  ) { return d.days  > 1 ? "in "+d.days +" days"    : "in "+d.days +" day"    }
+        if (hours   > 0  ) { return hours   > 1 ? "in "+hours  +" hours"   : "in "+hours  +" hour"   }
+        if (d.mins  > 0  ) { return d.mins  > 1 ? "in "+d.mins +" minutes" : "in "+d.mins +" minute" }
+        return "in "+d.secs+" seconds"
+    }
+    if (d.days  > 730) { return "over two years ago" }
+    if (d.days  > 365) { return "over a year ago" }
+    if (d.days  > 0  ) { return d.days  > 1 ? d.days +" days ago"    : d.days +" day ago"    }
+    if (hours   > 0  ) { return hours   > 1 ? hours  +" hours ago"   : hours  +" hour ago"   }
+    if (d.mins  > 0  ) { return d.mins  > 1 ? d.mins +" minutes ago" : d.mins +" minute ago" }
+    return d.secs+" seconds ago"
+}
+
+function text_color_duration(total) {
+    var d     = split_duration(total)
+    var hours = d.days * 24 + d.hours
+    if (d.days > 30) { return "grey-text                      " }
+    if (d.days > 14) { return "red-text         text-darken-2 " }
+    if (d.days >  1) { return "deep-orange-text text-lighten-1" }
+    if (hours  > 12) { return "orange-text                    " }
+    if (hours  >  1) { return "orange-text      text-lighten-2" }
+    if (hours == 1)  { return "yellow-text                    " }
+    if (d.mins > 15) { return "yellow-text      text-lighten-2" }
+    if (d.mins >  5) { return "green-text       text-lighten-3" }
+    if (d.secs > 30) { return "green-text       text-lighten-2" }
+    return "green-text                     "
+}
+
+// Date parts of an epoch timestamp in the server's timezone
+function local_time(timestamp, timezone) {
+    var parts = {}
+    new Intl.DateTimeFormat("en-US", {
+        timeZone: timezone, hourCycle: "h23",
+        year: "numeric", month: "2-digit", day: "2-digit", hour: "2-digit", minute: "2-digit", second: "2-digit", weekday: "long"
+    }).formatToParts(new Date(timestamp * 1000)).forEach(function(part) { parts[part.type] = part.value })
+    return parts
+}
+
+// Same format as timeutil.RenderContext.absolute:  "Monday 01/02/2023, 15:04:05 UTC"
+function format_absolute(timestamp, timezone) {
+    var t = local_time(timestamp, timezone)
+    return t.weekday+" "+t.month+"/"+t.day+"/"+t.year.padStart(4, "0")+", "+t.hour+":"+t.minute+":"+t.second+" "+timezone
+}
+
+// Unset timestamps (null) are shown as "N/A" and colored as long ago
+function format_since(timestamp, data) {
+    if (timestamp == null) { return {delta: Infinity, relative: "N/A", text: "N/A"} }
+    var delta    = data.now - timestamp
+    var relative = pretty_print_duration(delta)
+    return {delta: delta, relative: relative, text: format_absolute(timestamp, data.timezone)+" ("+relative+")"}
+}
+
+function format_until(timestamp, data) {
+    var delta    = timestamp - data.now
+    var relative = pretty_print_duration(delta, "expiry")
+    return {delta: delta, relative: relative, text: format_absolute(timestamp, data.timezone)+" ("+relative+")"}
+}
+
+function render_machine_routes(routes) {
+    if (!routes.some(function(route) { return route.advertised })) { return "" }
+    var html = [`<li class="collection-item avatar">
+                    <i class="material-icons circle">directions</i>
+                    <span class="title">Routes</span>
+                    <p><div>`]
+    routes.forEach(function(route) {
+        var color   = route.enabled ? "green"   : "red"
+        var tooltip = route.enabled ? "disable" : "enable"
+        var state   = route.enabled ? "True"    : "False"
+        html.push(`<p class='waves-effect waves-light btn-small ${color} lighten-2 tooltipped' data-position='top' data-tooltip='Click to ${tooltip}'
+                    id='${route.id}' onclick="toggle_route(${route.id}, '${state}')">${escapeHTML(route.prefix)}</p>`)
+    })
+    html.push("</div></p></li>")
+    return html.join("")
+}
+
+function render_machine_card(machine, user, routes, data) {
+    var id        = machine.id
+    var name      = escapeHTML(machine.name)
+    var user_name = escapeHTML(user.name)
+    var exit_node = routes.some(function(route) { return route.enabled && (route.prefix == "0.0.0.0/0" || route.prefix == "::/0") })
+
+    var last_seen   = format_since(machine.last_seen,   data)
+    var last_update = format_since(machine.last_update, data)
+    var created     = format_since(machine.created,     data)
+
+    var expiry_time   = "No expiration date."
+    var expiring_soon = false
+    if (machine.expiry != null) {
+        var expiry = format_until(machine.expiry, data)
+        var year   = parseInt(local_time(machine.expiry, data.timezone).year)
+        var days   = split_duration(expiry.delta).days
+        if (year > parseInt(local_time(data.now, data.timezone).year) + 2) {
+            var local   = local_time(machine.expiry, data.timezone)
+            expiry_time = local.month+"/"+local.year+" "+data.timezone+" ("+expiry.relative+")"
+        } else { expiry_time = expiry.text }
+        if (year == 9999) { expiry_time = "No expiration date." }
+        expiring_soon = days < 14 && days > 0
+    }
+
+    var status_badge     = `<i class='material-icons left tooltipped ${text_color_duration(last_seen.delta)}' data-position='top' data-tooltip='Last Seen:  ${last_seen.relative}' id='${id}-status'>fiber_manual_record</i>`
+    var user_badge       = `<span class='badge ipinfo ${get_color(user.id)} white-text hide-on-small-only' id='${id}-ns-badge'>${user_name}</span>`
+    var exit_node_badge  = exit_node     ? "<span class='badge grey white-text text-lighten-4 tooltipped' data-position='left' data-tooltip='This machine has an enabled exit route.'>Exit Node</span>" : ""
+    var expiration_badge = expiring_soon ? "<span class='badge red white-text text-lighten-4 tooltipped' data-position='left' data-tooltip='This machine expires soon.'>Expiring!</span>" : ""
+    var machine_ips      = "<ul>"+machine.ips.map(function(ip) { return "<li>"+escapeHTML(ip)+"</li>" }).join("")+"</ul>"
+
+    return `<ul class="collapsible popout" id="${id}-main-collapsible">
+        <li>
+            <div class="collapsible-header">
+                <div class="col s8 m6">
+                    <label class='machine-select' onclick='event.stopPropagation()'><input type='checkbox' class='filled-in' autocomplete='off' data-machine='${id}' onchange='select_machine(${id}, this.checked)'><span></span></label>
+                    ${status_badge}
+                    <span class="truncate hover-container" id="${id}-name-container">${id}. ${name}</span>
+                </div>
+                <div class="col s4 m6 activator">${user_badge}${exit_node_badge}${expiration_badge}</div>
+            </div>
+            <div class="collapsible-body">
+                <ul class="collection">
+                    <li class="collection-item avatar">
+                        <i class="material-icons circle">settings</i>
+                        <span class="title">Machine Actions</span>
+                        <p>
+                            <a href="#card_modal" onclick='load_modal_rename_machine(${id})' class="modal-trigger waves-effect waves-light btn-small">Rename</a>
+                            <a href="#card_modal" onclick='load_modal_move_machine(${id})'   class="modal-trigger waves-effect waves-light btn-small">Move</a>
+                            <a href="#card_modal" onclick='load_modal_delete_machine(${id})' class="modal-trigger red waves-effect waves-light btn-small">Delete</a>
+                        </p>
+                    </li>
+                    <li class="collection-item avatar"><i class="material-icons circle">domain</i><span class="title">Hostname</span><p>${escapeHTML(machine.hostname)}</p></li>
+                    <li class="collection-item avatar"><i class="material-icons circle">language</i><span class="title">User</span><p id="${id}-user-container">${user_name}</p></li>
+                    <li class="collection-item avatar"><i class="material-icons circle">network_wifi</i><span class="title">IP Addresses</span><p>${machine_ips}</p></li>
+                    <li class="collection-item avatar"><i class="material-icons circle">access_time</i><span class="title">Last Seen</span><p id="${id}-last-seen">${last_seen.text}</p></li>
+                    <li class="collection-item avatar"><i class="material-icons circle">update</i><span class="title">Last Update</span><p>${last_update.text}</p></li>
+                    <li class="collection-item avatar"><i class="material-icons circle">history</i><span class="title">Created At</span><p>${created.text}</p></li>
+                    <li class="collection-item avatar"><i class="material-icons circle">hourglass_empty</i><span class="title">Expiration</span><p id="${id}-expiry">${expiry_time}</p></li>
+                    <li class="collection-item avatar"><i class="material-icons circle">key</i><span class="title">PreAuth Key Prefix</span><p>${machine.preauth_key == null ? "None" : escapeHTML(machine.preauth_key)}</p></li>
+                    ${render_machine_routes(routes)}
+                    <li class="collection-item avatar">
+                        <i class="material-icons circle tooltipped" data-position="right" data-tooltip="Spaces will be replaced with a dash (-) upon page refresh">label</i>
+                        <span class="title">Tags</span>
+                        <p><div style='margin: 0px' class='chips' id='${id}-tags'></div></p>
+                    </li>
+                </ul>
+            </div>
+        </li>
+    </ul>`
+}
+
+// Materialize components have to be initialized on cards added after page load
+function init_rendered_cards(container) {
+    M.Collapsible.init(container.querySelectorAll('.collapsible'))
+    M.Tooltip.init(container.querySelectorAll('.tooltipped'))
+}
+
+function load_machines_cards() {
+    var container = document.getElementById('machines-cards')
+    container.innerHTML = loading()
+    $.ajax({
+        type: "GET",
+        url: "api/v1/machines",
+        success: function(data) {
+            var users  = {}
+            var routes = {}
+            data.users.forEach(function(user) { users[user.id] = user })
+            data.routes.forEach(function(route) { (routes[route.machine] = routes[route.machine] || []).push(route) })
+
+            container.innerHTML = data.machines.map(function(machine) {
+                return render_machine_card(machine, users[machine.user], routes[machine.id] || [], data)
+            }).join("")
+            init_rendered_cards(container)
+            data.machines.forEach(function(machine) {
+                M.Chips.init(document.getElementById(machine.id+'-tags'), {
+                    data: machine.tags.map(function(tag) { return {tag: tag} }),
+                    onChipDelete() { delete_chip(machine.id, this.chipsData) },
+                    onChipAdd()    { add_chip(machine.id,    this.chipsData) }
+                })
+            })
+        }
+    })
+}
+
+// User names and keys are passed to the onclick handlers through data-* attributes, so
+// quotes in them can't break the handler
+function render_preauth_key_table(user_name, keys, data) {
+    var name = escapeAttribute(user_name)
+    var html = [`<li class="collection-item avatar">
+            <span class='badge grey lighten-2 btn-small' onclick='toggle_expired()'>Toggle Expired</span>
+            <span href="#card_modal" class='badge grey lighten-2 btn-small modal-trigger' data-user="${name}" onclick="load_modal_add_preauth_key(this.dataset.user)">Add PreAuth Key</span>
+            <i class="material-icons circle">vpn_key</i>
+            <span class="title">PreAuth Keys</span>`]
+    if (keys.length == 0) { html.push("<p>No keys defined for this user</p>") }
+    else {
+        html.push(`<table class="responsive-table striped" id='${name}-preauthkey-table'>
+                    <thead><tr>
+                        <td>ID</td>
+                        <td class='tooltipped' data-tooltip='Click an Auth Key Prefix to copy it to the clipboard'>Key Prefix</td>
+                        <td><center>Reusable</center></td>
+                        <td><center>Used</center></td>
+                        <td><center>Ephemeral</center></td>
+                        <td><center>Usable</center></td>
+                        <td><center>Actions</center></td>
+                    </tr></thead>`)
+    }
+    keys.forEach(function(key) {
+        var expired = key.expiration < data.now
+        var usable  = (key.reusable && !expired) || (!key.reusable && !key.used && !expired)
+        var dot     = function(show, color) { return show ? `<i class='pulse material-icons tiny ${color}-text text-darken-1'>fiber_manual_record</i>` : "" }
+        var expire  = usable ? `<span href='#card_modal' data-tooltip='Expire this PreAuth Key' class='btn-small modal-trigger badge tooltipped white-text red' data-user="${name}" data-key="${escapeAttribute(key.key)}" onclick='load_modal_expire_preauth_key(this.dataset.user, this.dataset.key)'>Expire</span>` : ""
+        html.push(`<tr id='${key.id}-${name}-tr' class='${usable ? "" : "expired-row"}'>
+                <td>${key.id}</td>
+                <td data-key="${escapeAttribute(key.key)}" onclick='copy_preauth_key(this.dataset.key)' class='tooltipped' data-tooltip='Expiration:  ${format_absolute(key.expiration, data.timezone)}'>${escapeHTML(key.key.substring(0, 10))}</td>
+                <td><center>${dot(key.reusable,  "blue")}</center></td>
+                <td><center>${dot(key.used,      "yellow")}</center></td>
+                <td><center>${dot(key.ephemeral, "red")}</center></td>
+                <td><center>${dot(usable,        "green")}</center></td>
+                <td><center>${expire}</center></td>
+            </tr>`)
+    })
+    html.push("</table></li>")
+    return html.join("")
+}
+
+function render_user_card(user, keys, data) {
+    var id   = user.id
+    var name = escapeHTML(user.name)
+    return `<ul class="collapsible popout" id="${id}-main-collapsible">
+    <li>
+        <div class="collapsible-header">
+            <div class="col">
+                <i class='material-icons left ${get_text_color(id)}' id='${id}-status'>fiber_manual_record</i>
+                <span class="truncate hover-container" id="${id}-name-container">${id}. <span id="${id}-name-span">${name}</span></span>
+            </div>
+        </div>
+        <div class="collapsible-body">
+            <ul class="collection">
+                <li class="collection-item avatar">
+                    <i class="material-icons circle">settings</i>
+                    <span class="title">User Actions</span>
+                    <p>
+                        <a href="#card_modal" id="${id}-rename-user-lg" data-user="${escapeAttribute(user.name)}" onclick="load_modal_rename_user(${id}, this.dataset.user)" class="modal-trigger waves-effect waves-light btn-small">Rename</a>
+                        <a href="#card_modal" id="${id}-remove-user-lg" data-user="${escapeAttribute(user.name)}" onclick="load_modal_delete_user(${id}, this.dataset.user)" class="modal-trigger red waves-effect waves-light btn-small">Delete</a>
+                    </p>
+                </li>
+                <div id="${escapeAttribute(user.name)}-preauth-keys-collection">${render_preauth_key_table(user.name, keys, data)}</div>
+            </ul>
+        </div>
+    </li>
+</ul>`
+}
+
+function load_users_cards() {
+    var container = document.getElementById('users-cards')
+    container.innerHTML = loading()
+    $.ajax({
+        type: "GET",
+        url: "api/v1/users",
+        success: function(data) {
+            var keys = {}
+            data.preauth_keys.forEach(function(key) { (keys[key.user] = keys[key.user] || []).push(key) })
+
+            container.innerHTML = data.users.map(function(user) {
+                return render_user_card(user, keys[user.name] || [], data)
+            }).join("")
+            init_rendered_cards(container)
+        }
+    })
+}
+
+//-----------------------------------------------------------
+// Live Machine Status
+//-----------------------------------------------------------
+// The server pushes the machines whose status, expiry or routes changed and
+// their cards are patched in place.  EventSource reconnects on its own.
+function subscribe_machine_events() {
+    if (!window.EventSource) { return }
+    var source = new EventSource("api/events")
+    source.addEventListener("machines", function(event) {
+        var data = JSON.parse(event.data)
+        data.changed.forEach(patch_machine_card)
+        data.removed.forEach(function(machine_id) {
+            var card = document.getElementById(machine_id+'-main-collapsible')
+            if (card) { card.className = "collapsible popout hide" }
+        })
+    })
+}
+
+function patch_machine_card(machine) {
+    // Machines added since the page loaded have no card to patch
+    var status = document.getElementById(machine.id+'-status')
+    if (!status) { return }
+    status.className = "material-icons left tooltipped "+machine.status_color
+    status.setAttribute('data-tooltip', 'Last Seen:  '+machine.last_seen)
+    document.getElementById(machine.id+'-last-seen').innerHTML = machine.last_seen_text
+    document.getElementById(machine.id+'-expiry').innerHTML    = machine.expiry
+
+    // Same classes toggle_route() switches between
+    machine.routes.forEach(function(route) {
+        var element = document.getElementById(route.id)
+        if (!element) { return }
+        var state = route.enabled ? "True" : "False"
+        element.className = route.enabled ? "waves-effect waves-light btn-small green lighten-2 tooltipped" : "waves-effect waves-light btn-small red lighten-2 tooltipped"
+        element.setAttribute('data-tooltip', route.enabled ? "Click to disable" : "Click to enable")
+        element.setAttribute('onclick', 'toggle_route('+route.id+', "'+state+'")')
+    })
+}
+
 //-----------------------------------------------------------
 // User Page Actions
 //-----------------------------------------------------------
@@ -799,11 +1607,11 @@ function rename_user(user_id, old_name) {
                 // Rename the user on the page:
                 document.getElementById(user_id+'-name-span').innerHTML = escapeHTML(new_name)
 
-                // Set the button to use the NEW name as the OLD name for both buttons
-                var rename_button_sm = document.getElementById(user_id+'-rename-user-sm')
-                rename_button_sm.setAttribute('onclick', 'load_modal_rename_user('+user_id+', "'+new_name+'")')
-                var rename_button_lg = document.getElementById(user_id+'-rename-user-lg')
-                rename_button_lg.setAttribute('onclick', 'load_modal_rename_user('+user_id+', "'+new_name+'")')
+                // Set the buttons to use the NEW name, which they pass on from data-user
+                ['-rename-user-sm', '-rename-user-lg', '-remove-user-sm', '-remove-user-lg'].forEach(function(suffix) {
+                    var button = document.getElementById(user_id+suffix)
+                    if (button) { button.dataset.user = new_name }
+                })
 
                 // Send the completion toast
                 M.toast({html: "User '"+old_name+"' renamed to '"+new_name+"'."})
@@ -853,9 +1661,11 @@ function add_user() {
                 modal_element = document.getElementById('card_modal')
                 M.Modal.getInstance(modal_element).close()
 
-                // Send the completion toast
-                M.toast({html: "User '"+user_name+"' added to Headscale.  Refreshing..."})
-                window.location.reload()
+                // Add the new user's card instead of reloading the page
+                var container = document.getElementById('users-cards')
+                container.insertAdjacentHTML('beforeend', response.card)
+                M.Collapsible.init(container.lastElementChild)
+                M.toast({html: "User '"+escapeHTML(user_name)+"' added to Headscale."})
             } else { 
                 // We errored.  Decipher the error Headscale sent us and display it:
                 load_modal_generic("error", "Error adding  user", "Headscale response:  "+JSON.stringify(response.body.message))
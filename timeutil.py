@@ -0,0 +1,62 @@
+# pylint: disable=wrong-import-order
+
+import os, pytz, helper
+from collections import namedtuple
+from datetime    import datetime
+from functools   import lru_cache
+from dateutil    import parser
+
+# Day names for absolute timestamps.  Equivalent to strftime('%A') in the C locale.
+DAY_NAMES = ("Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday")
+
+def parse_timestamp(value):
+    """ Parses an RFC 3339 timestamp from Headscale.  Falls back to dateutil for anything fromisoformat rejects """
+    try:    return datetime.fromisoformat(value)
+    except ValueError: return parser.parse(value)
+
+@lru_cache(maxsize=None)
+def get_timezone(name=None):
+    """ Returns the pytz timezone for "name", or for $TZ.  Looked up once per name. """
+    if name is None: name = os.environ.get("TZ", "")
+    return pytz.timezone(name if name else "UTC")
+
+# local    = the timestamp converted to the render context's timezone
+# delta    = the time between "now" and the timestamp
+# relative = the delta in words, ie "5 minutes ago" or "in 3 days"
+# text     = the absolute timestamp followed by the relative one
+FormattedTime = namedtuple("FormattedTime", ("local", "delta", "relative", "text"))
+
+class RenderContext():
+    """ Time state for one request.  The timezone and "now" are computed once and shared by everything rendered. """
+    def __init__(self, timezone_name=None):
+        self.timezone      = get_timezone(timezone_name)
+        self.timezone_name = str(self.timezone)
+        self.now           = datetime.now(self.timezone)
+
+    def localize(self, value):
+        # Accepts a Headscale timestamp string or a datetime.  None means "now".
+        if value is None: return self.now
+        if isinstance(value, str): value = parse_timestamp(value)
+        return value.astimezone(self.timezone)
+
+    def absolute(self, local):
+        return (DAY_NAMES[local.weekday()]+" "+
+            f"{local.month:02}/{local.day:02}/{local.year:04}, {local.hour:02}:{local.minute:02}:{local.second:02} "+
+            self.timezone_name)
+
+    def since(self, value):
+        """ Formats a timestamp in the past, ie "lastSeen" """
+        local    = self.localize(value)
+        delta    = self.now - local
+        relative = helper.pretty_print_duration(delta)
+        return FormattedTime(local, delta, relative, self.absolute(local)+" ("+relative+")")
+
+    def until(self, value):
+        """ Formats a timestamp in the future, ie "expiry" """
+        local    = self.localize(value)
+        delta    = local - self.now
+        relative = helper.pretty_print_duration(delta, "expiry")
+        return FormattedTime(local, delta, relative, self.absolute(local)+" ("+relative+")")
+
+    def since_many(self, *values): return [self.since(value) for value in values]
+    def until_many(self, *values): return [self.until(value) for value in values]